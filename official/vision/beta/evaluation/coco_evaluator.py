@@ -27,6 +27,7 @@ See also: https://github.com/cocodataset/cocoapi/
 """
 
 import atexit
+import multiprocessing
 import tempfile
 # Import libraries
 from absl import logging
@@ -37,6 +38,54 @@ import tensorflow as tf
 
 from official.vision.beta.evaluation import coco_utils
 
+# the groundtruth and detection COCO objects of an evaluation worker
+_worker_coco = None
+
+
+def _init_eval_worker(coco_gt, coco_dt):
+  global _worker_coco
+  _worker_coco = (coco_gt, coco_dt)
+
+
+def _evaluate_categories(iou_type, image_ids, category_ids):
+  """Runs COCOeval evaluate and accumulate for some categories in a worker.
+
+  The precision and recall of a category only depend on the per image results
+  of that category, so they are the same as in a COCOeval of all the
+  categories.
+
+  Args:
+    iou_type: 'bbox' or 'segm'.
+    image_ids: the list of image ids to evaluate.
+    category_ids: the list of category ids to evaluate.
+
+  Returns:
+    a dictionary of the `precision`, `recall` and `scores` arrays of the
+    categories, in the order of `category_ids`.
+  """
+  coco_gt, coco_dt = _worker_coco
+  coco_eval = cocoeval.COCOeval(coco_gt, coco_dt, iouType=iou_type)
+  coco_eval.params.imgIds = image_ids
+  coco_eval.params.catIds = category_ids
+  coco_eval.evaluate()
+  coco_eval.accumulate()
+  return {key: coco_eval.eval[key] for key in ['precision', 'recall', 'scores']}
+
+
+def _shard_categories(coco_gt, coco_dt, category_ids, num_shards):
+  """Splits the categories into shards with similar numbers of annotations."""
+  sizes = [
+      len(coco_gt.catToImgs.get(i, [])) + len(coco_dt.catToImgs.get(i, []))
+      for i in category_ids
+  ]
+  shards = [[] for _ in range(min(num_shards, len(category_ids)))]
+  loads = np.zeros([len(shards)])
+  for index in np.argsort(sizes, kind='stable')[::-1]:
+    shard = np.argmin(loads)
+    shards[shard].append(category_ids[index])
+    loads[shard] += sizes[index]
+  return [sorted(shard) for shard in shards]
+
 
 class COCOEvaluator(object):
   """COCO evaluation metric class."""
@@ -45,7 +94,8 @@ class COCOEvaluator(object):
                annotation_file,
                include_mask,
                need_rescale_bboxes=True,
-               per_category_metrics=False):
+               per_category_metrics=False,
+               num_processes=0):
     """Constructs COCO evaluation class.
 
     The class provides the interface to COCO metrics_fn. The
@@ -62,6 +112,11 @@ class COCOEvaluator(object):
       need_rescale_bboxes: If true bboxes in `predictions` will be rescaled back
         to absolute values (`image_info` is needed in this case).
       per_category_metrics: Whether to return per category metrics.
+      num_processes: the number of processes COCOeval runs in. With more than
+        one, the categories are split across a process pool and the box and
+        mask evaluations run at the same time, the metrics are the same as
+        with one process. The workers are started by a forkserver rather than
+        forked from this multi-threaded TensorFlow process.
     """
     if annotation_file:
       if annotation_file.startswith('gs://'):
@@ -78,6 +133,7 @@ class COCOEvaluator(object):
     self._annotation_file = annotation_file
     self._include_mask = include_mask
     self._per_category_metrics = per_category_metrics
+    self._num_processes = num_processes
     self._metric_names = [
         'AP', 'AP50', 'AP75', 'APs', 'APm', 'APl', 'ARmax1', 'ARmax10',
         'ARmax100', 'ARs', 'ARm', 'ARl'
@@ -139,19 +195,25 @@ class COCOEvaluator(object):
     coco_dt = coco_gt.loadRes(predictions=coco_predictions)
     image_ids = [ann['image_id'] for ann in coco_predictions]
 
-    coco_eval = cocoeval.COCOeval(coco_gt, coco_dt, iouType='bbox')
-    coco_eval.params.imgIds = image_ids
-    coco_eval.evaluate()
-    coco_eval.accumulate()
-    coco_eval.summarize()
+    iou_types = ['bbox', 'segm'] if self._include_mask else ['bbox']
+    if self._num_processes > 1:
+      coco_evals = self._parallel_coco_eval(coco_gt, coco_dt, image_ids,
+                                            iou_types)
+    else:
+      coco_evals = []
+      for iou_type in iou_types:
+        coco_eval = cocoeval.COCOeval(coco_gt, coco_dt, iouType=iou_type)
+        coco_eval.params.imgIds = image_ids
+        coco_eval.evaluate()
+        coco_eval.accumulate()
+        coco_evals.append(coco_eval)
+    for coco_eval in coco_evals:
+      coco_eval.summarize()
+    coco_eval = coco_evals[0]
     coco_metrics = coco_eval.stats
 
     if self._include_mask:
-      mcoco_eval = cocoeval.COCOeval(coco_gt, coco_dt, iouType='segm')
-      mcoco_eval.params.imgIds = image_ids
-      mcoco_eval.evaluate()
-      mcoco_eval.accumulate()
-      mcoco_eval.summarize()
+      mcoco_eval = coco_evals[1]
       mask_coco_metrics = mcoco_eval.stats
 
     if self._include_mask:
@@ -173,6 +235,65 @@ class COCOEvaluator(object):
 
     return metrics_dict
 
+  def _parallel_coco_eval(self, coco_gt, coco_dt, image_ids, iou_types):
+    """Evaluates and accumulates shards of the categories in a process pool.
+
+    Args:
+      coco_gt: the groundtruth COCO object.
+      coco_dt: the detection COCO object.
+      image_ids: the list of image ids to evaluate.
+      iou_types: the list of COCOeval iou types.
+
+    Returns:
+      a list of accumulated cocoeval.COCOeval objects, one per iou type.
+    """
+    category_ids = sorted(coco_gt.getCatIds())
+    shards = _shard_categories(coco_gt, coco_dt, category_ids,
+                               self._num_processes)
+    # Forking a process with live TensorFlow threads can deadlock.
+    context = multiprocessing.get_context('forkserver')
+    with context.Pool(
+        self._num_processes,
+        initializer=_init_eval_worker,
+        initargs=(coco_gt, coco_dt)) as pool:
+      results = [[
+          pool.apply_async(_evaluate_categories, (iou_type, image_ids, shard))
+          for shard in shards
+      ] for iou_type in iou_types]
+
+      coco_evals = []
+      for iou_type, shard_results in zip(iou_types, results):
+        coco_eval = cocoeval.COCOeval(coco_gt, coco_dt, iouType=iou_type)
+        params = coco_eval.params
+        params.imgIds = list(np.unique(image_ids))
+        params.catIds = category_ids
+        params.maxDets = sorted(params.maxDets)
+        num_categories = len(category_ids)
+        shape = [
+            len(params.iouThrs),
+            len(params.recThrs), num_categories,
+            len(params.areaRng),
+            len(params.maxDets)
+        ]
+        precision = -np.ones(shape)
+        recall = -np.ones(shape[:1] + shape[2:])
+        scores = -np.ones(shape)
+        for shard, result in zip(shards, shard_results):
+          index = np.searchsorted(category_ids, shard)
+          result = result.get()
+          precision[:, :, index] = result['precision']
+          recall[:, index] = result['recall']
+          scores[:, :, index] = result['scores']
+        coco_eval.eval = {
+            'params': params,
+            'counts': shape,
+            'precision': precision,
+            'recall': recall,
+            'scores': scores,
+        }
+        coco_evals.append(coco_eval)
+    return coco_evals
+
   def _retrieve_per_category_metrics(self, coco_eval, prefix=''):
     """Retrieves and per-category metrics and retuns them in a dict.
 
@@ -184,55 +305,72 @@ class COCOEvaluator(object):
       metrics_dict: A dictionary with per category metrics.
     """
 
+    if hasattr(coco_eval, 'category_stats'):
+      return self._per_category_metrics_dict(
+          coco_eval.params.catIds, coco_eval.category_stats, prefix=prefix)
+    return {}
+
+  def _per_category_metrics_dict(self, category_ids, category_stats,
+                                 prefix=''):
+    """Names the per-category metrics.
+
+    Args:
+      category_ids: the list of category ids.
+      category_stats: a [12, len(category_ids)] array of the COCO stats of each
+        category.
+      prefix: str, A string used to prefix metric names.
+
+    Returns:
+      metrics_dict: A dictionary with per category metrics.
+    """
     metrics_dict = {}
     if prefix:
       prefix = prefix + ' '
 
-    if hasattr(coco_eval, 'category_stats'):
-      for category_index, category_id in enumerate(coco_eval.params.catIds):
-        if self._annotation_file:
-          coco_category = self._coco_gt.cats[category_id]
-          # if 'name' is available use it, otherwise use `id`
-          category_display_name = coco_category.get('name', category_id)
-        else:
-          category_display_name = category_id
-
-        metrics_dict[prefix + 'Precision mAP ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[0][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Precision mAP ByCategory@50IoU/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[1][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Precision mAP ByCategory@75IoU/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[2][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Precision mAP ByCategory (small) /{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[3][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Precision mAP ByCategory (medium) /{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[4][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Precision mAP ByCategory (large) /{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[5][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Recall AR@1 ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[6][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Recall AR@10 ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[7][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Recall AR@100 ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[8][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Recall AR (small) ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[9][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Recall AR (medium) ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[10][category_index].astype(np.float32)
-        metrics_dict[prefix + 'Recall AR (large) ByCategory/{}'.format(
-            category_display_name
-        )] = coco_eval.category_stats[11][category_index].astype(np.float32)
+    for category_index, category_id in enumerate(category_ids):
+      if self._annotation_file:
+        coco_category = self._coco_gt.cats[category_id]
+        # if 'name' is available use it, otherwise use `id`
+        category_display_name = coco_category.get('name', category_id)
+      else:
+        category_display_name = category_id
+
+      metrics_dict[prefix + 'Precision mAP ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[0][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Precision mAP ByCategory@50IoU/{}'.format(
+          category_display_name
+      )] = category_stats[1][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Precision mAP ByCategory@75IoU/{}'.format(
+          category_display_name
+      )] = category_stats[2][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Precision mAP ByCategory (small) /{}'.format(
+          category_display_name
+      )] = category_stats[3][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Precision mAP ByCategory (medium) /{}'.format(
+          category_display_name
+      )] = category_stats[4][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Precision mAP ByCategory (large) /{}'.format(
+          category_display_name
+      )] = category_stats[5][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Recall AR@1 ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[6][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Recall AR@10 ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[7][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Recall AR@100 ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[8][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Recall AR (small) ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[9][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Recall AR (medium) ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[10][category_index].astype(np.float32)
+      metrics_dict[prefix + 'Recall AR (large) ByCategory/{}'.format(
+          category_display_name
+      )] = category_stats[11][category_index].astype(np.float32)
 
     return metrics_dict
 
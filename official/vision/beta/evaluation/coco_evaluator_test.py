@@ -0,0 +1,108 @@
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for coco_evaluator.py."""
+
+import json
+import os
+
+# Import libraries
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from official.vision.beta.evaluation import coco_evaluator
+from official.vision.beta.evaluation import coco_utils
+from official.vision.beta.evaluation import streaming_coco_evaluator_benchmark
+
+
+def _evaluate(evaluator, batches):
+  for groundtruths, predictions in batches:
+    if groundtruths is not None:
+      groundtruths = tf.nest.map_structure(tf.constant, groundtruths)
+    evaluator.update_state(groundtruths,
+                           tf.nest.map_structure(tf.constant, predictions))
+  return evaluator.result()
+
+
+def _mask_batches(batches, annotation_file):
+  """Adds masks to the detections and writes the groundtruths with boxes as
+  polygons to the annotation file."""
+  dataset = coco_utils.convert_groundtruths_to_coco_dataset({
+      key: [groundtruths[key] for groundtruths, _ in batches]
+      for key in batches[0][0]
+  })
+  for ann in dataset['annotations']:
+    x, y, w, h = ann['bbox']
+    ann['segmentation'] = [[x, y, x, y + h, x + w, y + h, x + w, y]]
+  with tf.io.gfile.GFile(annotation_file, 'w') as f:
+    json.dump(dataset, f)
+
+  rng = np.random.RandomState(0)
+  mask_batches = []
+  for groundtruths, predictions in batches:
+    predictions = dict(predictions)
+    shape = predictions['detection_scores'].shape
+    predictions['detection_masks'] = rng.uniform(
+        size=shape + (8, 8)).astype(np.float32)
+    image_info = np.zeros(shape[:1] + (4, 2), np.float32)
+    image_info[:, 0] = np.stack(
+        [groundtruths['height'], groundtruths['width']], -1)
+    predictions['image_info'] = image_info
+    mask_batches.append((None, predictions))
+  return mask_batches
+
+
+class COCOEvaluatorTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters(2, 3)
+  def test_parallel_box_eval(self, num_processes):
+    batches = streaming_coco_evaluator_benchmark.synthetic_batches(
+        48, 16, num_classes=7, max_detections=30)
+    expected = _evaluate(
+        coco_evaluator.COCOEvaluator(
+            annotation_file=None,
+            include_mask=False,
+            need_rescale_bboxes=False), batches)
+    actual = _evaluate(
+        coco_evaluator.COCOEvaluator(
+            annotation_file=None,
+            include_mask=False,
+            need_rescale_bboxes=False,
+            num_processes=num_processes), batches)
+    self.assertCountEqual(expected.keys(), actual.keys())
+    for key in expected:
+      self.assertEqual(expected[key], actual[key], msg=key)
+
+  def test_parallel_mask_eval(self):
+    annotation_file = os.path.join(self.get_temp_dir(), 'annotations.json')
+    batches = _mask_batches(
+        streaming_coco_evaluator_benchmark.synthetic_batches(
+            16, 8, num_classes=4, max_detections=10), annotation_file)
+    metrics = []
+    for num_processes in [0, 2]:
+      evaluator = coco_evaluator.COCOEvaluator(
+          annotation_file=annotation_file,
+          include_mask=True,
+          need_rescale_bboxes=False,
+          num_processes=num_processes)
+      metrics.append(_evaluate(evaluator, batches))
+    self.assertLen(metrics[0], 24)
+    self.assertCountEqual(metrics[0].keys(), metrics[1].keys())
+    for key in metrics[0]:
+      self.assertEqual(metrics[0][key], metrics[1][key], msg=key)
+
+
+if __name__ == '__main__':
+  tf.test.main()
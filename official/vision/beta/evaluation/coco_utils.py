@@ -144,15 +144,12 @@ def convert_predictions_to_coco_annotations(predictions):
 
     for j in range(batch_size):
       if 'detection_masks' in predictions:
-        image_masks = mask_ops.paste_instance_masks(
-            predictions['detection_masks'][i][j],
-            mask_boxes[i][j],
-            int(predictions['image_info'][i][j, 0, 0]),
-            int(predictions['image_info'][i][j, 0, 1]))
-        binary_masks = (image_masks > 0.0).astype(np.uint8)
-        encoded_masks = [
-            mask_api.encode(np.asfortranarray(binary_mask))
-            for binary_mask in list(binary_masks)]
+        image_height = int(predictions['image_info'][i][j, 0, 0])
+        image_width = int(predictions['image_info'][i][j, 0, 1])
+        encoded_masks = mask_api.frPyObjects(
+            mask_ops.paste_instance_masks_rle(
+                predictions['detection_masks'][i][j], mask_boxes[i][j],
+                image_height, image_width), image_height, image_width)
       for k in range(max_num_detections):
         ann = {}
         ann['image_id'] = predictions['source_id'][i][j]
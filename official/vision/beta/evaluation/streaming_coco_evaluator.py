@@ -0,0 +1,501 @@
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""The streaming COCO-style box evaluator.
+
+COCOEvaluator buffers every prediction of the eval set and hands them to
+pycocotools at the end. StreamingCOCOEvaluator instead matches the detections
+of each batch to the groundtruths as the batch arrives, with the greedy
+matching of `COCOeval.evaluateImg` vectorized over the images and categories of
+the batch, the IoU thresholds and the area ranges. Only the score, the rank and
+the true and false positive bits of each detection are kept, `evaluate` then
+computes the precision and recall curves like `COCOeval.accumulate` and the
+12 stats like `COCOeval.summarize`.
+
+  evaluator = StreamingCOCOEvaluator(...)
+  for _ in range(num_batches_per_eval):
+    predictions, groundtruth = predictor.predict(...)  # pop a batch.
+    evaluator.update_state(groundtruths, predictions)
+  evaluator.result()  # finish one full eval and reset states.
+"""
+
+import collections
+
+# Import libraries
+from absl import logging
+import numpy as np
+
+from official.vision.beta.evaluation import coco_evaluator
+
+# The evaluation parameters of pycocotools.
+IOU_THRESHOLDS = np.linspace(
+    .5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+RECALL_THRESHOLDS = np.linspace(
+    .0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
+MAX_DETECTIONS = (1, 10, 100)
+AREA_RANGES = np.array([[0**2, 1e5**2], [0**2, 32**2], [32**2, 96**2],
+                        [96**2, 1e5**2]])
+
+
+def _group_positions(keys):
+  """Returns the group index and the position within the group of sorted keys.
+
+  Args:
+    keys: a [N, P] int array sorted lexicographically along axis 0.
+
+  Returns:
+    group: a [N] int array, the index of the distinct key of each row.
+    position: a [N] int array, the number of rows before it with the same key.
+  """
+  if not keys.shape[0]:
+    return np.zeros([0], np.int64), np.zeros([0], np.int64)
+  starts = np.ones([keys.shape[0]], bool)
+  starts[1:] = np.any(keys[1:] != keys[:-1], axis=-1)
+  group = np.cumsum(starts) - 1
+  first = np.flatnonzero(starts)
+  position = np.arange(keys.shape[0]) - first[group]
+  return group, position
+
+
+def box_iou(dt_boxes, gt_boxes, gt_crowd):
+  """Computes the IoU of pycocotools between boxes in [x, y, w, h] format.
+
+  The union of a crowd groundtruth is the area of the detection.
+
+  Args:
+    dt_boxes: a float64 array of shape [..., D, 4].
+    gt_boxes: a float64 array of shape [..., G, 4].
+    gt_crowd: a bool array of shape [..., G].
+
+  Returns:
+    a float64 array of shape [..., D, G].
+  """
+  dt = dt_boxes[..., :, None, :]
+  gt = gt_boxes[..., None, :, :]
+  width = (np.minimum(dt[..., 0] + dt[..., 2], gt[..., 0] + gt[..., 2]) -
+           np.maximum(dt[..., 0], gt[..., 0]))
+  height = (np.minimum(dt[..., 1] + dt[..., 3], gt[..., 1] + gt[..., 3]) -
+            np.maximum(dt[..., 1], gt[..., 1]))
+  overlaps = (width > 0) & (height > 0)
+  intersection = np.where(overlaps, width * height, 0.0)
+  dt_area = dt[..., 2] * dt[..., 3]
+  union = np.where(gt_crowd[..., None, :], dt_area,
+                   dt_area + gt[..., 2] * gt[..., 3] - intersection)
+  return np.where(overlaps, intersection / np.where(overlaps, union, 1.0), 0.0)
+
+
+def _last_argmax(values):
+  """The index of the last maximum along the last axis."""
+  return values.shape[-1] - 1 - np.argmax(values[..., ::-1], axis=-1)
+
+
+def match_detections(ious, dt_valid, gt_valid, gt_crowd, gt_ignore):
+  """Greedily matches the ranked detections of groups to their groundtruths.
+
+  This is `COCOeval.evaluateImg` for every IoU threshold and area range at
+  once, over groups of one image and one category. Each detection, from the
+  highest score down, takes the unmatched groundtruth with the highest IoU
+  above the threshold, the last one on ties. Groundtruths that are not ignored
+  are preferred, crowd groundtruths can be matched more than once. Detections
+  that overlap no groundtruth by the lowest threshold can't match and are
+  skipped, so the loop only runs over the detections that might match.
+
+  Args:
+    ious: a [N, D, G] float64 array, the IoUs of the detections of each group,
+      in the order of their scores, with its groundtruths.
+    dt_valid: a [N, D] bool array, whether the detection exists.
+    gt_valid: a [N, G] bool array, whether the groundtruth exists.
+    gt_crowd: a [N, G] bool array, whether the groundtruth is a crowd.
+    gt_ignore: a [N, A, G] bool array, whether the groundtruth is ignored in
+      the area range.
+
+  Returns:
+    matched: a [N, T, A, D] bool array, whether the detection is matched at
+      the IoU threshold in the area range.
+    ignored: a [N, T, A, D] bool array, whether the detection is matched to an
+      ignored groundtruth.
+  """
+  num_groups, num_dets, num_gts = ious.shape
+  num_areas = gt_ignore.shape[1]
+  shape = [num_groups, IOU_THRESHOLDS.size, num_areas, num_dets]
+  matched = np.zeros(shape, bool)
+  ignored = np.zeros(shape, bool)
+
+  ious = np.where(gt_valid[:, None, :], ious, -1.0)
+  candidates = dt_valid & np.any(ious >= IOU_THRESHOLDS[0], axis=-1)
+  groups = np.flatnonzero(np.any(candidates, axis=-1))
+  if not groups.size:
+    return matched, ignored
+
+  # compact the candidates of each group to the front, in rank order, and
+  # sort the groups by their number of candidates so that the groups that
+  # still have a candidate at a rank are a prefix
+  count = candidates[groups].sum(axis=-1)
+  groups = groups[np.argsort(-count, kind='stable')]
+  count = -np.sort(-count)
+  active = np.searchsorted(-count, -np.arange(count[0]), side='left')
+  order = np.argsort(~candidates[groups], axis=-1, kind='stable')[:, :count[0]]
+  ious = np.take_along_axis(ious[groups], order[..., None], axis=1)
+  crowd = gt_crowd[groups][:, None, None, :]
+  gt_ignore = gt_ignore[groups][:, None, :, :]
+
+  thresholds = np.minimum(IOU_THRESHOLDS, 1 - 1e-10)[None, :, None, None]
+  gt_matched = np.zeros(
+      [groups.size, IOU_THRESHOLDS.size, num_areas, num_gts], bool)
+  gt_index = np.arange(num_gts)
+  for rank in range(count[0]):
+    n = active[rank]
+    iou = ious[:n, None, None, rank, :]
+    found = (iou >= thresholds) & (crowd[:n] | ~gt_matched[:n])
+    kept = found & ~gt_ignore[:n]
+    best = np.where(kept.any(axis=-1), _last_argmax(np.where(kept, iou, -1.0)),
+                    _last_argmax(np.where(found, iou, -1.0)))
+    is_matched = found.any(axis=-1)
+
+    gt_matched[:n] |= is_matched[..., None] & (gt_index == best[..., None])
+    dt_index = order[:n, rank]
+    matched[groups[:n], ..., dt_index] = is_matched
+    ignored[groups[:n], ..., dt_index] = is_matched & np.take_along_axis(
+        gt_ignore[:n], best[..., None], axis=-1)[..., 0]
+  return matched, ignored
+
+
+class StreamingCOCOEvaluator(coco_evaluator.COCOEvaluator):
+  """COCO box evaluation metric class that matches detections per batch."""
+
+  def __init__(self,
+               annotation_file,
+               include_mask=False,
+               need_rescale_bboxes=True,
+               per_category_metrics=False):
+    """Constructs the streaming COCO evaluation class.
+
+    Args:
+      annotation_file: a JSON file that stores annotations of the eval dataset.
+        If `annotation_file` is None, groundtruth annotations will be loaded
+        from the dataloader.
+      include_mask: must be False, only boxes are evaluated.
+      need_rescale_bboxes: If true bboxes in `predictions` will be rescaled back
+        to absolute values (`image_info` is needed in this case).
+      per_category_metrics: Whether to return per category metrics.
+
+    Raises:
+      ValueError: if `include_mask` is True.
+    """
+    if include_mask:
+      raise ValueError('StreamingCOCOEvaluator only evaluates boxes.')
+    super(StreamingCOCOEvaluator, self).__init__(
+        annotation_file=annotation_file,
+        include_mask=False,
+        need_rescale_bboxes=need_rescale_bboxes,
+        per_category_metrics=per_category_metrics)
+    if annotation_file:
+      self._gt_annotations = self._index_annotations()
+
+  def _index_annotations(self):
+    """Returns the groundtruth arrays of each image of the annotation file."""
+    annotations = {}
+    for image_id, anns in self._coco_gt.imgToAnns.items():
+      annotations[image_id] = (
+          np.array([ann['bbox'] for ann in anns], np.float64).reshape([-1, 4]),
+          np.array([ann['category_id'] for ann in anns], np.int64),
+          np.array([ann.get('iscrowd', 0) for ann in anns], bool),
+          np.array([ann['area'] for ann in anns], np.float64))
+    return annotations
+
+  def reset_states(self):
+    """Resets internal states for a fresh run."""
+    self._detections = collections.defaultdict(list)
+    self._num_positives = collections.defaultdict(
+        lambda: np.zeros([len(AREA_RANGES)], np.int64))
+    self._gt_category_ids = set()
+
+  def _batch_groundtruths(self, image_ids, groundtruths):
+    """Flattens the groundtruths of a batch.
+
+    Returns:
+      the batch index, box in [x, y, w, h], category, crowd flag and area of
+      each groundtruth, in the order of the images and their annotations.
+    """
+    if self._annotation_file:
+      empty = (np.zeros([0, 4]), np.zeros([0], np.int64), np.zeros([0], bool),
+               np.zeros([0]))
+      anns = [self._gt_annotations.get(i, empty) for i in image_ids]
+      index = np.repeat(np.arange(len(anns)), [len(a[1]) for a in anns])
+      return (index,) + tuple(np.concatenate(a) for a in zip(*anns))
+
+    for k in self._required_groundtruth_fields:
+      if k not in groundtruths:
+        raise ValueError(
+            'Missing the required key `{}` in groundtruths!'.format(k))
+    classes = groundtruths['classes']
+    batch_size, max_num_instances = classes.shape
+    num_instances = groundtruths['num_detections']
+    if np.any(num_instances > max_num_instances):
+      logging.warning(
+          'num_groundtruths is larger than max_num_instances, %d v.s. %d',
+          np.max(num_instances), max_num_instances)
+    valid = np.arange(max_num_instances) < num_instances[:, None]
+    index = np.broadcast_to(np.arange(batch_size)[:, None], valid.shape)
+
+    # the same float32 arithmetic as convert_groundtruths_to_coco_dataset
+    boxes = groundtruths['boxes']
+    width = boxes[..., 3] - boxes[..., 1]
+    height = boxes[..., 2] - boxes[..., 0]
+    xywh = np.stack([boxes[..., 1], boxes[..., 0], width, height], axis=-1)
+    if 'areas' in groundtruths:
+      areas = groundtruths['areas']
+    else:
+      areas = width * height
+    if 'is_crowds' in groundtruths:
+      crowd = groundtruths['is_crowds'].astype(np.int64) != 0
+    else:
+      crowd = np.zeros(valid.shape, bool)
+    classes = classes.astype(np.int64)
+    self._gt_category_ids.update(np.unique(classes[valid]).tolist())
+    return (index[valid], xywh[valid].astype(np.float64), classes[valid],
+            crowd[valid], areas[valid].astype(np.float64))
+
+  def update_state(self, groundtruths, predictions):
+    """Matches the detections of a batch and keeps their outcome.
+
+    Args:
+      groundtruths: a dictionary of Tensors with the fields of
+        `COCOEvaluator.update_state`, ignored if there is an annotation file.
+      predictions: a dictionary of Tensors with the fields of
+        `COCOEvaluator.update_state`, without masks.
+
+    Raises:
+      ValueError: if the required prediction or groundtruth fields are not
+        present in the incoming `predictions` or `groundtruths`.
+    """
+    groundtruths, predictions = self._convert_to_numpy(groundtruths,
+                                                       predictions)
+    for k in self._required_prediction_fields:
+      if k not in predictions:
+        raise ValueError(
+            'Missing the required key `{}` in predictions!'.format(k))
+    if self._need_rescale_bboxes:
+      self._process_predictions(predictions)
+    if not self._annotation_file:
+      assert groundtruths
+
+    image_ids = [int(i) for i in predictions['source_id']]
+    gt_index, gt_boxes, gt_classes, gt_crowd, gt_areas = (
+        self._batch_groundtruths(image_ids, groundtruths))
+
+    # all the detections are evaluated, like with pycocotools
+    boxes = predictions['detection_boxes']
+    batch_size, max_num_detections = boxes.shape[:2]
+    width = boxes[..., 3] - boxes[..., 1]
+    height = boxes[..., 2] - boxes[..., 0]
+    dt_boxes = np.stack([boxes[..., 1], boxes[..., 0], width, height],
+                        axis=-1).reshape([-1, 4]).astype(np.float64)
+    dt_areas = (width * height).reshape([-1]).astype(np.float64)
+    dt_classes = predictions['detection_classes'].reshape([-1]).astype(np.int64)
+    dt_scores = predictions['detection_scores'].reshape([-1]).astype(np.float64)
+    dt_index = np.repeat(np.arange(batch_size), max_num_detections)
+
+    # group the detections by image and category, by score in each group
+    dt_order = np.lexsort((-dt_scores, dt_classes, dt_index))
+    dt_keys = np.stack([dt_index, dt_classes], axis=-1)[dt_order]
+    gt_order = np.lexsort((gt_classes, gt_index))
+    gt_keys = np.stack([gt_index, gt_classes], axis=-1)[gt_order]
+    keys, inverse = np.unique(
+        np.concatenate([dt_keys, gt_keys]), axis=0, return_inverse=True)
+    inverse = inverse.reshape([-1])
+    dt_group, dt_rank = inverse[:dt_keys.shape[0]], _group_positions(dt_keys)[1]
+    gt_group, gt_rank = inverse[dt_keys.shape[0]:], _group_positions(gt_keys)[1]
+    kept = dt_rank < MAX_DETECTIONS[-1]
+    dt_order, dt_group, dt_rank = dt_order[kept], dt_group[kept], dt_rank[kept]
+
+    num_groups = keys.shape[0]
+    num_dets = dt_rank.max() + 1 if dt_rank.size else 0
+    num_gts = gt_rank.max() + 1 if gt_rank.size else 0
+    dt_valid = np.zeros([num_groups, num_dets], bool)
+    dt_valid[dt_group, dt_rank] = True
+    padded_dt_boxes = np.zeros([num_groups, num_dets, 4])
+    padded_dt_boxes[dt_group, dt_rank] = dt_boxes[dt_order]
+    gt_valid = np.zeros([num_groups, num_gts], bool)
+    gt_valid[gt_group, gt_rank] = True
+    padded_gt_boxes = np.zeros([num_groups, num_gts, 4])
+    padded_gt_boxes[gt_group, gt_rank] = gt_boxes[gt_order]
+    padded_gt_crowd = np.zeros([num_groups, num_gts], bool)
+    padded_gt_crowd[gt_group, gt_rank] = gt_crowd[gt_order]
+
+    gt_outside = ((gt_areas[:, None] < AREA_RANGES[:, 0]) |
+                  (gt_areas[:, None] > AREA_RANGES[:, 1]))
+    gt_ignore = gt_outside | gt_crowd[:, None]
+    padded_gt_ignore = np.ones([num_groups, num_gts, len(AREA_RANGES)], bool)
+    padded_gt_ignore[gt_group, gt_rank] = gt_ignore[gt_order]
+    ious = box_iou(padded_dt_boxes, padded_gt_boxes, padded_gt_crowd)
+    matched, ignored = match_detections(ious, dt_valid, gt_valid,
+                                        padded_gt_crowd,
+                                        padded_gt_ignore.transpose([0, 2, 1]))
+
+    # [num_kept, T, A]
+    matched = matched[dt_group, ..., dt_rank]
+    ignored = ignored[dt_group, ..., dt_rank]
+    dt_outside = ((dt_areas[dt_order, None] < AREA_RANGES[:, 0]) |
+                  (dt_areas[dt_order, None] > AREA_RANGES[:, 1]))
+    ignored |= ~matched & dt_outside[:, None, :]
+    self._detections['category'].append(keys[dt_group, 1])
+    self._detections['score'].append(dt_scores[dt_order])
+    self._detections['image'].append(
+        np.array(image_ids, np.int64)[keys[dt_group, 0]])
+    self._detections['rank'].append(dt_rank.astype(np.int16))
+    self._detections['tp'].append(
+        np.packbits((matched & ~ignored).reshape([matched.shape[0], -1]), -1))
+    self._detections['fp'].append(
+        np.packbits((~matched & ~ignored).reshape([matched.shape[0], -1]), -1))
+
+    for category in np.unique(gt_classes):
+      in_category = gt_classes == category
+      self._num_positives[int(category)] += np.sum(
+          ~gt_ignore[in_category], axis=0)
+
+  def _category_ids(self):
+    if self._annotation_file:
+      return sorted(self._coco_gt.getCatIds())
+    return sorted(self._gt_category_ids)
+
+  def accumulate(self):
+    """Computes the precision and recall curves of the matched detections.
+
+    Returns:
+      precision: a [T, R, K, A, M] float array, the precision at each recall
+        threshold, -1 where the category has no groundtruth.
+      recall: a [T, K, A, M] float array, the maximum recall.
+    """
+    category_ids = self._category_ids()
+    num_thresholds = IOU_THRESHOLDS.size
+    num_areas = len(AREA_RANGES)
+    precision = -np.ones([
+        num_thresholds, RECALL_THRESHOLDS.size,
+        len(category_ids), num_areas,
+        len(MAX_DETECTIONS)
+    ])
+    recall = -np.ones(
+        [num_thresholds,
+         len(category_ids), num_areas,
+         len(MAX_DETECTIONS)])
+    if not self._detections:
+      detections = {
+          key: np.zeros([0], np.int64)
+          for key in ['category', 'score', 'image', 'rank']
+      }
+      detections['tp'] = detections['fp'] = np.zeros([0, 5], np.uint8)
+    else:
+      detections = {
+          key: np.concatenate(value)
+          for key, value in self._detections.items()
+      }
+
+    # by category, then like the mergesort of pycocotools over the images in
+    # id order
+    order = np.lexsort((detections['rank'], detections['image'],
+                        -detections['score'], detections['category']))
+    detections = {key: value[order] for key, value in detections.items()}
+    starts = np.searchsorted(detections['category'], category_ids, 'left')
+    ends = np.searchsorted(detections['category'], category_ids, 'right')
+    for k, category_id in enumerate(category_ids):
+      num_positives = self._num_positives.get(category_id)
+      if num_positives is None or not num_positives.any():
+        continue
+      rank = detections['rank'][starts[k]:ends[k]]
+      flags = []
+      for key in ['tp', 'fp']:
+        bits = np.unpackbits(
+            detections[key][starts[k]:ends[k]], axis=-1,
+            count=num_thresholds * num_areas)
+        flags.append(bits.reshape([-1, num_thresholds, num_areas]))
+      for m, max_detections in enumerate(MAX_DETECTIONS):
+        kept = rank < max_detections
+        tp_sum = np.cumsum(flags[0][kept], axis=0, dtype=np.float64)
+        fp_sum = np.cumsum(flags[1][kept], axis=0, dtype=np.float64)
+        num_dets = tp_sum.shape[0]
+        for a in range(num_areas):
+          if not num_positives[a]:
+            continue
+          rc = tp_sum[:, :, a] / num_positives[a]
+          pr = tp_sum[:, :, a] / (fp_sum[:, :, a] + tp_sum[:, :, a] +
+                                  np.spacing(1))
+          recall[:, k, a, m] = rc[-1] if num_dets else 0
+          pr = np.maximum.accumulate(pr[::-1], axis=0)[::-1]
+          if not num_dets:
+            precision[:, :, k, a, m] = 0
+            continue
+          for t in range(num_thresholds):
+            inds = np.searchsorted(rc[:, t], RECALL_THRESHOLDS, side='left')
+            q = pr[np.minimum(inds, num_dets - 1), t]
+            q[inds >= num_dets] = 0
+            precision[t, :, k, a, m] = q
+    return precision, recall
+
+  def evaluate(self):
+    """Computes the COCO metrics of the detections seen since the reset.
+
+    Returns:
+      a dictionary of the 12 COCO box metrics, and of the metrics of each
+      category if `per_category_metrics` is True.
+    """
+    precision, recall = self.accumulate()
+    stats = summarize(precision, recall)
+
+    metrics_dict = {}
+    for i, name in enumerate(self._metric_names):
+      metrics_dict[name] = stats[i].astype(np.float32)
+    if self._per_category_metrics:
+      category_stats = np.stack([
+          summarize(precision[:, :, k:k + 1], recall[:, k:k + 1])
+          for k in range(precision.shape[2])
+      ], axis=-1)
+      metrics_dict.update(
+          self._per_category_metrics_dict(self._category_ids(), category_stats))
+    return metrics_dict
+
+
+def summarize(precision, recall):
+  """Computes the 12 stats of `COCOeval.summarize`.
+
+  Args:
+    precision: a [T, R, K, A, M] float array from accumulate.
+    recall: a [T, K, A, M] float array from accumulate.
+
+  Returns:
+    a [12] float64 array, AP, AP50, AP75, APs, APm, APl, ARmax1, ARmax10,
+    ARmax100, ARs, ARm and ARl.
+  """
+
+  def mean(values):
+    values = values[values > -1]
+    return np.mean(values) if values.size else -1.0
+
+  iou50 = np.flatnonzero(IOU_THRESHOLDS == .5)
+  iou75 = np.flatnonzero(IOU_THRESHOLDS == .75)
+  stats = [
+      mean(precision[..., 0, 2]),
+      mean(precision[iou50][..., 0, 2]),
+      mean(precision[iou75][..., 0, 2]),
+      mean(precision[..., 1, 2]),
+      mean(precision[..., 2, 2]),
+      mean(precision[..., 3, 2]),
+      mean(recall[..., 0, 0]),
+      mean(recall[..., 0, 1]),
+      mean(recall[..., 0, 2]),
+      mean(recall[..., 1, 2]),
+      mean(recall[..., 2, 2]),
+      mean(recall[..., 3, 2]),
+  ]
+  return np.array(stats, np.float64)
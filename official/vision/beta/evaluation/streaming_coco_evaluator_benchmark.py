@@ -0,0 +1,168 @@
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Benchmark of the COCO evaluators on a synthetic eval set.
+
+Random groundtruths and noisy detections of them are fed batch by batch to
+COCOEvaluator and StreamingCOCOEvaluator, the time spent in update_state and
+in result and the largest metric difference are reported.
+
+python3 -m official.vision.beta.evaluation.streaming_coco_evaluator_benchmark \
+    --num_eval_images=5000
+"""
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import tensorflow as tf
+
+from official.vision.beta.evaluation import coco_evaluator
+from official.vision.beta.evaluation import streaming_coco_evaluator
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('num_eval_images', 5000, 'number of synthetic images.')
+flags.DEFINE_integer('eval_batch_size', 64, 'images per batch.')
+flags.DEFINE_integer('num_categories', 80, 'number of categories.')
+flags.DEFINE_integer('max_eval_detections', 100, 'detections per image.')
+flags.DEFINE_list('evaluators', ['pycocotools', 'streaming'],
+                  'evaluators to benchmark.')
+
+
+def synthetic_batches(num_images,
+                      batch_size,
+                      num_classes=80,
+                      max_detections=100,
+                      max_instances=30,
+                      seed=0):
+  """Generates batches of random groundtruths and detections.
+
+  The detections are jittered copies of the groundtruths, some duplicated or
+  with the wrong class, random false positives and zero padding. The scores
+  are rounded to 2 decimals so that ties occur.
+
+  Args:
+    num_images: the number of images, a multiple of batch_size.
+    batch_size: the number of images per batch.
+    num_classes: the number of categories.
+    max_detections: the number of detections per image, K.
+    max_instances: the maximum number of groundtruths per image.
+    seed: the random seed.
+
+  Return:
+    a list of (groundtruths, predictions) dictionaries of numpy arrays in the
+    format of COCOEvaluator.update_state with absolute boxes.
+  """
+  rng = np.random.RandomState(seed)
+  batches = []
+  for start in range(0, num_images, batch_size):
+    height = rng.randint(240, 640, [batch_size])
+    width = rng.randint(240, 640, [batch_size])
+    num_instances = rng.randint(0, max_instances + 1, [batch_size])
+    shape = [batch_size, max_instances]
+    size = np.exp(rng.uniform(np.log(4), np.log(400), shape + [2]))
+    size = np.minimum(size, np.stack([height, width], -1)[:, None] - 1)
+    corner = rng.uniform(0, 1, shape + [2]) * (
+        np.stack([height, width], -1)[:, None] - size)
+    boxes = np.concatenate([corner, corner + size], -1).astype(np.float32)
+    classes = rng.randint(1, num_classes + 1, shape)
+    groundtruths = {
+        'source_id': np.arange(start, start + batch_size) * 3 + 1,
+        'height': height,
+        'width': width,
+        'num_detections': num_instances,
+        'boxes': boxes,
+        'classes': classes,
+        'is_crowds': (rng.uniform(size=shape) < 0.05).astype(np.int32),
+    }
+
+    # jittered detections of a random subset of the groundtruths
+    source = rng.randint(0, max_instances, [batch_size, max_detections])
+    source = np.minimum(source, np.maximum(num_instances[:, None] - 1, 0))
+    dt_boxes = np.take_along_axis(boxes, source[..., None], axis=1)
+    dt_size = np.tile(dt_boxes[..., 2:] - dt_boxes[..., :2], [1, 1, 2])
+    dt_boxes += rng.normal(0, 0.1, dt_boxes.shape) * dt_size
+    dt_classes = np.take_along_axis(classes, source, axis=1)
+    wrong = rng.uniform(size=source.shape) < 0.1
+    dt_classes[wrong] = rng.randint(1, num_classes + 1, np.sum(wrong))
+    random = (rng.uniform(size=source.shape) < 0.3) | (
+        num_instances[:, None] == 0)
+    dt_boxes[random] = np.concatenate(
+        [rng.uniform(0, 200, [np.sum(random), 2])] * 2, -1) + np.concatenate(
+            [np.zeros([np.sum(random), 2]),
+             rng.uniform(2, 300, [np.sum(random), 2])], -1)
+    scores = np.round(rng.uniform(size=source.shape), 2)
+    num_detections = rng.randint(0, max_detections + 1, [batch_size])
+    padded = np.arange(max_detections) >= num_detections[:, None]
+    dt_boxes[padded] = 0
+    dt_classes[padded] = 0
+    scores[padded] = 0
+    predictions = {
+        'source_id': groundtruths['source_id'],
+        'num_detections': num_detections,
+        'detection_boxes': dt_boxes.astype(np.float32),
+        'detection_classes': dt_classes,
+        'detection_scores': scores.astype(np.float32),
+    }
+    batches.append((groundtruths, predictions))
+  return batches
+
+
+def build_evaluator(name, per_category_metrics=False):
+  evaluator = {
+      'pycocotools': coco_evaluator.COCOEvaluator,
+      'streaming': streaming_coco_evaluator.StreamingCOCOEvaluator,
+  }[name]
+  return evaluator(
+      annotation_file=None,
+      include_mask=False,
+      need_rescale_bboxes=False,
+      per_category_metrics=per_category_metrics)
+
+
+def evaluate(evaluator, batches):
+  """Returns the metrics and the seconds spent in update_state and result."""
+  update_time = 0.0
+  for groundtruths, predictions in batches:
+    groundtruths = tf.nest.map_structure(tf.constant, groundtruths)
+    predictions = tf.nest.map_structure(tf.constant, predictions)
+    start = time.perf_counter()
+    evaluator.update_state(groundtruths, predictions)
+    update_time += time.perf_counter() - start
+  start = time.perf_counter()
+  metrics = evaluator.result()
+  return metrics, update_time, time.perf_counter() - start
+
+
+def main(_):
+  batches = synthetic_batches(
+      FLAGS.num_eval_images,
+      FLAGS.eval_batch_size,
+      num_classes=FLAGS.num_categories,
+      max_detections=FLAGS.max_eval_detections)
+  results = {}
+  for name in FLAGS.evaluators:
+    metrics, update_time, result_time = evaluate(build_evaluator(name), batches)
+    results[name] = metrics
+    print(f'{name:12s} update_state {update_time:7.2f}s  '
+          f'result {result_time:7.2f}s  '
+          f'total {update_time + result_time:7.2f}s  AP {metrics["AP"]:.4f}')
+  if len(results) == 2:
+    first, second = results.values()
+    print('max metric difference',
+          max(abs(first[key] - second[key]) for key in first))
+
+
+if __name__ == '__main__':
+  app.run(main)
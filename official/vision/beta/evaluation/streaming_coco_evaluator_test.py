@@ -0,0 +1,133 @@
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for streaming_coco_evaluator.py."""
+
+import json
+import os
+
+# Import libraries
+from absl.testing import parameterized
+import numpy as np
+from pycocotools import cocoeval
+import tensorflow as tf
+
+from official.vision.beta.evaluation import coco_utils
+from official.vision.beta.evaluation import streaming_coco_evaluator
+from official.vision.beta.evaluation import streaming_coco_evaluator_benchmark
+
+
+def _evaluate(evaluator, batches):
+  for groundtruths, predictions in batches:
+    if groundtruths is not None:
+      groundtruths = tf.nest.map_structure(tf.constant, groundtruths)
+    evaluator.update_state(groundtruths,
+                           tf.nest.map_structure(tf.constant, predictions))
+  return evaluator.result()
+
+
+class StreamingCOCOEvaluatorTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((96, 32, 100, False), (40, 8, 20, True))
+  def test_matches_pycocotools(self, num_images, batch_size, max_detections,
+                               with_areas):
+    batches = streaming_coco_evaluator_benchmark.synthetic_batches(
+        num_images, batch_size, num_classes=5, max_detections=max_detections)
+    if with_areas:
+      for groundtruths, _ in batches:
+        groundtruths['areas'] = np.random.RandomState(0).uniform(
+            0, 128**2, groundtruths['classes'].shape)
+
+    expected = _evaluate(
+        streaming_coco_evaluator_benchmark.build_evaluator('pycocotools'),
+        batches)
+    actual = _evaluate(
+        streaming_coco_evaluator_benchmark.build_evaluator('streaming'),
+        batches)
+    self.assertCountEqual(expected.keys(), actual.keys())
+    for key in expected:
+      self.assertAllClose(expected[key], actual[key], atol=1e-4, msg=key)
+
+  def test_annotation_file(self):
+    batches = streaming_coco_evaluator_benchmark.synthetic_batches(
+        32, 16, num_classes=5)
+    dataset = coco_utils.convert_groundtruths_to_coco_dataset({
+        key: [groundtruths[key] for groundtruths, _ in batches]
+        for key in batches[0][0]
+    })
+    dataset['categories'].append({'id': 7})
+    annotation_file = os.path.join(self.get_temp_dir(), 'annotations.json')
+    with tf.io.gfile.GFile(annotation_file, 'w') as f:
+      json.dump(dataset, f)
+
+    expected = _evaluate(
+        streaming_coco_evaluator_benchmark.build_evaluator('streaming'),
+        batches)
+    evaluator = streaming_coco_evaluator.StreamingCOCOEvaluator(
+        annotation_file=annotation_file,
+        need_rescale_bboxes=False,
+        per_category_metrics=True)
+    actual = _evaluate(evaluator, [(None, p) for _, p in batches])
+    for key in expected:
+      self.assertAllClose(expected[key], actual[key], atol=1e-6, msg=key)
+    self.assertEqual(actual['Precision mAP ByCategory/7'], -1)
+
+  def test_per_category_metrics(self):
+    batches = streaming_coco_evaluator_benchmark.synthetic_batches(
+        48, 16, num_classes=3)
+    metrics = _evaluate(
+        streaming_coco_evaluator_benchmark.build_evaluator(
+            'streaming', per_category_metrics=True), batches)
+
+    gt_dataset = coco_utils.convert_groundtruths_to_coco_dataset({
+        key: [groundtruths[key] for groundtruths, _ in batches]
+        for key in batches[0][0]
+    })
+    coco_gt = coco_utils.COCOWrapper(gt_dataset=gt_dataset)
+    coco_dt = coco_gt.loadRes(
+        coco_utils.convert_predictions_to_coco_annotations({
+            key: [predictions[key].copy() for _, predictions in batches]
+            for key in batches[0][1]
+        }))
+    for category_id in [1, 2, 3]:
+      coco_eval = cocoeval.COCOeval(coco_gt, coco_dt, iouType='bbox')
+      coco_eval.params.catIds = [category_id]
+      coco_eval.evaluate()
+      coco_eval.accumulate()
+      coco_eval.summarize()
+      self.assertAllClose(
+          coco_eval.stats[0],
+          metrics['Precision mAP ByCategory/{}'.format(category_id)],
+          atol=1e-4)
+      self.assertAllClose(
+          coco_eval.stats[8],
+          metrics['Recall AR@100 ByCategory/{}'.format(category_id)],
+          atol=1e-4)
+
+  def test_result_resets_states(self):
+    batches = streaming_coco_evaluator_benchmark.synthetic_batches(
+        16, 8, num_classes=3)
+    evaluator = streaming_coco_evaluator_benchmark.build_evaluator('streaming')
+    first = _evaluate(evaluator, batches)
+    second = _evaluate(evaluator, batches)
+    self.assertAllClose(first, second)
+
+  def test_include_mask(self):
+    with self.assertRaises(ValueError):
+      streaming_coco_evaluator.StreamingCOCOEvaluator(
+          annotation_file=None, include_mask=True)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -20,12 +20,146 @@ import cv2
 import numpy as np
 
 
+# the largest number of pixels of the box regions resized at once
+_MAX_PASTE_PIXELS = 2**24
+
+
+def _expand_boxes(boxes, scale):
+  """Expands an array of boxes by a given scale."""
+  # Reference: https://github.com/facebookresearch/Detectron/blob/master/detectron/utils/boxes.py#L227  # pylint: disable=line-too-long
+  # The `boxes` in the reference implementation is in [x1, y1, x2, y2] form,
+  # whereas `boxes` here is in [x1, y1, w, h] form
+  w_half = boxes[:, 2] * .5
+  h_half = boxes[:, 3] * .5
+  x_c = boxes[:, 0] + w_half
+  y_c = boxes[:, 1] + h_half
+
+  w_half *= scale
+  h_half *= scale
+
+  boxes_exp = np.zeros(boxes.shape)
+  boxes_exp[:, 0] = x_c - w_half
+  boxes_exp[:, 2] = x_c + w_half
+  boxes_exp[:, 1] = y_c - h_half
+  boxes_exp[:, 3] = y_c + h_half
+
+  return boxes_exp
+
+
+def _linear_weights(src_size, dst_sizes, offsets, length):
+  """Bilinear weights of cv2.resize for a window of the resized pixels.
+
+  Args:
+    src_size: the size of the source along the axis.
+    dst_sizes: a [N] int array, the resized size of each instance.
+    offsets: a [N] int array, the first resized pixel of each window.
+    length: the size of the windows.
+
+  Returns:
+    a [N, length, src_size] float32 array, the weights of the source pixels
+    in each resized pixel of the windows.
+  """
+  dst = offsets[:, None] + np.arange(length)
+  # the same float32 source coordinates as cv2.resize with INTER_LINEAR
+  scale = src_size / dst_sizes[:, None].astype(np.float64)
+  coord = ((dst + 0.5) * scale - 0.5).astype(np.float32)
+  index = np.floor(coord).astype(np.int64)
+  frac = coord - index
+  # clamped to the border pixels, the last one as the second tap
+  frac[index < 0] = 0
+  frac[index >= src_size - 1] = 1
+  index = np.clip(index, 0, src_size - 2)
+
+  weights = np.zeros(dst.shape + (src_size,), np.float32)
+  np.put_along_axis(weights, index[..., None], (1 - frac)[..., None], -1)
+  np.put_along_axis(weights, index[..., None] + 1, frac[..., None], -1)
+  return weights
+
+
+def _paste_windows(masks, detected_boxes, image_height, image_width):
+  """Resizes the masks to their boxes, only inside the image.
+
+  The masks are zero-padded by 1 pixel and resized to their expanded boxes
+  with the bilinear interpolation of cv2.resize, as a product with the
+  interpolation weights along each axis. Only the window of each resized mask
+  that is inside the image is computed.
+
+  Args:
+    masks: a numpy array of shape [N, mask_height, mask_width].
+    detected_boxes: a numpy array of shape [N, 4] in [x, y, w, h] format.
+    image_height: an integer representing the height of the image.
+    image_width: an integer representing the width of the image.
+
+  Yields:
+    groups of instances with windows of similar sizes, the [n] int array of
+    their indices, the [n, h, w] bool windows and the [n] int arrays of the top
+    and left of the windows in the image. Each window is the top left corner
+    of its array, instances without window are skipped.
+  """
+  num_masks, mask_height, mask_width = masks.shape
+  # Reference: https://github.com/facebookresearch/Detectron/blob/master/detectron/core/test.py#L812  # pylint: disable=line-too-long
+  # To work around an issue with cv2.resize (it seems to automatically pad
+  # with repeated border values), we manually zero-pad the masks by 1 pixel
+  # prior to resizing back to the original image resolution. This prevents
+  # "top hat" artifacts. We therefore need to expand the reference boxes by an
+  # appropriate factor.
+  scale = max((mask_width + 2.0) / mask_width,
+              (mask_height + 2.0) / mask_height)
+  ref_boxes = _expand_boxes(detected_boxes, scale).astype(np.int32)
+  padded_masks = np.zeros((num_masks, mask_height + 2, mask_width + 2),
+                          np.float32)
+  padded_masks[:, 1:-1, 1:-1] = masks
+
+  widths = np.maximum(ref_boxes[:, 2] - ref_boxes[:, 0] + 1, 1)
+  heights = np.maximum(ref_boxes[:, 3] - ref_boxes[:, 1] + 1, 1)
+  x_0 = np.clip(ref_boxes[:, 0], 0, image_width)
+  x_1 = np.clip(ref_boxes[:, 2] + 1, 0, image_width)
+  y_0 = np.clip(ref_boxes[:, 1], 0, image_height)
+  y_1 = np.clip(ref_boxes[:, 3] + 1, 0, image_height)
+  window_widths = x_1 - x_0
+  window_heights = y_1 - y_0
+
+  # windows within a factor of 2 of each other in both sizes are padded to
+  # the same size
+  visible = np.flatnonzero((window_widths > 0) & (window_heights > 0))
+  size_classes = np.stack([
+      np.ceil(np.log2(window_heights[visible])),
+      np.ceil(np.log2(window_widths[visible]))
+  ], -1)
+  _, group_of = np.unique(size_classes, axis=0, return_inverse=True)
+  group_of = group_of.reshape([-1])
+  order = np.argsort(group_of, kind='stable')
+  splits = np.flatnonzero(np.diff(group_of[order])) + 1
+  for group in np.split(visible[order], splits):
+    if not group.size:
+      continue
+    length_y = int(window_heights[group].max())
+    length_x = int(window_widths[group].max())
+    chunk_size = max(_MAX_PASTE_PIXELS // (length_y * length_x), 1)
+    for start in range(0, group.size, chunk_size):
+      chunk = group[start:start + chunk_size]
+      # the columns of the windows, then the rows like cv2.resize
+      weights_x = _linear_weights(mask_width + 2, widths[chunk],
+                                  x_0[chunk] - ref_boxes[chunk, 0], length_x)
+      weights_y = _linear_weights(mask_height + 2, heights[chunk],
+                                  y_0[chunk] - ref_boxes[chunk, 1], length_y)
+      rows = np.matmul(padded_masks[chunk], weights_x.transpose([0, 2, 1]))
+      windows = np.matmul(weights_y, rows) > 0.5
+      windows &= (np.arange(length_y)[:, None] <
+                  window_heights[chunk, None, None])
+      windows &= np.arange(length_x) < window_widths[chunk, None, None]
+      yield chunk, windows, y_0[chunk], x_0[chunk]
+
+
 def paste_instance_masks(masks,
                          detected_boxes,
                          image_height,
                          image_width):
   """Paste instance masks to generate the image segmentation results.
 
+  The masks are resized with the bilinear interpolation of cv2.resize, in
+  batches and only inside the image.
+
   Args:
     masks: a numpy array of shape [N, mask_height, mask_width] representing the
       instance masks w.r.t. the `detected_boxes`.
@@ -38,70 +172,72 @@ def paste_instance_masks(masks,
     segms: a numpy array of shape [N, image_height, image_width] representing
       the instance masks *pasted* on the image canvas.
   """
+  segms = np.zeros((masks.shape[0], image_height, image_width), np.uint8)
+  flat_segms = segms.reshape([-1])
+  for instances, windows, y_0, x_0 in _paste_windows(
+      masks, detected_boxes, image_height, image_width):
+    n, y, x = np.nonzero(windows)
+    flat_segms[(instances[n] * image_height + y_0[n] + y) * image_width +
+               x_0[n] + x] = 1
+  return segms
 
-  def expand_boxes(boxes, scale):
-    """Expands an array of boxes by a given scale."""
-    # Reference: https://github.com/facebookresearch/Detectron/blob/master/detectron/utils/boxes.py#L227  # pylint: disable=line-too-long
-    # The `boxes` in the reference implementation is in [x1, y1, x2, y2] form,
-    # whereas `boxes` here is in [x1, y1, w, h] form
-    w_half = boxes[:, 2] * .5
-    h_half = boxes[:, 3] * .5
-    x_c = boxes[:, 0] + w_half
-    y_c = boxes[:, 1] + h_half
-
-    w_half *= scale
-    h_half *= scale
 
-    boxes_exp = np.zeros(boxes.shape)
-    boxes_exp[:, 0] = x_c - w_half
-    boxes_exp[:, 2] = x_c + w_half
-    boxes_exp[:, 1] = y_c - h_half
-    boxes_exp[:, 3] = y_c + h_half
+def paste_instance_masks_rle(masks,
+                             detected_boxes,
+                             image_height,
+                             image_width):
+  """Paste instance masks as uncompressed COCO run-length encodings.
 
-    return boxes_exp
+  The same masks as `paste_instance_masks`, but the runs are found in the
+  windows of the boxes in the image, without dense image masks.
 
-  # Reference: https://github.com/facebookresearch/Detectron/blob/master/detectron/core/test.py#L812  # pylint: disable=line-too-long
-  # To work around an issue with cv2.resize (it seems to automatically pad
-  # with repeated border values), we manually zero-pad the masks by 1 pixel
-  # prior to resizing back to the original image resolution. This prevents
-  # "top hat" artifacts. We therefore need to expand the reference boxes by an
-  # appropriate factor.
-  _, mask_height, mask_width = masks.shape
-  scale = max((mask_width + 2.0) / mask_width,
-              (mask_height + 2.0) / mask_height)
+  Args:
+    masks: a numpy array of shape [N, mask_height, mask_width] representing the
+      instance masks w.r.t. the `detected_boxes`.
+    detected_boxes: a numpy array of shape [N, 4] representing the reference
+      bounding boxes.
+    image_height: an integer representing the height of the image.
+    image_width: an integer representing the width of the image.
 
-  ref_boxes = expand_boxes(detected_boxes, scale)
-  ref_boxes = ref_boxes.astype(np.int32)
-  padded_mask = np.zeros((mask_height + 2, mask_width + 2), dtype=np.float32)
-  segms = []
-  for mask_ind, mask in enumerate(masks):
-    im_mask = np.zeros((image_height, image_width), dtype=np.uint8)
-    # Process mask inside bounding boxes.
-    padded_mask[1:-1, 1:-1] = mask[:, :]
-
-    ref_box = ref_boxes[mask_ind, :]
-    w = ref_box[2] - ref_box[0] + 1
-    h = ref_box[3] - ref_box[1] + 1
-    w = np.maximum(w, 1)
-    h = np.maximum(h, 1)
-
-    mask = cv2.resize(padded_mask, (w, h))
-    mask = np.array(mask > 0.5, dtype=np.uint8)
-
-    x_0 = min(max(ref_box[0], 0), image_width)
-    x_1 = min(max(ref_box[2] + 1, 0), image_width)
-    y_0 = min(max(ref_box[1], 0), image_height)
-    y_1 = min(max(ref_box[3] + 1, 0), image_height)
-
-    im_mask[y_0:y_1, x_0:x_1] = mask[
-        (y_0 - ref_box[1]):(y_1 - ref_box[1]),
-        (x_0 - ref_box[0]):(x_1 - ref_box[0])
-    ]
-    segms.append(im_mask)
+  Returns:
+    rles: a list of N dictionaries with the `size` [image_height, image_width]
+      and the column-major `counts` of each mask, alternating the lengths of
+      the runs of zeros and ones starting with zeros, as taken by
+      `pycocotools.mask.frPyObjects`.
+  """
+  num_pixels = image_height * image_width
+  instance_runs = []
+  for instances, windows, y_0, x_0 in _paste_windows(
+      masks, detected_boxes, image_height, image_width):
+    # the runs start and end in the columns, zero-pad the column ends
+    windows = np.pad(windows.transpose([0, 2, 1]), [[0, 0], [0, 0], [1, 1]])
+    n, x, y = np.nonzero(windows[..., 1:] != windows[..., :-1])
+    # the pixel index of each start and end in the column-major image
+    runs = ((x_0[n] + x) * image_height + y_0[n] + y).reshape([-1, 2])
+    n = instances[n[::2]]
+    # a run that ends at the bottom of a column and starts again at the top of
+    # the next one continues
+    continued = (n[1:] == n[:-1]) & (runs[1:, 0] == runs[:-1, 1])
+    runs[:-1, 1] = np.where(continued, -1, runs[:-1, 1])
+    runs[1:, 0] = np.where(continued, -1, runs[1:, 0])
+    instance_runs.append((n, runs))
 
-  segms = np.array(segms)
-  assert masks.shape[0] == segms.shape[0]
-  return segms
+  if instance_runs:
+    n, runs = (np.concatenate(x) for x in zip(*instance_runs))
+  else:
+    n, runs = np.zeros([0], np.int64), np.zeros([0, 2], np.int64)
+  order = np.argsort(n, kind='stable')
+  n, runs = n[order], runs[order]
+  splits = np.searchsorted(n, np.arange(1, masks.shape[0] + 1))
+  rles = []
+  for start, end in zip(np.concatenate([[0], splits[:-1]]), splits):
+    boundaries = runs[start:end].reshape([-1])
+    boundaries = boundaries[boundaries >= 0]
+    counts = np.diff(np.concatenate([[0], boundaries, [num_pixels]]))
+    if counts.size > 1 and not counts[-1]:
+      counts = counts[:-1]
+    rles.append({'size': [image_height, image_width], 'counts': counts.tolist()})
+  return rles
 
 
 def paste_instance_masks_v2(masks,
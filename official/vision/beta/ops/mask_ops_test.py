@@ -16,11 +16,49 @@
 """Tests for mask_ops.py."""
 
 # Import libraries
+import cv2
 import numpy as np
+from pycocotools import mask as mask_api
 import tensorflow as tf
 from official.vision.beta.ops import mask_ops
 
 
+def _reference_paste(masks, detected_boxes, image_height, image_width):
+  """Pastes the masks one by one with cv2.resize."""
+  _, mask_height, mask_width = masks.shape
+  scale = max((mask_width + 2.0) / mask_width,
+              (mask_height + 2.0) / mask_height)
+  ref_boxes = mask_ops._expand_boxes(detected_boxes, scale).astype(np.int32)
+  segms = np.zeros((len(masks), image_height, image_width), np.uint8)
+  for i, mask in enumerate(masks):
+    padded_mask = np.pad(mask.astype(np.float32), 1)
+    x_min, y_min, x_max, y_max = ref_boxes[i]
+    w = max(x_max - x_min + 1, 1)
+    h = max(y_max - y_min + 1, 1)
+    mask = cv2.resize(padded_mask, (w, h)) > 0.5
+    x_0 = min(max(x_min, 0), image_width)
+    x_1 = min(max(x_max + 1, 0), image_width)
+    y_0 = min(max(y_min, 0), image_height)
+    y_1 = min(max(y_max + 1, 0), image_height)
+    segms[i, y_0:y_1, x_0:x_1] = mask[(y_0 - y_min):(y_1 - y_min),
+                                      (x_0 - x_min):(x_1 - x_min)]
+  return segms
+
+
+def _random_instances(num_instances, image_height, image_width, seed=0):
+  rng = np.random.RandomState(seed)
+  masks = rng.uniform(-0.5, 1.5, (num_instances, 14, 14)).astype(np.float32)
+  masks = cv2.blur(masks.transpose([1, 2, 0]), (3, 3)).transpose([2, 0, 1])
+  xy = rng.uniform(-0.2, 1.0, (num_instances, 2)) * [image_width, image_height]
+  wh = np.exp(rng.uniform(0, np.log(image_height * 1.5), (num_instances, 2)))
+  boxes = np.concatenate([xy, wh], -1)
+  # the whole image, beyond the image and smaller than a pixel
+  boxes[:3] = [[0, 0, image_width, image_height],
+               [-8, -8, image_width + 16, image_height + 16], [3, 5, 0.5, 0.5]]
+  boxes[3] = [image_width + 10, 0, 20, 20]
+  return masks, boxes
+
+
 class MaskUtilsTest(tf.test.TestCase):
 
   def testPasteInstanceMasks(self):
@@ -34,6 +72,31 @@ class MaskUtilsTest(tf.test.TestCase):
     _ = mask_ops.paste_instance_masks(
         masks, detected_boxes, image_height, image_width)
 
+  def testPasteInstanceMasksMatchesResize(self):
+    masks, boxes = _random_instances(60, 48, 64)
+    image_masks = mask_ops.paste_instance_masks(masks, boxes, 48, 64)
+    self.assertEqual(image_masks.dtype, np.uint8)
+    self.assertAllEqual(image_masks, _reference_paste(masks, boxes, 48, 64))
+    self.assertGreater(image_masks.sum(), 0)
+
+  def testPasteInstanceMasksRle(self):
+    masks, boxes = _random_instances(60, 48, 64, seed=1)
+    image_masks = mask_ops.paste_instance_masks(masks, boxes, 48, 64)
+    rles = mask_ops.paste_instance_masks_rle(masks, boxes, 48, 64)
+    self.assertLen(rles, 60)
+    self.assertEqual(rles[0]['size'], [48, 64])
+    self.assertEqual(
+        mask_api.frPyObjects(rles, 48, 64),
+        [mask_api.encode(np.asfortranarray(mask)) for mask in image_masks])
+
+  def testPasteNoInstances(self):
+    masks = np.zeros((0, 6, 6))
+    boxes = np.zeros((0, 4))
+    self.assertEqual(
+        mask_ops.paste_instance_masks(masks, boxes, 10, 12).shape, (0, 10, 12))
+    self.assertEqual(mask_ops.paste_instance_masks_rle(masks, boxes, 10, 12),
+                     [])
+
   def testPasteInstanceMasksV2(self):
     image_height = 10
     image_width = 10
@@ -82,6 +82,8 @@ class Controller:
       # Train related
       steps_per_loop: Optional[int] = None,
       checkpoint_manager: Optional[tf.train.CheckpointManager] = None,
+      async_checkpoint: bool = False,
+      step_time_monitor: Optional[utils.StepTimeMonitor] = None,
       # Summary related
       summary_interval: Optional[int] = None,
       summary_dir: Optional[str] = None,
@@ -117,6 +119,20 @@ class Controller:
         the model will be restored from the most recent checkpoint inside this
         `__init__` method. If not provided, the `Controller` will not
         automatically save to or restore from checkpoints.
+      async_checkpoint: Whether to write checkpoints in the background with
+        `tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)`.
+        If `True`, saving a checkpoint only copies the checkpointed values to
+        host memory at the step boundary, and training continues while
+        TensorFlow writes the files and deletes old checkpoints. At most one
+        save is in flight, `train`, `train_and_evaluate`, and `save_checkpoint`
+        wait for it to complete before returning. The time each save blocks
+        training for is summarized as "checkpoint_snapshot_seconds".
+      step_time_monitor: An optional `orbit.utils.StepTimeMonitor`. If
+        provided, the time per training step is broken down into the time
+        waiting on the input (if the trainer measures it, see
+        `StandardTrainerOptions.measure_input_wait`), the rest of
+        `trainer.train`, and the host-side work of the `Controller`, and
+        moving percentiles of each are written as training summaries.
       summary_interval: Step interval for training summaries. Note that this
         argument only applies to `tf.summary` calls inside the `trainer.train`
         function. Summaries written by the `Controller` (specifically
@@ -135,6 +151,8 @@ class Controller:
       ValueError: If `steps_per_loop` is not a positive integer.
       ValueError: If `summary_interval` is not a positive integer or is not
         divisible by `steps_per_loop`.
+      NotImplementedError: If `async_checkpoint` is `True` and this version
+        of TensorFlow does not support asynchronous checkpointing.
     """
     if trainer is None and evaluator is None:
       raise ValueError("`trainer` and `evaluator` should not both be `None`.")
@@ -165,11 +183,15 @@ class Controller:
 
     self.global_step = global_step
     self.checkpoint_manager = checkpoint_manager
+    self.checkpoint_saver = None
+    if async_checkpoint and checkpoint_manager is not None:
+      self.checkpoint_saver = utils.AsyncCheckpointSaver(checkpoint_manager)
 
     if self.trainer is not None:
       self.step_timer = None
       self.steps_per_loop = steps_per_loop
       self.summary_interval = summary_interval
+      self.step_time_monitor = step_time_monitor
       self.summary_manager = utils.SummaryManager(
           summary_dir, tf.summary.scalar, global_step=self.global_step)
 
@@ -209,15 +231,26 @@ class Controller:
     # TODO(momernick): Support steps=None or -1 (training to exhaustion).
     current_step = self.global_step.numpy()  # Cache, since this is expensive.
     _log(f"train | step: {current_step: 6d} | training until step {steps}...")
-    while current_step < steps:
-      # Calculates steps to run for the next train loop.
-      num_steps = min(steps - current_step, self.steps_per_loop)
-      self._train_n_steps(num_steps)
-      self._maybe_save_checkpoint()
-      current_step = self.global_step.numpy()
-
-    if checkpoint_at_completion:
-      self._maybe_save_checkpoint(check_interval=False)
+    try:
+      while current_step < steps:
+        # Calculates steps to run for the next train loop.
+        num_steps = min(steps - current_step, self.steps_per_loop)
+        if self.step_time_monitor is not None:
+          self.step_time_monitor.loop_begin()
+        self._train_n_steps(num_steps)
+        self._maybe_save_checkpoint()
+        if self.step_time_monitor is not None:
+          self.step_time_monitor.loop_end(num_steps)
+          self.summary_manager.write_summaries(
+              self.step_time_monitor.summaries())
+          self.summary_manager.flush()
+        current_step = self.global_step.numpy()
+
+      if checkpoint_at_completion:
+        self._maybe_save_checkpoint(check_interval=False)
+    finally:
+      # Waits for the checkpoint in flight, even if training failed.
+      self._wait_for_checkpoint()
 
   def evaluate(self, steps: int = -1) -> Optional[runner.Output]:
     """Runs evaluation for the given number of steps.
@@ -304,6 +337,7 @@ class Controller:
       self.evaluate(steps=eval_steps)
       current_step = self.global_step.numpy()
     self._maybe_save_checkpoint(check_interval=False)
+    self._wait_for_checkpoint()
 
   def evaluate_continuously(self,
                             steps: int = -1,
@@ -352,6 +386,7 @@ class Controller:
       restore occurred.
     """
     self._require("checkpoint_manager", for_method="restore_checkpoint")
+    self._wait_for_checkpoint()
 
     with self.strategy.scope():
       # Checkpoint restoring should be inside scope (b/139450638).
@@ -381,6 +416,7 @@ class Controller:
     """
     self._require("checkpoint_manager", for_method="save_checkpoint")
     self._maybe_save_checkpoint(check_interval=False)
+    self._wait_for_checkpoint()
 
   def _train_n_steps(self, num_steps: int):
     """Runs training for `num_steps` steps.
@@ -407,8 +443,13 @@ class Controller:
         should_record = lambda: (self.global_step % self.summary_interval == 0)
       with tf.summary.record_if(should_record):
         num_steps_tensor = tf.convert_to_tensor(num_steps, dtype=tf.int32)
+        if self.step_time_monitor is not None:
+          self.step_time_monitor.train_begin(
+              getattr(self.trainer, "input_wait_seconds", None))
         train_output = self.trainer.train(num_steps_tensor)
     train_output = tf.nest.map_structure(utils.get_value, train_output or {})
+    if self.step_time_monitor is not None:
+      self.step_time_monitor.train_end()
 
     # Verify that global_step was updated properly, then update current_step.
     expected_step = current_step + num_steps
@@ -447,15 +488,37 @@ class Controller:
       A boolean indicating whether a checkpoint was saved.
     """
     if self.checkpoint_manager and self.checkpoint_manager.checkpoint_interval:
+      if self.checkpoint_saver is not None:
+        ckpt_path = self.checkpoint_saver.save(
+            checkpoint_number=self.global_step.numpy(),
+            check_interval=check_interval)
+        if ckpt_path is not None:
+          _log(f"saving checkpoint to {ckpt_path} in the background.")
+          self._write_checkpoint_summaries()
+          return True
+        return False
       ckpt_path = self.checkpoint_manager.save(
           checkpoint_number=self.global_step.numpy(),
-          
           check_interval=check_interval)
       if ckpt_path is not None:
         _log(f"saved checkpoint to {ckpt_path}.")
         return True
     return False
 
+  def _wait_for_checkpoint(self):
+    """Waits for the checkpoint being written in the background, if any."""
+    if self.checkpoint_saver is not None:
+      self.checkpoint_saver.wait()
+
+  def _write_checkpoint_summaries(self):
+    """Summarizes the time the asynchronous checkpoint save blocked for."""
+    if self.trainer is None:
+      return
+    self.summary_manager.write_summaries({
+        "checkpoint_snapshot_seconds": self.checkpoint_saver.snapshot_seconds
+    })
+    self.summary_manager.flush()
+
   def _require(self, attribute, for_method):
     """Utility method to raise an error if the given `attribute` is not set."""
     if getattr(self, attribute, None) is None:
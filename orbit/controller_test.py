@@ -16,6 +16,8 @@
 
 import os
 
+from unittest import mock
+
 from absl import logging
 from absl.testing import parameterized
 
@@ -24,6 +26,8 @@ import numpy as np
 from orbit import controller
 from orbit import runner
 from orbit import standard_runner
+from orbit import utils
+from orbit.utils import async_checkpoint
 
 import tensorflow as tf
 
@@ -61,7 +65,7 @@ class TestRunner(standard_runner.StandardTrainer,
                  standard_runner.StandardEvaluator):
   """Implements the training and evaluation APIs for the test model."""
 
-  def __init__(self, return_numpy=False):
+  def __init__(self, return_numpy=False, train_options=None):
     self.strategy = tf.distribute.get_strategy()
     self.model = create_model()
     self.optimizer = tf.keras.optimizers.RMSprop(learning_rate=0.1)
@@ -71,7 +75,8 @@ class TestRunner(standard_runner.StandardTrainer,
     self.return_numpy = return_numpy
     train_dataset = self.strategy.distribute_datasets_from_function(dataset_fn)
     eval_dataset = self.strategy.distribute_datasets_from_function(dataset_fn)
-    standard_runner.StandardTrainer.__init__(self, train_dataset)
+    standard_runner.StandardTrainer.__init__(
+        self, train_dataset, options=train_options)
     standard_runner.StandardEvaluator.__init__(self, eval_dataset)
 
   def train_step(self, iterator):
@@ -435,6 +440,127 @@ class ControllerTest(tf.test.TestCase, parameterized.TestCase):
     self.assertFalse(
         tf.io.gfile.exists(os.path.join(self.model_dir, "summaries/eval")))
 
+  def test_async_checkpoint(self):
+    if not async_checkpoint.is_supported():
+      self.skipTest("Asynchronous checkpointing is not supported.")
+    test_runner = TestRunner()
+
+    checkpoint = tf.train.Checkpoint(
+        model=test_runner.model, optimizer=test_runner.optimizer)
+    checkpoint_manager = tf.train.CheckpointManager(
+        checkpoint,
+        self.model_dir,
+        max_to_keep=2,
+        step_counter=test_runner.global_step,
+        checkpoint_interval=4)
+    test_controller = controller.Controller(
+        trainer=test_runner,
+        global_step=test_runner.global_step,
+        steps_per_loop=2,
+        summary_dir=os.path.join(self.model_dir, "summaries/train"),
+        checkpoint_manager=checkpoint_manager,
+        async_checkpoint=True)
+    test_controller.train(steps=10)
+
+    # Old checkpoints are deleted once the last one is written.
+    self.assertEqual(checkpoint_manager.checkpoints,
+                     [os.path.join(self.model_dir, f"ckpt-{step}")
+                      for step in [6, 10]])
+    self.assertEqual(
+        tf.train.latest_checkpoint(self.model_dir),
+        os.path.join(self.model_dir, "ckpt-10"))
+    self.assertEmpty(tf.io.gfile.glob(os.path.join(self.model_dir, "ckpt-2*")))
+
+    # The last checkpoint holds the final values of the model and optimizer.
+    restored_runner = TestRunner()
+    restored_checkpoint = tf.train.Checkpoint(
+        model=restored_runner.model, optimizer=restored_runner.optimizer)
+    restored_checkpoint.restore(
+        checkpoint_manager.latest_checkpoint).assert_existing_objects_matched()
+    self.assertEqual(restored_runner.global_step.numpy(), 10)
+    self.assertAllClose(test_runner.model.get_weights(),
+                        restored_runner.model.get_weights())
+
+    # The save latencies are summarized.
+    train_summary_dir = os.path.join(self.model_dir, "summaries/train")
+    self.assertNotEmpty(
+        summaries_with_matching_keyword("checkpoint_snapshot_seconds",
+                                        train_summary_dir))
+
+  def test_async_checkpoint_waits_without_checkpoint_at_completion(self):
+    if not async_checkpoint.is_supported():
+      self.skipTest("Asynchronous checkpointing is not supported.")
+    test_runner = TestRunner()
+    checkpoint_manager = tf.train.CheckpointManager(
+        tf.train.Checkpoint(model=test_runner.model),
+        self.model_dir,
+        max_to_keep=None,
+        step_counter=test_runner.global_step,
+        checkpoint_interval=2)
+    test_controller = controller.Controller(
+        trainer=test_runner,
+        global_step=test_runner.global_step,
+        steps_per_loop=2,
+        checkpoint_manager=checkpoint_manager,
+        async_checkpoint=True)
+    test_controller.train(steps=4, checkpoint_at_completion=False)
+    self.assertEqual(
+        tf.train.latest_checkpoint(self.model_dir),
+        os.path.join(self.model_dir, "ckpt-4"))
+
+    # The save in flight is also waited for when training fails.
+    with mock.patch.object(
+        test_controller, "_train_n_steps", side_effect=RuntimeError):
+      with mock.patch.object(
+          checkpoint_manager, "sync", wraps=checkpoint_manager.sync) as sync:
+        with self.assertRaises(RuntimeError):
+          test_controller.train(steps=6, checkpoint_at_completion=False)
+    sync.assert_called()
+
+  def test_async_checkpoint_unsupported(self):
+    test_runner = TestRunner()
+    checkpoint_manager = tf.train.CheckpointManager(
+        tf.train.Checkpoint(model=test_runner.model),
+        self.model_dir,
+        max_to_keep=None)
+    with mock.patch.object(
+        async_checkpoint, "is_supported", return_value=False):
+      with self.assertRaises(NotImplementedError):
+        controller.Controller(
+            trainer=test_runner,
+            global_step=test_runner.global_step,
+            steps_per_loop=2,
+            checkpoint_manager=checkpoint_manager,
+            async_checkpoint=True)
+
+  @parameterized.parameters(True, False)
+  def test_step_time_monitor(self, measure_input_wait):
+    test_runner = TestRunner(
+        train_options=standard_runner.StandardTrainerOptions(
+            measure_input_wait=measure_input_wait))
+    test_controller = controller.Controller(
+        trainer=test_runner,
+        global_step=test_runner.global_step,
+        steps_per_loop=2,
+        summary_dir=os.path.join(self.model_dir, "summaries/train"),
+        step_time_monitor=utils.StepTimeMonitor(percentiles=(50, 90)))
+    test_controller.train(steps=10)
+
+    train_summary_dir = os.path.join(self.model_dir, "summaries/train")
+    components = ["compute", "host", "total"]
+    if measure_input_wait:
+      components.append("input_wait")
+      self.assertGreater(test_runner.input_wait_seconds.numpy(), 0)
+    for component in components:
+      for percentile in [50, 90]:
+        self.assertNotEmpty(
+            summaries_with_matching_keyword(
+                f"step_time/{component}_p{percentile}", train_summary_dir))
+    self.assertEqual(
+        bool(summaries_with_matching_keyword("step_time/input_wait",
+                                             train_summary_dir)),
+        measure_input_wait)
+
   def test_evaluate_only(self):
     test_runner = TestRunner()
 
@@ -41,6 +41,7 @@ import dataclasses
 
 from orbit import runner
 from orbit.utils import loop_fns
+from orbit.utils import step_time_monitor
 
 import tensorflow as tf
 
@@ -62,10 +63,16 @@ class StandardTrainerOptions:
       `True`, this optimization creates two `tf.function`s with two XLA programs
       (one with summary calls, and one without). The program with summaries runs
       only for one step when summaries should be recorded.
+    measure_input_wait: A boolean indicating whether to measure the time
+      `train_step` waits on the training iterators. If `True`, the iterators
+      passed to `train_step` are `orbit.utils.TimedIterator`s adding their wait
+      to the `input_wait_seconds` variable of the trainer, which the
+      `Controller` reports if given a `step_time_monitor`.
   """
   use_tf_function: bool = True
   use_tf_while_loop: bool = True
   use_tpu_summary_optimization: bool = False
+  measure_input_wait: bool = False
 
 
 def _create_train_loop_fn(train_step_fn, options: StandardTrainerOptions):
@@ -118,6 +125,10 @@ class StandardTrainer(runner.AbstractTrainer, metaclass=abc.ABCMeta):
     self._train_dataset = train_dataset
     self._train_iter = None
     self._train_loop_fn = None
+    self._input_wait_seconds = None
+    if options.measure_input_wait:
+      self._input_wait_seconds = tf.Variable(
+          0.0, dtype=tf.float64, trainable=False, name="input_wait_seconds")
 
   def train(self, num_steps: tf.Tensor) -> Optional[runner.Output]:
     """Implements `num_steps` steps of training.
@@ -137,6 +148,11 @@ class StandardTrainer(runner.AbstractTrainer, metaclass=abc.ABCMeta):
 
     if self._train_iter is None:
       self._train_iter = tf.nest.map_structure(iter, self.train_dataset)
+      if self._input_wait_seconds is not None:
+        wait_seconds = self._input_wait_seconds
+        self._train_iter = tf.nest.map_structure(
+            lambda it: step_time_monitor.TimedIterator(it, wait_seconds),
+            self._train_iter)
 
     self._train_loop_fn(self._train_iter, num_steps)
     return self.train_loop_end()
@@ -187,6 +203,14 @@ class StandardTrainer(runner.AbstractTrainer, metaclass=abc.ABCMeta):
     """
     pass
 
+  @property
+  def input_wait_seconds(self) -> Optional[tf.Variable]:
+    """The total seconds `train_step` waited on the training iterators.
+
+    `None` unless `measure_input_wait` is set in the options.
+    """
+    return self._input_wait_seconds
+
   @property
   def train_dataset(self):
     """The current training dataset."""
@@ -122,6 +122,16 @@ class StandardRunnerTest(parameterized.TestCase):
     trainer = TestTrainer(options)
     self.assertEqual(trainer.train(tf.constant(10)), 10)
 
+  @parameterized.named_parameters(("use_tf_while_loop", True), ("", False))
+  def test_trainer_measures_input_wait(self, use_tf_while_loop):
+    options = standard_runner.StandardTrainerOptions(
+        use_tf_while_loop=use_tf_while_loop, measure_input_wait=True)
+    trainer = TestTrainer(options)
+    self.assertEqual(trainer.input_wait_seconds.numpy(), 0)
+    self.assertEqual(trainer.train(tf.constant(10)), 10)
+    self.assertGreater(trainer.input_wait_seconds.numpy(), 0)
+    self.assertIsNone(TestTrainer().input_wait_seconds)
+
   @parameterized.named_parameters(("use_tf_while_loop", True), ("", False))
   def test_default_evaluator(self, use_tf_while_loop):
     options = standard_runner.StandardEvaluatorOptions(
@@ -14,6 +14,8 @@
 
 """Defines exported symbols for the `orbit.utils` package."""
 
+from orbit.utils.async_checkpoint import AsyncCheckpointSaver
+
 from orbit.utils.common import create_global_step
 from orbit.utils.common import get_value
 from orbit.utils.common import make_distributed_dataset
@@ -24,6 +26,9 @@ from orbit.utils.loop_fns import create_loop_fn
 from orbit.utils.loop_fns import create_tf_while_loop_fn
 from orbit.utils.loop_fns import LoopFnWithSummaries
 
+from orbit.utils.step_time_monitor import StepTimeMonitor
+from orbit.utils.step_time_monitor import TimedIterator
+
 from orbit.utils.summary_manager import SummaryManager
 
 from orbit.utils.tpu_summaries import OptionalSummariesFunction
@@ -0,0 +1,94 @@
+# Copyright 2021 The Orbit Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Provides a utility class for saving checkpoints in the background."""
+
+import time
+
+from typing import Optional
+
+import tensorflow as tf
+
+
+def is_supported() -> bool:
+  """Returns whether TensorFlow can write checkpoints in the background."""
+  try:
+    tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+  except TypeError:
+    return False
+  return hasattr(tf.train.CheckpointManager, "sync")
+
+
+class AsyncCheckpointSaver:
+  """Saves the checkpoints of a `tf.train.CheckpointManager` in the background.
+
+  This is a thin wrapper around `CheckpointManager.save` with
+  `tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)`:
+  `save` copies the checkpointed values to host memory and returns, and
+  TensorFlow writes the copies, updates the checkpoint state file, and deletes
+  the checkpoints that the manager no longer keeps in a background thread. At
+  most one save is in flight: a save first waits for the previous one.
+
+  The time the last save blocked for, i.e. the copy and the wait for the
+  previous save, is recorded as `snapshot_seconds`.
+  """
+
+  def __init__(self, checkpoint_manager: tf.train.CheckpointManager):
+    """Initializes the `AsyncCheckpointSaver` instance.
+
+    Args:
+      checkpoint_manager: The `tf.train.CheckpointManager` whose checkpoints
+        are saved.
+
+    Raises:
+      NotImplementedError: If this version of TensorFlow does not support
+        asynchronous checkpointing (see `is_supported`).
+    """
+    if not is_supported():
+      raise NotImplementedError(
+          "Asynchronous checkpointing is not supported by this version of "
+          "TensorFlow: `tf.train.CheckpointOptions` has no "
+          "`experimental_enable_async_checkpoint`.")
+    self._manager = checkpoint_manager
+    self._options = tf.train.CheckpointOptions(
+        experimental_enable_async_checkpoint=True)
+    self.snapshot_seconds = None
+
+  def save(self,
+           checkpoint_number=None,
+           check_interval: bool = True) -> Optional[str]:
+    """Takes a snapshot of the checkpoint and writes it in the background.
+
+    Args:
+      checkpoint_number: An optional integer, or an integer-dtype `Variable` or
+        `Tensor`, used to number the checkpoint, as in `CheckpointManager.save`.
+      check_interval: Whether to skip the save if the checkpoint interval of
+        the manager has not elapsed since the last save.
+
+    Returns:
+      The path prefix of the checkpoint being written, or `None` if no
+      checkpoint is saved.
+    """
+    start = time.time()
+    path = self._manager.save(
+        checkpoint_number=checkpoint_number,
+        check_interval=check_interval,
+        options=self._options)
+    if path is not None:
+      self.snapshot_seconds = time.time() - start
+    return path
+
+  def wait(self):
+    """Waits for the checkpoint in flight, if any, to be written."""
+    self._manager.sync()
@@ -0,0 +1,90 @@
+# Copyright 2021 The Orbit Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for orbit.utils.async_checkpoint."""
+
+import os
+
+from unittest import mock
+
+from orbit.utils import async_checkpoint
+
+import tensorflow as tf
+
+
+class AsyncCheckpointSaverTest(tf.test.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    if not async_checkpoint.is_supported():
+      self.skipTest("Asynchronous checkpointing is not supported.")
+
+  def test_saves_snapshot(self):
+    variable = tf.Variable(tf.zeros([256, 256]))
+    checkpoint = tf.train.Checkpoint(variable=variable)
+    checkpoint_manager = tf.train.CheckpointManager(
+        checkpoint, self.get_temp_dir(), max_to_keep=2)
+    saver = async_checkpoint.AsyncCheckpointSaver(checkpoint_manager)
+
+    for value in range(1, 5):
+      variable.assign(tf.fill([256, 256], float(value)))
+      path = saver.save(checkpoint_number=value)
+      # Updates after the snapshot are not saved.
+      variable.assign_add(tf.ones([256, 256]))
+    saver.wait()
+
+    self.assertEqual(path, os.path.join(self.get_temp_dir(), "ckpt-4"))
+    self.assertEqual(checkpoint_manager.checkpoints,
+                     [os.path.join(self.get_temp_dir(), "ckpt-3"), path])
+    self.assertEqual(tf.train.latest_checkpoint(self.get_temp_dir()), path)
+    self.assertEqual(checkpoint.save_counter.numpy(), 4)
+    self.assertGreaterEqual(saver.snapshot_seconds, 0.0)
+    checkpoint.restore(path).assert_consumed()
+    self.assertAllEqual(variable.numpy(), tf.fill([256, 256], 4.0))
+
+  def test_checkpoint_interval(self):
+    step = tf.Variable(0, dtype=tf.int64)
+    checkpoint = tf.train.Checkpoint(step=step)
+    checkpoint_manager = tf.train.CheckpointManager(
+        checkpoint,
+        self.get_temp_dir(),
+        max_to_keep=None,
+        step_counter=step,
+        checkpoint_interval=3)
+    saver = async_checkpoint.AsyncCheckpointSaver(checkpoint_manager)
+
+    saved_steps = []
+    for _ in range(8):
+      step.assign_add(1)
+      if saver.save(checkpoint_number=step) is not None:
+        saved_steps.append(step.numpy())
+    self.assertEqual(saved_steps, [1, 4, 7])
+    self.assertIsNotNone(
+        saver.save(checkpoint_number=step, check_interval=False))
+    # A step is only saved once.
+    self.assertIsNone(saver.save(checkpoint_number=step, check_interval=False))
+    saver.wait()
+    self.assertLen(checkpoint_manager.checkpoints, 4)
+
+  def test_unsupported(self):
+    checkpoint_manager = tf.train.CheckpointManager(
+        tf.train.Checkpoint(), self.get_temp_dir(), max_to_keep=1)
+    with mock.patch.object(
+        async_checkpoint, "is_supported", return_value=False):
+      with self.assertRaises(NotImplementedError):
+        async_checkpoint.AsyncCheckpointSaver(checkpoint_manager)
+
+
+if __name__ == "__main__":
+  tf.test.main()
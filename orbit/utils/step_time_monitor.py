@@ -0,0 +1,241 @@
+# Copyright 2021 The Orbit Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Provides utilities to break down where the time of training steps goes."""
+
+import collections
+import time
+
+from typing import Dict, Optional, Sequence
+
+from absl import logging
+
+import numpy as np
+import tensorflow as tf
+
+# The number of loops to observe before step time regressions are detected.
+_MIN_LOOPS_FOR_REGRESSION = 5
+
+
+class TimedIterator:
+  """Wraps an iterator to accumulate the time spent waiting for its elements.
+
+  The wait is measured with `tf.timestamp` ops ordered around the dequeue, so
+  it is also measured when `next` is called inside a `tf.function` or a
+  `tf.while_loop`. As the stateful ops of a `tf.function` run in program order,
+  it only covers the time blocked in `get_next`, not the previous step.
+  """
+
+  def __init__(self, iterator, wait_seconds: tf.Variable):
+    """Initializes the `TimedIterator` instance.
+
+    Args:
+      iterator: The `tf.data.Iterator` or `DistributedIterator` to wrap.
+      wait_seconds: A scalar float64 `tf.Variable` the wait is added to.
+    """
+    self._iterator = iterator
+    self._wait_seconds = wait_seconds
+
+  @property
+  def element_spec(self):
+    """The type specification of the elements of the wrapped iterator."""
+    return self._iterator.element_spec
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return self._timed(lambda: next(self._iterator))
+
+  def get_next(self):
+    """Returns the next element, like `tf.data.Iterator.get_next`."""
+    return self._timed(self._iterator.get_next)
+
+  def _timed(self, get_next_fn):
+    start = tf.timestamp()
+    with tf.control_dependencies([start]):
+      element = get_next_fn()
+    with tf.control_dependencies(
+        tf.nest.flatten(element, expand_composites=True)):
+      self._wait_seconds.assign_add(tf.timestamp() - start)
+    return element
+
+
+class StepTimeMonitor:
+  """Breaks down the time per training step and reports moving percentiles.
+
+  The `Controller` splits each training loop, i.e. one `trainer.train` call and
+  the summaries and checkpoints that follow it, into:
+
+    * "input_wait": the time `trainer.train` waited on its training iterators.
+      Only reported if the trainer has an `input_wait_seconds` variable (see
+      `StandardTrainerOptions.measure_input_wait`).
+    * "compute": the rest of the time spent in `trainer.train`.
+    * "host": the time spent by the controller outside of `trainer.train`.
+    * "total": the whole loop.
+
+  Each is divided by the number of steps of the loop, and `summaries` returns
+  their percentiles over the last `window_size` loops, in seconds per step.
+
+  If `profile_threshold` is set, a loop whose total step time exceeds
+  `profile_threshold` times the median of the previous loops triggers a
+  `tf.profiler` trace of the next loop, written to `profile_dir`. At most one
+  trace is taken every `window_size` loops.
+  """
+
+  COMPONENTS = ("input_wait", "compute", "host", "total")
+
+  def __init__(self,
+               window_size: int = 100,
+               percentiles: Sequence[float] = (50, 90, 99),
+               profile_threshold: Optional[float] = None,
+               profile_dir: Optional[str] = None):
+    """Initializes the `StepTimeMonitor` instance.
+
+    Args:
+      window_size: The number of most recent training loops the percentiles
+        are computed over.
+      percentiles: The percentiles to report, between 0 and 100.
+      profile_threshold: An optional ratio to the median step time above which
+        the next training loop is traced. If `None`, no trace is taken.
+      profile_dir: The directory to write traces to. Required if
+        `profile_threshold` is set.
+
+    Raises:
+      ValueError: If `window_size` is not a positive integer, or if
+        `profile_threshold` is set without a `profile_dir`.
+    """
+    if not isinstance(window_size, int) or window_size < 1:
+      raise ValueError(
+          f"`window_size` ({window_size}) must be a positive integer.")
+    if profile_threshold is not None and not profile_dir:
+      raise ValueError(
+          "`profile_dir` is required when `profile_threshold` is set.")
+    self.window_size = window_size
+    self.percentiles = tuple(percentiles)
+    self.profile_threshold = profile_threshold
+    self.profile_dir = profile_dir
+
+    self._history = {
+        name: collections.deque(maxlen=window_size) for name in self.COMPONENTS
+    }
+    self._loop_start = None
+    self._train_start = None
+    self._train_seconds = 0.0
+    self._input_wait_variable = None
+    self._input_wait_start = None
+    self._input_wait_seconds = None
+    self._trace_next_loop = False
+    self._tracing = False
+    self._loops_until_next_trace = 0
+
+  @property
+  def tracing(self) -> bool:
+    """Whether the current training loop is being traced."""
+    return self._tracing
+
+  def loop_begin(self):
+    """Marks the beginning of a training loop."""
+    self._train_seconds = 0.0
+    self._input_wait_seconds = None
+    if self._trace_next_loop:
+      self._trace_next_loop = False
+      try:
+        tf.profiler.experimental.start(self.profile_dir)
+        self._tracing = True
+      except tf.errors.OpError as e:
+        logging.warning("Failed to start the step time profiler: %s", e)
+    self._loop_start = time.time()
+
+  def train_begin(self, input_wait_seconds: Optional[tf.Variable] = None):
+    """Marks the beginning of a `trainer.train` call.
+
+    Args:
+      input_wait_seconds: An optional scalar `tf.Variable` accumulating the
+        seconds the trainer waits on its iterators.
+    """
+    self._input_wait_variable = input_wait_seconds
+    if input_wait_seconds is not None:
+      self._input_wait_start = float(input_wait_seconds.numpy())
+    self._train_start = time.time()
+
+  def train_end(self):
+    """Marks the end of a `trainer.train` call.
+
+    Its outputs must have been fetched, so that the call has completed.
+    """
+    self._train_seconds += time.time() - self._train_start
+    if self._input_wait_variable is not None:
+      input_wait = (
+          float(self._input_wait_variable.numpy()) - self._input_wait_start)
+      self._input_wait_seconds = (self._input_wait_seconds or 0.0) + input_wait
+      self._input_wait_variable = None
+
+  def loop_end(self, num_steps: int):
+    """Marks the end of a training loop and records its step times.
+
+    Args:
+      num_steps: The number of steps run in the loop.
+    """
+    loop_seconds = time.time() - self._loop_start
+    if self._tracing:
+      tf.profiler.experimental.stop()
+      self._tracing = False
+      logging.info("Wrote a step time trace to %s.", self.profile_dir)
+
+    step_seconds = {
+        "compute": self._train_seconds,
+        "host": max(loop_seconds - self._train_seconds, 0.0),
+        "total": loop_seconds,
+    }
+    if self._input_wait_seconds is not None:
+      input_wait = min(self._input_wait_seconds, self._train_seconds)
+      step_seconds["input_wait"] = input_wait
+      step_seconds["compute"] -= input_wait
+    step_seconds = {
+        name: seconds / num_steps for name, seconds in step_seconds.items()
+    }
+
+    previous = self._history["total"]
+    if self._loops_until_next_trace > 0:
+      self._loops_until_next_trace -= 1
+    elif (self.profile_threshold is not None and len(previous) >= min(
+        _MIN_LOOPS_FOR_REGRESSION, self.window_size)):
+      median = np.median(previous)
+      if step_seconds["total"] > self.profile_threshold * median:
+        logging.warning(
+            "Step time regressed to %.4fs from a median of %.4fs, tracing the "
+            "next training loop.", step_seconds["total"], median)
+        self._trace_next_loop = True
+        self._loops_until_next_trace = self.window_size
+
+    for name, seconds in step_seconds.items():
+      self._history[name].append(seconds)
+
+  def summaries(self) -> Dict[str, float]:
+    """Returns the percentiles of the step times over the recent loops.
+
+    Returns:
+      A dictionary mapping "step_time/{component}_p{percentile}" to seconds per
+      step, for the components measured so far.
+    """
+    summaries = {}
+    for name in self.COMPONENTS:
+      history = self._history[name]
+      if not history:
+        continue
+      values = np.percentile(history, self.percentiles)
+      for percentile, value in zip(self.percentiles, values):
+        summaries[f"step_time/{name}_p{percentile:g}"] = float(value)
+    return summaries
@@ -0,0 +1,134 @@
+# Copyright 2021 The Orbit Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for orbit.utils.step_time_monitor."""
+
+import time
+
+from unittest import mock
+
+from orbit.utils import step_time_monitor
+
+import tensorflow as tf
+
+
+def _run_loops(monitor, loops, input_wait_seconds=None):
+  """Runs `monitor` over loops of (num_steps, train, input_wait, host) times."""
+  clock = [0.0]
+  for num_steps, train, input_wait, host in loops:
+    # loop_begin, train_begin, train_end and loop_end each read the time once.
+    times = [clock[0], clock[0], clock[0] + train, clock[0] + train + host]
+    clock[0] += train + host
+    with mock.patch.object(step_time_monitor, "time") as mock_time:
+      mock_time.time.side_effect = times
+      monitor.loop_begin()
+      monitor.train_begin(input_wait_seconds)
+      if input_wait_seconds is not None:
+        input_wait_seconds.assign_add(input_wait)
+      monitor.train_end()
+      monitor.loop_end(num_steps)
+
+
+class TimedIteratorTest(tf.test.TestCase):
+
+  def test_measures_wait_in_tf_function(self):
+
+    def slow_element(x):
+      time.sleep(0.05)
+      return x
+
+    dataset = tf.data.Dataset.range(4).map(
+        lambda x: tf.reshape(tf.py_function(slow_element, [x], tf.int64), []))
+    wait_seconds = tf.Variable(0.0, dtype=tf.float64)
+    iterator = step_time_monitor.TimedIterator(iter(dataset), wait_seconds)
+
+    @tf.function
+    def loop_fn(iterator):
+      total = tf.constant(0, tf.int64)
+      for _ in tf.range(4):
+        total += next(iterator)
+      return total
+
+    self.assertEqual(loop_fn(iterator).numpy(), 6)
+    self.assertGreaterEqual(wait_seconds.numpy(), 0.2)
+    self.assertEqual(iterator.element_spec, dataset.element_spec)
+
+
+class StepTimeMonitorTest(tf.test.TestCase):
+
+  def test_summaries(self):
+    monitor = step_time_monitor.StepTimeMonitor(
+        window_size=3, percentiles=(0, 50, 100))
+    self.assertEmpty(monitor.summaries())
+
+    input_wait_seconds = tf.Variable(0.0, dtype=tf.float64)
+    _run_loops(
+        monitor, [(2, 10.0, 4.0, 2.0), (2, 2.0, 1.0, 2.0), (1, 1.0, 0.0, 1.0),
+                  (1, 2.0, 1.0, 2.0)], input_wait_seconds)
+    # The first loop is out of the window.
+    self.assertAllClose(
+        monitor.summaries(), {
+            "step_time/input_wait_p0": 0.0,
+            "step_time/input_wait_p50": 0.5,
+            "step_time/input_wait_p100": 1.0,
+            "step_time/compute_p0": 0.5,
+            "step_time/compute_p50": 1.0,
+            "step_time/compute_p100": 1.0,
+            "step_time/host_p0": 1.0,
+            "step_time/host_p50": 1.0,
+            "step_time/host_p100": 2.0,
+            "step_time/total_p0": 2.0,
+            "step_time/total_p50": 2.0,
+            "step_time/total_p100": 4.0,
+        })
+
+  def test_summaries_without_input_wait(self):
+    monitor = step_time_monitor.StepTimeMonitor(percentiles=(50,))
+    _run_loops(monitor, [(4, 4.0, 0.0, 1.0)])
+    self.assertAllClose(monitor.summaries(), {
+        "step_time/compute_p50": 1.0,
+        "step_time/host_p50": 0.25,
+        "step_time/total_p50": 1.25,
+    })
+
+  @mock.patch.object(tf.profiler.experimental, "stop")
+  @mock.patch.object(tf.profiler.experimental, "start")
+  def test_traces_regressions(self, start, stop):
+    monitor = step_time_monitor.StepTimeMonitor(
+        window_size=4, profile_threshold=2.0, profile_dir="/tmp/profile")
+    _run_loops(monitor, [(1, 1.0, 0.0, 0.0)] * 5 + [(1, 1.5, 0.0, 0.5)])
+    start.assert_not_called()
+
+    # A loop over twice the median traces the next loop.
+    _run_loops(monitor, [(1, 2.0, 0.0, 0.5)])
+    start.assert_not_called()
+    _run_loops(monitor, [(1, 1.0, 0.0, 0.0)])
+    start.assert_called_once_with("/tmp/profile")
+    stop.assert_called_once()
+    self.assertFalse(monitor.tracing)
+
+    # No other trace is taken until the window has been renewed.
+    _run_loops(monitor, [(1, 5.0, 0.0, 0.0)] + [(1, 1.0, 0.0, 0.0)] * 3 +
+               [(1, 5.0, 0.0, 0.0), (1, 1.0, 0.0, 0.0)])
+    self.assertEqual(start.call_count, 2)
+
+  def test_invalid_arguments(self):
+    with self.assertRaises(ValueError):
+      step_time_monitor.StepTimeMonitor(window_size=0)
+    with self.assertRaises(ValueError):
+      step_time_monitor.StepTimeMonitor(profile_threshold=2.0)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -130,6 +130,10 @@ class Mosaic(hyperparams.Config):
       default_factory=lambda: [1.0, 1.0])
   aspect_ratio_mode: str = 'crop'
   mosaic_crop_mode: Optional[str] = 'crop_scale'
+  # Opt-in: draws the mix up partners from a pool of the most recent samples
+  # instead of a second shuffled stream.
+  mixup_pool_size: int = 0
+  mixup_pool_eviction: str = 'fifo'
   aug_scale_min: Optional[float] = None
   aug_scale_max: Optional[float] = None
   jitter: Optional[float] = None
@@ -165,6 +169,10 @@ class Parser(hyperparams.Config):
   area_thresh: float = 0.1
   stride: Optional[int] = None
   mosaic: Mosaic = Mosaic()
+  # where the anchor matching and gridded labels are built, 'example' in the
+  # parser, 'batch' after batch() in the input pipeline or 'device' in the
+  # train and validation steps
+  label_encoding: str = 'example'
 
 
 # pylint: disable=missing-class-docstring
@@ -261,11 +269,14 @@ class YoloLossLayer(hyperparams.Config):
   nms_thresh: float = 0.6
   max_boxes: int = 200
   pre_nms_points: int = 5000
+  per_level_top_k: Optional[int] = None
   label_smoothing: float = 0.0
   anchor_generation_scale: int = 512
   use_scaled_loss: bool = True
   update_on_repeat: bool = False
   darknet: Optional[bool] = None
+  box_search: str = 'tiled'
+  box_search_chunk_size: Optional[int] = None
 
 
 @dataclasses.dataclass
@@ -310,13 +321,30 @@ class YoloTask(cfg.TaskConfig):
   annotation_file: Optional[str] = None
   gradient_clip_norm: float = 0.0
   per_category_metrics: bool = False
+  # match the detections of each eval batch as it arrives instead of
+  # buffering them for pycocotools, only for boxes
+  streaming_coco_eval: bool = False
+  # processes pycocotools evaluates the categories in, 0 runs it serially
+  coco_eval_num_processes: int = 0
 
   load_darknet_weights: bool = False
   darknet_load_decoder: bool = False
+  # where the converted darknet weights are cached as a checkpoint, defaults
+  # to <model_dir>/darknet, set to '' to always convert the weights
+  darknet_weights_cache_dir: Optional[str] = None
   init_checkpoint_modules: str = None  #'backbone'
   smart_bias_lr: float = 0.0
   coco91to80: bool = False
   reduced_logs: bool = True
+  # where generated anchors are cached, defaults to <model_dir>/anchors, set
+  # to '' to always run k-means
+  anchor_cache_dir: Optional[str] = None
+  # skip the loss in evaluation and only compute the detection metrics, the
+  # validation parser then only builds the ground truths
+  metrics_only_eval: bool = False
+  # split each batch into this many micro batches and accumulate their
+  # gradients before applying them, as darknet does with subdivisions
+  subdivisions: int = 1
 
 
 @dataclasses.dataclass
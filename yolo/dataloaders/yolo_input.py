@@ -82,6 +82,8 @@ class Parser(parser.Parser):
                dtype='float32',
                coco91to80=False,
                anchor_free_limits=None, 
+               encode_labels_after_batch=False,
+               eval_groundtruths_only=False,
                seed=None):
     """Initializes parameters for parsing annotations in the dataset.
     Args:
@@ -156,6 +158,14 @@ class Parser(parser.Parser):
         from {"float32", "float16", "bfloat16"}.
       coco91to80: `bool` for wether to convert coco91 to coco80 to minimize 
         model parameters.
+      encode_labels_after_batch: `bool` for whether to skip the anchor 
+        matching and the gridded labels in the parser. The labels then only 
+        hold the padded boxes, classes and ground truths, and 
+        `encode_labels` must be applied to the batched labels, either in the
+        input pipeline through `postprocess_fn` or on the device.
+      eval_groundtruths_only: `bool` for whether the eval labels only hold the
+        ground truths used by the detection metrics. The anchor matching and
+        the gridded labels for the loss are skipped.
       seed: `int` the seed for random number generation. 
     """
     self._coco91to80 = coco91to80
@@ -221,6 +231,11 @@ class Parser(parser.Parser):
                      } if self._use_scale_xy else {key: 1 for key in keys}
     self._area_thresh = area_thresh
     self._anchor_free_limits = anchor_free_limits
+    self._encode_labels_after_batch = encode_labels_after_batch
+    if encode_labels_after_batch and dynamic_conv:
+      raise ValueError('encode_labels_after_batch requires a fixed image size, '
+                       'it is not supported with dynamic_conv.')
+    self._eval_groundtruths_only = eval_groundtruths_only
 
     self._seed = seed
 
@@ -474,16 +489,32 @@ class Parser(parser.Parser):
     imshape[-1] = 3
     image.set_shape(imshape)
 
-    # Get the best anchors.
+    groundtruths_only = self._eval_groundtruths_only and not is_training
+    encode_labels = not (self._encode_labels_after_batch or groundtruths_only)
+
     boxes = box_utils.yxyx_to_xcycwh(boxes_)
-    best_anchors, ious = preprocessing_ops.get_best_anchor(
-        boxes,
-        self._anchors,
-        width=width,
-        height=height,
-        iou_thresh=self._anchor_t,
-        anchor_free_limits = self._anchor_free_limits, 
-        best_match_only=self._best_match_only)
+    if encode_labels:
+      # Get the best anchors.
+      best_anchors, ious = preprocessing_ops.get_best_anchor(
+          boxes,
+          self._anchors,
+          width=width,
+          height=height,
+          iou_thresh=self._anchor_t,
+          anchor_free_limits = self._anchor_free_limits, 
+          best_match_only=self._best_match_only)
+
+      # Set/fix the best anchor shape.
+      bashape = best_anchors.get_shape().as_list()
+      best_anchors = preprocessing_ops.pad_max_instances(best_anchors, self._max_num_instances, -1)
+      bashape[0] = self._max_num_instances
+      best_anchors.set_shape(bashape)
+
+      # Set/fix the ious shape.
+      ishape = ious.get_shape().as_list()
+      ious = preprocessing_ops.pad_max_instances(ious, self._max_num_instances, 0)
+      ishape[0] = self._max_num_instances
+      ious.set_shape(ishape)
 
     # Set/fix the boxes shape.
     bshape = boxes.get_shape().as_list()
@@ -497,18 +528,6 @@ class Parser(parser.Parser):
     cshape[0] = self._max_num_instances
     classes.set_shape(cshape)
 
-    # Set/fix the best anchor shape.
-    bashape = best_anchors.get_shape().as_list()
-    best_anchors = preprocessing_ops.pad_max_instances(best_anchors, self._max_num_instances, -1)
-    bashape[0] = self._max_num_instances
-    best_anchors.set_shape(bashape)
-
-    # Set/fix the ious shape.
-    ishape = ious.get_shape().as_list()
-    ious = preprocessing_ops.pad_max_instances(ious, self._max_num_instances, 0)
-    ishape[0] = self._max_num_instances
-    ious.set_shape(ishape)
-
     # Set/fix the area shape.
     area = data['groundtruth_area']
     area = tf.gather(area, inds)
@@ -533,27 +552,33 @@ class Parser(parser.Parser):
         'classes': tf.cast(classes, self._dtype),
         'area': tf.cast(area, self._dtype),
         'is_crowd': is_crowd,
-        'best_anchors': tf.cast(best_anchors, self._dtype),
-        'best_iou_match': ious,
         'width': width,
         'height': height,
         'info': info,
         'num_detections': tf.shape(inds)[0]
     }
 
-    # Build the grid formatted for loss computation in model output format.
-    grid, inds, upds, true_conf = self._build_grid(
-        labels,
-        width,
-        height,
-        use_tie_breaker=self._use_tie_breaker,
-        is_training=is_training)
-
-    # Update the labels dictionary.
-    labels['bbox'] = box_utils.xcycwh_to_yxyx(labels['bbox'])
-    labels['upds'] = upds
-    labels['inds'] = inds
-    labels['true_conf'] = true_conf
+    if not encode_labels:
+      # Keep the float32 center boxes for the anchor matching in 
+      # encode_labels.
+      labels['bbox'] = boxes
+    else:
+      labels['best_anchors'] = tf.cast(best_anchors, self._dtype)
+      labels['best_iou_match'] = ious
+
+      # Build the grid formatted for loss computation in model output format.
+      grid, inds, upds, true_conf = self._build_grid(
+          labels,
+          width,
+          height,
+          use_tie_breaker=self._use_tie_breaker,
+          is_training=is_training)
+
+      # Update the labels dictionary.
+      labels['bbox'] = box_utils.xcycwh_to_yxyx(labels['bbox'])
+      labels['upds'] = upds
+      labels['inds'] = inds
+      labels['true_conf'] = true_conf
 
     # Sets up groundtruth data for evaluation.
     groundtruths = {
@@ -572,5 +597,65 @@ class Parser(parser.Parser):
     groundtruths = utils.pad_groundtruths_to_fixed_size(groundtruths,
                                                         self._max_num_instances)
 
+    if groundtruths_only:
+      return image, {'groundtruths': groundtruths}
     labels['groundtruths'] = groundtruths
     return image, labels
+
+  def encode_labels(self, labels):
+    """Matches the boxes to the anchors and builds the gridded labels for a 
+    batch of labels from a parser with `encode_labels_after_batch` set. The 
+    whole batch is encoded with vectorized ops, so this can run in the input 
+    pipeline after batch() or on the device in the train step.
+
+    Args:
+      labels: `dict` of batched labels from the parser.
+
+    Return:
+      labels: `dict` with the bbox, best_anchors, best_iou_match, inds, upds 
+        and true_conf entries set as they are in the per example labels.
+    """
+    labels = dict(labels)
+    boxes = tf.cast(labels['bbox'], tf.float32)
+    best_anchors, ious = preprocessing_ops.get_best_anchor(
+        boxes,
+        self._anchors,
+        width=self._image_w,
+        height=self._image_h,
+        iou_thresh=self._anchor_t,
+        anchor_free_limits=self._anchor_free_limits,
+        best_match_only=self._best_match_only)
+
+    # The padded boxes get the same values as the per example padding.
+    num_instances = tf.shape(boxes)[-2]
+    valid = tf.range(num_instances) < tf.expand_dims(
+        tf.cast(labels['num_detections'], tf.int32), axis=-1)
+    valid = tf.expand_dims(valid, axis=-1)
+    best_anchors = tf.where(valid, best_anchors, -tf.ones_like(best_anchors))
+    ious = tf.where(valid, ious, tf.zeros_like(ious))
+
+    labels['bbox'] = tf.cast(boxes, self._dtype)
+    labels['best_anchors'] = tf.cast(best_anchors, self._dtype)
+    labels['best_iou_match'] = ious
+    _, inds, upds, true_conf = self._build_grid(
+        labels,
+        self._image_w,
+        self._image_h,
+        use_tie_breaker=self._use_tie_breaker)
+
+    labels['bbox'] = box_utils.xcycwh_to_yxyx(labels['bbox'])
+    labels['upds'] = upds
+    labels['inds'] = inds
+    labels['true_conf'] = true_conf
+    return labels
+
+  def postprocess_fn(self):
+    """Returns a function that encodes the labels of a batch, to be used as
+    the postprocess_fn of the InputReader."""
+    if not self._encode_labels_after_batch:
+      return None
+
+    def encode(image, labels):
+      return image, self.encode_labels(labels)
+
+    return encode
@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 import dataclasses
 from official.modeling import hyperparams
 from official.core import config_definitions as cfg
+import numpy as np
 import tensorflow as tf
 
 from yolo.modeling.layers import detection_generator
@@ -283,6 +284,74 @@ def test_ret_pipeline():
       break
 
 
+class LabelEncodingTest(tf.test.TestCase):
+
+  def _data(self, seed, num_boxes):
+    rng = np.random.RandomState(seed)
+    yx = rng.uniform(0.0, 0.6, size=(num_boxes, 2))
+    hw = rng.uniform(0.05, 0.4, size=(num_boxes, 2))
+    return {
+        'source_id': tf.constant(str(seed)),
+        'image': tf.constant(
+            rng.randint(0, 255, size=(300, 400, 3)).astype(np.uint8)),
+        'height': tf.constant(300),
+        'width': tf.constant(400),
+        'groundtruth_boxes': tf.constant(
+            np.concatenate([yx, yx + hw], axis=-1).astype(np.float32)),
+        'groundtruth_classes': tf.constant(
+            rng.randint(0, 80, size=(num_boxes,)).astype(np.int64)),
+        'groundtruth_area': tf.constant(
+            rng.uniform(1, 100, size=(num_boxes,)).astype(np.float32)),
+        'groundtruth_is_crowd': tf.zeros([num_boxes], dtype=tf.bool),
+    }
+
+  def _parser(self, encode_labels_after_batch, eval_groundtruths_only=False):
+    return YOLO_Detection_Input.Parser(
+        output_size=[256, 256],
+        masks={'3': [0, 1, 2], '4': [3, 4, 5], '5': [6, 7, 8]},
+        anchors=[[12.0, 19.0], [31.0, 46.0], [96.0, 54.0], [46.0, 114.0],
+                 [133.0, 127.0], [79.0, 225.0], [301.0, 150.0],
+                 [172.0, 286.0], [348.0, 340.0]],
+        max_num_instances=20,
+        scale_xy={'3': 2.0, '4': 2.0, '5': 2.0},
+        use_scale_xy=True,
+        anchor_t=4.0,
+        encode_labels_after_batch=encode_labels_after_batch,
+        eval_groundtruths_only=eval_groundtruths_only)
+
+  def testMatchesPerExampleLabels(self):
+    data = [self._data(seed, num_boxes) for seed, num_boxes in enumerate(
+        [3, 12, 7])]
+
+    parser = self._parser(False)
+    expected = [parser.parse_fn(is_training=False)(x) for x in data]
+    expected = tf.nest.map_structure(lambda *x: tf.stack(x), *expected)
+
+    parser = self._parser(True)
+    actual = [parser.parse_fn(is_training=False)(x) for x in data]
+    actual = tf.nest.map_structure(lambda *x: tf.stack(x), *actual)
+    self.assertNotIn('inds', actual[1])
+    actual = parser.postprocess_fn()(*actual)
+
+    self.assertAllEqual(expected[0], actual[0])
+    self.assertEqual(set(expected[1].keys()), set(actual[1].keys()))
+    for key in ['bbox', 'best_anchors', 'best_iou_match', 'upds', 'inds',
+                'true_conf']:
+      tf.nest.map_structure(self.assertAllEqual, expected[1][key],
+                            actual[1][key])
+
+  def testEvalGroundtruthsOnly(self):
+    data = self._data(0, 5)
+    expected = self._parser(False).parse_fn(is_training=False)(data)
+    image, labels = self._parser(
+        False, eval_groundtruths_only=True).parse_fn(is_training=False)(data)
+
+    self.assertAllEqual(expected[0], image)
+    self.assertEqual(['groundtruths'], list(labels.keys()))
+    tf.nest.map_structure(self.assertAllEqual, expected[1]['groundtruths'],
+                          labels['groundtruths'])
+
+
 if __name__ == '__main__':
 
   # test_ret_pipeline()
@@ -1,49 +1,54 @@
-from yolo.utils.run_utils import prep_gpu
-try:
-  prep_gpu()
-except BaseException:
-  print("GPU's already prepped")
+"""Asynchronous, batched inference endpoint for the yolo models.
 
-from flask import Flask, request, jsonify
-import numpy as np
-import base64
+POST /detect with a raw JPEG body or a multipart form with a `frame` file. The
+images are decoded on a worker pool and run in batches by a shared
+ModelServer. The response is JSON with the `bbox` (normalized ymin, xmin, ymax,
+xmax), `classes` and `confidence` of each detection, or with `?format=binary`
+the packed detections:
+
+  uint32 n, float32 bbox[n, 4], int32 classes[n], float32 confidence[n]
+
+all little endian. With `?draw=1` the image is returned as a JPEG with the
+boxes drawn on it. When too many requests are pending the server answers 503
+so clients can back off.
+
+python3 -m yolo.demos.examples.server.app --version=v4 --port=5000
+"""
+import asyncio
+import concurrent.futures
+import struct
+
+from absl import app
+from absl import flags
 import cv2
-import sys
+import numpy as np
 import tensorflow as tf
+from aiohttp import web
 
 from yolo.demos.three_servers import model_server as ms
-
-from yolo.configs import yolo as exp_cfg
-from yolo.tasks.yolo import YoloTask
 from yolo.utils.demos import utils
 from yolo.utils.demos import coco
-from queue import Queue
-import urllib.request
-
-app = Flask(__name__)
-
-
-class dualQue(object):
-
-  def __init__(self):
-    self._return_buffer = Queue(maxsize=10)
 
-  def put(self, raw_frame):
-    if self._return_buffer.full():
-      return False
-    if hasattr(raw_frame, "numpy"):
-      raw_frame = raw_frame.numpy()
-    self._return_buffer.put(raw_frame)
-    return True
+FLAGS = flags.FLAGS
+flags.DEFINE_string('version', 'v4', 'model version to serve.')
+flags.DEFINE_string('host', '127.0.0.1', 'address to listen on.')
+flags.DEFINE_integer('port', 5000, 'port to listen on.')
+flags.DEFINE_string('run_strat', '/GPU:0', 'device to run the model on.')
+flags.DEFINE_integer('max_batch', 8, 'maximum batch size.')
+flags.DEFINE_float('max_latency', 0.005,
+                   'seconds a frame waits for a batch to fill.')
+flags.DEFINE_integer('max_pending', 64,
+                     'requests in flight before answering 503.')
+flags.DEFINE_integer('decode_workers', 4, 'threads decoding images.')
 
-  def get(self):
-    if self._return_buffer.empty():
-      return None
-    f = self._return_buffer.get()
-    return f
+_DETECTION_KEYS = ('bbox', 'classes', 'confidence')
 
 
 def build_model(version):
+  from yolo.configs import yolo as exp_cfg
+  from yolo.tasks.yolo import YoloTask
+  from yolo.modeling.yolo_model import fuse_for_inference
+
   if version == "v4":
     config = exp_cfg.YoloTask(
         model=exp_cfg.Yolo(
@@ -84,150 +89,227 @@ def build_model(version):
   task = YoloTask(config)
   model = task.build_model()
   task.initialize(model)
-
-  pfn = ms.preprocess_fn
-  pofn = utils.DrawBoxes(
-      classes=80, labels=coco.get_coco_names(), display_names=True, thickness=2)
-  server_t = ms.ModelServer(
-      model=model,
-      preprocess_fn=pfn,
-      postprocess_fn=pofn,
-      wait_time=0.00001,
-      max_batch=5)
-  return server_t
-
-
-class ServerAttr(object):
-
-  def __init__(self):
-    self.model = None
-    return
-
-  def init_model(self, model):
-    self.model = build_model(model)
-    self.model.start()
-    print(model)
-    return
-
-  def close_model(self):
-    self.model.close()
-    del self.model
-    self.model = None
-    return
-
-  def get(self):
-    f = self.model.get()
-    if np.max(f) <= 1:
-      f = (f * 255).astype(np.uint8)
-    f = cv2.cvtColor(f, cv2.COLOR_BGR2RGB)
-    f = cv2.imencode(".jpg", f)[1].tostring()
-    f = base64.b64encode(f).decode("utf-8")
-    b64_src = "data:image/jpg;base64,"
-    f = b64_src + f
-    return f
-
-  def getall(self):
-    fs = self.model.getall()
-    fl = []
-    for f in fs:
-      if np.max(f) <= 1:
-        f = (f * 255).astype(np.uint8)
-      f = cv2.cvtColor(f, cv2.COLOR_BGR2RGB)
-      f = cv2.imencode(".jpg", f)[1].tostring()
-      f = base64.b64encode(f).decode("utf-8")
-      b64_src = "data:image/jpg;base64,"
-      f = b64_src + f
-      fl.append(f)
-    return fl
-
-  def put(self, image):
-    with urllib.request.urlopen(image) as response:
-      data = response.read()
-    img = tf.io.decode_jpeg(data)
-    return self.model.put(img / 255)
-
-
-MODEL = ServerAttr()
-
-
-@app.route("/")
-def init():
+  model(
+      tf.ones((1, *config.model.input_size), dtype=tf.float32),
+      training=False)
+  model = fuse_for_inference(model)
+  return model, config.model.input_size[:2]
+
+
+def decode_image(data, input_size):
+  """Decodes a JPEG into the BGR image and the RGB model input in [0, 1]."""
+  image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+  if image is None:
+    raise ValueError('the body is not a valid image')
+  inputs = cv2.resize(
+      image, (input_size[1], input_size[0]), interpolation=cv2.INTER_AREA)
+  inputs = cv2.cvtColor(inputs, cv2.COLOR_BGR2RGB)
+  return np.multiply(inputs, 1 / 255, dtype=np.float32), image
+
+
+def encode_detections(detections):
+  """Packs the detections into the binary response format."""
+  num_detections = detections['classes'].shape[0]
+  return b''.join([
+      struct.pack('<I', num_detections),
+      detections['bbox'].astype('<f4').tobytes(),
+      detections['classes'].astype('<i4').tobytes(),
+      detections['confidence'].astype('<f4').tobytes(),
+  ])
+
+
+class InferenceService(object):
+  """Feeds decoded requests to a shared batching ModelServer.
+
+  Each frame carries the future of its request through the ModelServer, the
+  post processing thread resolves the futures with the detections of their
+  frame.
   """
-    get attr for model version
-    """
-  return "<h1>hello world</h1>"
 
+  def __init__(self,
+               model,
+               input_size,
+               run_strat='/GPU:0',
+               max_batch=8,
+               max_latency=0.005,
+               max_pending=64,
+               decode_workers=4,
+               request_timeout=10.0,
+               draw_fn=None):
+    self._input_size = input_size
+    self._request_timeout = request_timeout
+    self._max_pending = max_pending
+    self._pending = 0
+    self._pool = concurrent.futures.ThreadPoolExecutor(decode_workers)
+    self._draw_fn = draw_fn if draw_fn is not None else utils.DrawBoxes(
+        classes=80, labels=coco.get_coco_names(), display_names=True)
+    self._server = ms.ModelServer(
+        model=model,
+        preprocess_fn=lambda item, pdims: item[0],
+        postprocess_fn=self._resolve,
+        run_strat=run_strat,
+        max_batch=max_batch,
+        max_latency=max_latency,
+        que_size=max_pending)
+    return
 
-@app.route("/set/<version>", methods=["POST"])
-def hello_model(version):
-  """
-    get attr for model version
+  @property
+  def model_server(self):
+    return self._server
+
+  def start(self):
+    self._server.start()
+
+  def close(self):
+    self._server.close()
+    self._pool.shutdown()
+
+  def _resolve(self, items, results):
+    results = {key: np.asarray(results[key]) for key in _DETECTION_KEYS}
+    for i, (_, future, loop) in enumerate(items):
+      valid = results['confidence'][i] > 0
+      detections = {key: results[key][i][valid] for key in _DETECTION_KEYS}
+      loop.call_soon_threadsafe(_set_result, future, detections)
+    return []
+
+  async def detect(self, data):
+    """Returns the detections in the JPEG data and the decoded image.
+
+    Raises:
+      web.HTTPServiceUnavailable: too many requests are pending or the model
+        server has stopped.
+      web.HTTPBadRequest: the data is not an image.
+      web.HTTPGatewayTimeout: the model did not answer within the timeout.
     """
-  MODEL.init_model(version)
-  return f"<h1>{version}</h1>"
-
+    self._check_running()
+    if self._pending >= self._max_pending:
+      raise web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
+    self._pending += 1
+    try:
+      loop = asyncio.get_running_loop()
+      try:
+        inputs, image = await loop.run_in_executor(self._pool, decode_image,
+                                                   data, self._input_size)
+      except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+      future = loop.create_future()
+      self._check_running()
+      if not self._server.put((inputs, future, loop)):
+        raise web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
+      try:
+        detections = await asyncio.wait_for(future, self._request_timeout)
+      except asyncio.TimeoutError:
+        raise web.HTTPGatewayTimeout()
+      return detections, image
+    finally:
+      self._pending -= 1
+
+  def _check_running(self):
+    # the model server threads stop on errors, requests would only time out.
+    if not self._server.running:
+      raise web.HTTPServiceUnavailable(text='the model server is not running')
+
+  async def draw(self, image, detections):
+    """Returns the image as a JPEG with the detections drawn on it."""
+
+    def draw():
+      results = {key: value[None] for key, value in detections.items()}
+      drawn = self._draw_fn(image, results)
+      return cv2.imencode('.jpg', drawn)[1].tobytes()
+
+    return await asyncio.get_running_loop().run_in_executor(self._pool, draw)
+
+
+def _set_result(future, result):
+  if not future.done():
+    future.set_result(result)
+
+
+async def _read_frame(request):
+  if request.content_type.startswith('multipart/'):
+    reader = await request.multipart()
+    async for part in reader:
+      if part.name == 'frame':
+        return await part.read()
+    raise web.HTTPBadRequest(text='the form has no frame field')
+  return await request.read()
+
+
+async def detect(request):
+  service = request.app['service']
+  detections, image = await service.detect(await _read_frame(request))
+  if request.query.get('draw', '0') not in ('0', 'false'):
+    return web.Response(
+        body=await service.draw(image, detections), content_type='image/jpeg')
+  if request.query.get('format') == 'binary':
+    return web.Response(
+        body=encode_detections(detections),
+        content_type='application/octet-stream')
+  return web.json_response(
+      {key: value.tolist() for key, value in detections.items()})
+
+
+async def health(request):
+  server = request.app['service'].model_server
+  if not server.running:
+    return web.json_response(
+        dict(server.latency_stats, status='down'), status=503)
+  return web.json_response(dict(server.latency_stats, status='ok'))
+
+
+@web.middleware
+async def cors(request, handler):
+  if request.method == 'OPTIONS':
+    response = web.Response()
+  else:
+    response = await handler(request)
+  response.headers['Access-Control-Allow-Origin'] = '*'
+  response.headers['Access-Control-Allow-Headers'] = (
+      'Content-Type,Authorization')
+  response.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS'
+  return response
 
-@app.route("/close", methods=["POST"])
-def close_model():
-  MODEL.close_model()
-  return f"<h1>closed</h1>"
 
+def create_app(service):
+  """Builds the web application around a service, the service is started and
+  closed with the application."""
+  application = web.Application(middlewares=[cors])
+  application['service'] = service
+  application.router.add_post('/detect', detect)
+  application.router.add_route('OPTIONS', '/detect', detect)
+  application.router.add_get('/health', health)
 
-@app.route("/send_frame", methods=["POST"])
-def send_frame():
-  try:
-    print("decoding image", request)
-    data_url = request.values["frame"]
-    data = not MODEL.put(data_url)
-    return jsonify({"dropped": data})
-  except BaseException:
-    return jsonify({"dropped": True})
+  async def start(_):
+    service.start()
 
+  async def close(_):
+    service.close()
 
-@app.route("/get_frame", methods=["GET"])
-def get_frame():
-  print("getting image")
-  try:
-    frame = MODEL.get()
-    if type(frame) == type(None):
-      return jsonify({"frame": "null"})
-    else:
-      return jsonify({"frame": frame})
-  except BaseException:
-    return jsonify({"frame": "null"})
+  application.on_startup.append(start)
+  application.on_cleanup.append(close)
+  return application
 
 
-@app.route("/getall_frames", methods=["GET"])
-def getall_frames():
-  print("getting image")
+def main(_):
+  from yolo.utils.run_utils import prep_gpu
   try:
-    frame = MODEL.getall()
-    return jsonify({"frames": frame})
+    prep_gpu()
   except BaseException:
-    return jsonify({"frames": "null"})
-
-
-@app.after_request
-def after_request(response):
-  print("log: setting cors", file=sys.stderr)
-  response.headers.add("Access-Control-Allow-Origin", "*")
-  response.headers.add("Access-Control-Allow-Headers",
-                       "Content-Type,Authorization")
-  response.headers.add("Access-Control-Allow-Methods", "GET,PUT,POST,DELETE")
-  return response
-
-
-def load_for_colab():
-  from flask_ngrok import run_with_ngrok
-  run_with_ngrok(app)  # Start ngrok when app is run
-  app.run()
-  return
-
-
-def load(port):
-  app.run(host="127.0.0.1", port=port)
-  return
-
-
-if __name__ == "__main__":
-  load(5000)
+    print("GPU's already prepped")
+
+  model, input_size = build_model(FLAGS.version)
+  service = InferenceService(
+      model,
+      input_size,
+      run_strat=FLAGS.run_strat,
+      max_batch=FLAGS.max_batch,
+      max_latency=FLAGS.max_latency,
+      max_pending=FLAGS.max_pending,
+      decode_workers=FLAGS.decode_workers)
+  web.run_app(
+      create_app(service), host=FLAGS.host, port=FLAGS.port, access_log=None)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,130 @@
+"""Load test of the batched inference endpoint with a local stand-in model.
+
+The endpoint is started in process around a small convolutional stand-in for
+the yolo models, a number of concurrent clients then post JPEG frames to it
+for a fixed duration. The requests per second, the p50/p99 latency and the
+number of rejected requests are reported. The batching flags of the endpoint,
+like --max_batch and --max_pending, apply.
+
+python3 -m yolo.demos.examples.server.app_benchmark --concurrency=32 --load_duration=10
+"""
+import asyncio
+import time
+
+from absl import app
+from absl import flags
+import aiohttp
+import cv2
+import numpy as np
+import tensorflow as tf
+from aiohttp import web
+
+from yolo.demos.examples.server import app as server
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('concurrency', 16, 'number of concurrent clients.')
+flags.DEFINE_float('load_duration', 10.0, 'seconds to send requests.')
+flags.DEFINE_integer('frame_size', 480, 'resolution of the posted frames.')
+flags.DEFINE_integer('model_size', 416,
+                     'input resolution of the stand in model.')
+flags.DEFINE_enum('format', 'json', ['json', 'binary', 'draw'],
+                  'response format.')
+
+
+def standin_model(max_boxes=100, num_classes=80):
+  """A small convolution returning random detections in the yolo format."""
+  conv = tf.keras.layers.Conv2D(16, 3, strides=4)
+
+  @tf.function
+  def model(images):
+    features = tf.reduce_mean(conv(images), axis=[1, 2, 3])
+    batch_size = tf.shape(images)[0]
+    yx = tf.random.uniform([batch_size, max_boxes, 2], 0, 0.8)
+    hw = tf.random.uniform([batch_size, max_boxes, 2], 0.05, 0.2)
+    confidence = tf.random.uniform([batch_size, max_boxes])
+    confidence = tf.where(confidence > 0.9, confidence, 0.0)
+    return {
+        'bbox': tf.concat([yx, yx + hw], axis=-1),
+        'classes': tf.random.uniform([batch_size, max_boxes],
+                                     maxval=num_classes,
+                                     dtype=tf.int32),
+        'confidence': confidence + features[:, None] * 0,
+        'num_detections': tf.reduce_sum(
+            tf.cast(confidence > 0, tf.int32), axis=-1),
+    }
+
+  return model
+
+
+def frame_jpeg(image_size):
+  image = np.random.RandomState(0).randint(
+      0, 255, [image_size, image_size, 3], np.uint8)
+  return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+async def client(session, url, data, deadline, latencies, statuses):
+  headers = {'Content-Type': 'image/jpeg'}
+  while time.time() < deadline:
+    start = time.time()
+    async with session.post(url, data=data, headers=headers) as response:
+      await response.read()
+      statuses.append(response.status)
+      if response.status == 200:
+        latencies.append(time.time() - start)
+      else:
+        await asyncio.sleep(0.01)
+
+
+async def load_test(service, url, data, concurrency, duration):
+  runner = web.AppRunner(server.create_app(service), access_log=None)
+  await runner.setup()
+  site = web.TCPSite(runner, '127.0.0.1', FLAGS.port)
+  await site.start()
+
+  latencies = []
+  statuses = []
+  try:
+    async with aiohttp.ClientSession() as session:
+      # warm up the traces of the bucketed batch sizes
+      async with session.post(url, data=data) as response:
+        await response.read()
+      deadline = time.time() + duration
+      await asyncio.gather(*[
+          client(session, url, data, deadline, latencies, statuses)
+          for _ in range(concurrency)
+      ])
+  finally:
+    await runner.cleanup()
+  return latencies, statuses
+
+
+def main(_):
+  model = standin_model()
+  for size in set([1, 2, 4, FLAGS.max_batch]):
+    model(tf.zeros([size, FLAGS.model_size, FLAGS.model_size, 3]))
+
+  service = server.InferenceService(
+      model, [FLAGS.model_size, FLAGS.model_size],
+      run_strat='/CPU:0',
+      max_batch=FLAGS.max_batch,
+      max_latency=FLAGS.max_latency,
+      max_pending=FLAGS.max_pending,
+      decode_workers=FLAGS.decode_workers)
+  url = f'http://127.0.0.1:{FLAGS.port}/detect'
+  if FLAGS.format == 'binary':
+    url += '?format=binary'
+  elif FLAGS.format == 'draw':
+    url += '?draw=1'
+
+  latencies, statuses = asyncio.get_event_loop().run_until_complete(
+      load_test(service, url, frame_jpeg(FLAGS.frame_size),
+                FLAGS.concurrency, FLAGS.load_duration))
+  print('requests/s: {:.1f}'.format(len(latencies) / FLAGS.load_duration))
+  if latencies:
+    print('latency p50: {:.4f} s, p99: {:.4f} s'.format(
+        np.percentile(latencies, 50), np.percentile(latencies, 99)))
+  print('rejected: {}'.format(sum(status == 503 for status in statuses)))
+
+
+if __name__ == '__main__':
+  app.run(main)
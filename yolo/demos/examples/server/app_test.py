@@ -0,0 +1,132 @@
+import asyncio
+import json
+import struct
+import time
+
+from absl.testing import parameterized
+import aiohttp
+import numpy as np
+import tensorflow as tf
+from aiohttp import web
+
+from yolo.demos.examples.server import app
+from yolo.demos.examples.server import app_benchmark
+
+PORT = 8766
+URL = f'http://127.0.0.1:{PORT}/detect'
+HEALTH_URL = f'http://127.0.0.1:{PORT}/health'
+
+
+class AppTest(parameterized.TestCase, tf.test.TestCase):
+
+  def _serve(self, request_fn, max_pending=8, stop_server=False):
+    """Runs request_fn(session) against a served app and returns its result,
+    with stop_server the model server is stopped as if it had failed."""
+    service = app.InferenceService(
+        app_benchmark.standin_model(),
+        [64, 64],
+        run_strat='/CPU:0',
+        max_batch=4,
+        max_pending=max_pending)
+
+    async def serve():
+      runner = web.AppRunner(app.create_app(service), access_log=None)
+      await runner.setup()
+      await web.TCPSite(runner, '127.0.0.1', PORT).start()
+      if stop_server:
+        service.model_server.running = False
+      try:
+        async with aiohttp.ClientSession() as session:
+          return await request_fn(session)
+      finally:
+        await runner.cleanup()
+
+    return asyncio.get_event_loop().run_until_complete(serve())
+
+  def _post(self,
+            query='',
+            max_pending=8,
+            data=None,
+            multipart=False,
+            stop_server=False):
+    data = app_benchmark.frame_jpeg(96) if data is None else data
+
+    async def post(session):
+      if multipart:
+        body = aiohttp.FormData()
+        body.add_field('frame', data, content_type='image/jpeg')
+      else:
+        body = data
+      async with session.post(URL + query, data=body) as response:
+        return response.status, response.content_type, await response.read()
+
+    return self._serve(post, max_pending, stop_server)
+
+  def _health(self, stop_server=False):
+
+    async def get(session):
+      async with session.get(HEALTH_URL) as response:
+        return response.status, await response.json()
+
+    return self._serve(get, stop_server=stop_server)
+
+  @parameterized.parameters(False, True)
+  def testJson(self, multipart):
+    status, content_type, body = self._post(multipart=multipart)
+    self.assertEqual(200, status)
+    self.assertEqual('application/json', content_type)
+    detections = {
+        key: np.array(value) for key, value in json.loads(body).items()
+    }
+    num_detections = len(detections['classes'])
+    self.assertAllEqual([num_detections], detections['confidence'].shape)
+    self.assertTrue(np.all(detections['confidence'] > 0))
+
+  def testBinary(self):
+    status, content_type, body = self._post('?format=binary')
+    self.assertEqual(200, status)
+    self.assertEqual('application/octet-stream', content_type)
+    num_detections = struct.unpack('<I', body[:4])[0]
+    self.assertLen(body, 4 + num_detections * 4 * 6)
+
+  def testDraw(self):
+    status, content_type, body = self._post('?draw=1')
+    self.assertEqual(200, status)
+    self.assertEqual('image/jpeg', content_type)
+    self.assertEqual(b'\xff\xd8', body[:2])
+
+  def testInvalidImage(self):
+    status, _, _ = self._post(data=b'not a jpeg')
+    self.assertEqual(400, status)
+
+  def testBackpressure(self):
+    status, _, _ = self._post(max_pending=0)
+    self.assertEqual(503, status)
+
+  def testServerDown(self):
+    start = time.time()
+    status, _, body = self._post(stop_server=True)
+    self.assertEqual(503, status)
+    self.assertIn(b'not running', body)
+    self.assertLess(time.time() - start, 5)
+
+  @parameterized.parameters((False, 200, 'ok'), (True, 503, 'down'))
+  def testHealth(self, stop_server, expected_status, expected_state):
+    status, body = self._health(stop_server)
+    self.assertEqual(expected_status, status)
+    self.assertEqual(expected_state, body['status'])
+    self.assertIn('compute_p50', body)
+
+  def testEncodeDetections(self):
+    detections = {
+        'bbox': np.zeros([3, 4], np.float32),
+        'classes': np.array([1, 2, 3]),
+        'confidence': np.full([3], 0.5, np.float32)
+    }
+    body = app.encode_detections(detections)
+    self.assertEqual(3, struct.unpack('<I', body[:4])[0])
+    self.assertAllEqual([1, 2, 3], np.frombuffer(body[52:64], '<i4'))
+
+
+if __name__ == '__main__':
+  tf.test.main()
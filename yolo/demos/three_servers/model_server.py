@@ -6,8 +6,10 @@ import colorsys
 import numpy as np
 import time
 
+import collections
+import multiprocessing as mp
 import threading as t
-from queue import Queue
+from queue import Empty, Full, Queue
 
 import tensorflow as tf
 import tensorflow.keras as ks
@@ -17,10 +19,54 @@ from yolo.utils.run_utils import support_windows
 from yolo.utils.run_utils import prep_gpu
 from yolo.utils.demos import utils
 from yolo.utils.demos import coco
+from yolo.demos.three_servers.shared_frame_que import SharedFrameQue
 import traceback
 
 
+def bucket_sizes(max_batch):
+  """The batch sizes batches are padded to, the powers of 2 below max_batch
+  and max_batch, so the model is only traced for a few batch sizes."""
+  sizes = []
+  size = 1
+  while size < max_batch:
+    sizes.append(size)
+    size *= 2
+  sizes.append(max_batch)
+  return sizes
+
+
+class LatencyStats(object):
+  """Percentiles of a window of the most recent latencies, in seconds."""
+
+  def __init__(self, window=1000):
+    self._samples = collections.deque(maxlen=window)
+    self._lock = t.Lock()
+    return
+
+  def add(self, *latencies):
+    with self._lock:
+      self._samples.extend(latencies)
+
+  def percentile(self, q):
+    with self._lock:
+      if not self._samples:
+        return 0.0
+      return float(np.percentile(self._samples, q))
+
+  def clear(self):
+    with self._lock:
+      self._samples.clear()
+
+
 class ModelServer(object):
+  """Runs a model on the frames of one or more streams in batches.
+
+  Frames wait in the load buffer until a batch of max_batch frames is ready
+  or the oldest frame has waited max_latency seconds, the batch is then padded
+  to the next bucketed batch size and run on the model. The results are
+  passed to the postprocess_fn as numpy arrays. The threads block on
+  condition variables instead of polling the queues.
+  """
 
   def __init__(self,
                model=None,
@@ -29,13 +75,16 @@ class ModelServer(object):
                process_dims=416,
                run_strat="/GPU:0",
                max_batch=5,
-               wait_time=0.000001):
+               wait_time=0.000001,
+               max_latency=0.005,
+               batch_sizes=None,
+               que_size=None):
     # support for ANSI cahracters in windows
     support_windows()
     self._model = model
     self._timeout = 120000000
 
-    self._device = utils.get_device(run_strat)
+    self._run_strat = run_strat
 
     # steps to take before loading into model
     self._preprocess_fn = preprocess_fn if preprocess_fn is not None else self._pre
@@ -45,26 +94,40 @@ class ModelServer(object):
 
     self._pdims = process_dims
     self._max_batch = max_batch
+    self._max_latency = max_latency
+    self._batch_sizes = sorted(
+        batch_sizes if batch_sizes is not None else bucket_sizes(max_batch))
+    if self._batch_sizes[-1] < max_batch:
+      raise ValueError(f"the largest batch size {self._batch_sizes[-1]} is "
+                       f"smaller than max_batch {max_batch}")
+
+    # the wait time is only a hint for the threads feeding and reading the
+    # server, the server threads block on the queues
     self._dynamic_wt = (wait_time == "dynamic" or wait_time is None)
     if not self._dynamic_wt:
       self._wait_time = utils.get_wait_time(wait_time, max_batch)
     else:
       self._wait_time = 0.001
 
-    self._load_buffer = Queue(maxsize=max_batch)
-    self._batched_que = Queue(maxsize=max_batch)
+    # how often blocked threads check if the server was closed
+    self._poll_time = 0.1
+    self._que_size = que_size if que_size is not None else 2 * max_batch
+    self._load_buffer = collections.deque()
+    self._lock = t.Lock()
+    self._not_empty = t.Condition(self._lock)
+    self._not_full = t.Condition(self._lock)
     self._processed_que = Queue(maxsize=max_batch)
     self._return_buffer = Queue(maxsize=max_batch)
 
     self._running = False
     self._thread = None
     self._clear_thread = None
-    self._lbuffer_size = 0
-    self._rbuffer_size = 0
     self._lsum = 0
     self._latency = 0
     self._prev_latency = 0
     self._frames = 0
+    self._queue_latency = LatencyStats()
+    self._compute_latency = LatencyStats()
     return
 
   def _pre(self, frame, pdim):
@@ -73,67 +136,112 @@ class ModelServer(object):
   def _post(self, frame, result):
     return result
 
-  def put(self, raw_frame):
-    if self._load_buffer.full():
+  def put(self, raw_frame, block=False):
+    """Adds a frame to the load buffer.
+
+    Args:
+      raw_frame: the frame to run the model on.
+      block: wait until there is space in the load buffer, if False the frame
+        is dropped when the buffer is full.
+
+    Return:
+      whether the frame was added.
+    """
+    if not block and len(self._load_buffer) >= self._que_size:
       return False
     frame = self._preprocess_fn(raw_frame, self._pdims)
-    self._load_buffer.put((frame, raw_frame))
+    with self._not_full:
+      while block and self._running and len(
+          self._load_buffer) >= self._que_size:
+        self._not_full.wait(self._poll_time)
+      if len(self._load_buffer) >= self._que_size:
+        return False
+      self._load_buffer.append((frame, raw_frame, time.time()))
+      self._not_empty.notify()
     return True
 
-  def _get_batch_input(self, que, max_batch):
-    frames = []
-    raw = []
-    i = 0
-    while (i < max_batch and not que.empty()):
-      i += 1
-      frame, rawframe = que.get()
-      frames.append(frame)
-      raw.append(rawframe)
-    return frames, raw
+  def _get_batch_input(self):
+    """Blocks until a batch is ready, the batch is closed when it holds
+    max_batch frames or the oldest frame has waited max_latency seconds."""
+    with self._not_empty:
+      while self._running and not self._load_buffer:
+        self._not_empty.wait(self._poll_time)
+      if not self._running:
+        return []
+
+      deadline = self._load_buffer[0][2] + self._max_latency
+      while self._running and len(self._load_buffer) < self._max_batch:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self._not_empty.wait(remaining)
+
+      batch = []
+      while self._load_buffer and len(batch) < self._max_batch:
+        batch.append(self._load_buffer.popleft())
+      self._not_full.notify(len(batch))
+    return batch
+
+  def _pad_batch(self, frames):
+    """Stacks the frames and pads them to the next bucketed batch size."""
+    num_frames = len(frames)
+    for size in self._batch_sizes:
+      if size >= num_frames:
+        break
+
+    if all(isinstance(frame, np.ndarray) for frame in frames):
+      # converting a list of arrays to a tensor goes element by element
+      batch = np.zeros([size, *frames[0].shape], frames[0].dtype)
+      batch[:num_frames] = frames
+      return tf.convert_to_tensor(batch)
+
+    frames = tf.stack(frames)
+    paddings = [[0, size - num_frames]] + [[0, 0]] * (frames.shape.rank - 1)
+    return tf.pad(frames, paddings)
 
   def process_frames(self):
     frame_count = 0
     try:
       self._running = True
-      while (self._running):
-        if self._load_buffer.empty():
-          time.sleep(self._wait_time)
-          continue
-        if self._processed_que.full():
-          time.sleep(self._wait_time)
-          continue
-
-        start_t = time.time()
-        frames = []
-        raw = []
-        i = 0
-        while (i < self._max_batch and not self._load_buffer.empty()):
-          i += 1
-          frame, rawframe = self._load_buffer.get()
-          frames.append(frame)
-          raw.append(rawframe)
-        rframes = len(raw)
-        with tf.device("/GPU:0"):
-          frame = tf.convert_to_tensor(frames)
+      with utils.get_device(self._run_strat):
+        while (self._running):
+          batch = self._get_batch_input()
+          if not batch:
+            continue
+
+          start_t = time.time()
+          frames, raw, arrivals = zip(*batch)
+          raw = list(raw)
+          rframes = len(raw)
+          frame = self._pad_batch(frames)
           result = self._process_fn(frame)
-        self._processed_que.put((raw, result))
-        time.sleep(self._wait_time)
-        end_t = time.time()
-
-        if self._frames >= 1000:
-          self._frames = 0
-          self._lsum = 0
-        self._frames += rframes
-        self._lsum += (end_t - start_t)
-        #self._prev_latency = self._latency * 0.1 + 0.9 * self._prev_latency
-        self._latency = self._lsum / self._frames
-        if self._dynamic_wt:
-          if self._prev_latency >= self._latency:
-            self._prev_latency = self._latency * 0.1 + 0.9 * self._prev_latency
-            self._wait_time = self._wait_time - 0.02 * self._wait_time
-          else:
-            self._prev_latency = self._latency * 0.1 + 0.9 * self._prev_latency
-            self._wait_time = self._wait_time + 0.01 * self._wait_time
+          # fetching the results waits for the device, so the compute latency
+          # covers the whole model run and not only its dispatch
+          result = tf.nest.map_structure(lambda x: x[:rframes].numpy(), result)
+          end_t = time.time()
+          self._queue_latency.add(*[start_t - arrival for arrival in arrivals])
+          self._compute_latency.add(end_t - start_t)
+
+          while self._running:
+            try:
+              self._processed_que.put((raw, result), timeout=self._poll_time)
+              break
+            except Full:
+              continue
+
+          if self._frames >= 1000:
+            self._frames = 0
+            self._lsum = 0
+          self._frames += rframes
+          self._lsum += (end_t - start_t)
+          self._latency = self._lsum / self._frames
+          if self._dynamic_wt:
+            if self._prev_latency >= self._latency:
+              self._prev_latency = self._latency * 0.1 + 0.9 * self._prev_latency
+              self._wait_time = self._wait_time - 0.02 * self._wait_time
+            else:
+              self._prev_latency = self._latency * 0.1 + 0.9 * self._prev_latency
+              self._wait_time = self._wait_time + 0.01 * self._wait_time
 
     except KeyboardInterrupt:
       self._running = False
@@ -148,20 +256,16 @@ class ModelServer(object):
     try:
       self._running = True
       while (self._running):
-        if self._processed_que.empty():
-          time.sleep(self._wait_time)
+        try:
+          frames, results = self._processed_que.get(timeout=self._poll_time)
+        except Empty:
           continue
-        start_t = time.time()
-        frames, results = self._processed_que.get()
         ret = self._postprocess_fn(frames, results)
         if not isinstance(ret, dict):
           for frame in ret:
             self._return_buffer.put(frame)
         else:
           self._return_buffer.put((frames, ret))
-
-        end_t = time.time()
-        time.sleep(self._wait_time)
     except KeyboardInterrupt:
       self._running = False
     except Exception as e:
@@ -184,6 +288,7 @@ class ModelServer(object):
     return self._running, self.get()
 
   def start(self):
+    self._running = True
     self._thread = t.Thread(target=self.process_frames, args=())
     self._thread.start()
     self._clear_thread = t.Thread(target=self.postprocess_buffer, args=())
@@ -192,6 +297,9 @@ class ModelServer(object):
 
   def close(self):
     self._running = False
+    with self._lock:
+      self._not_empty.notify_all()
+      self._not_full.notify_all()
     if self._thread is not None:
       self._thread.join()
     if self._clear_thread is not None:
@@ -202,6 +310,17 @@ class ModelServer(object):
   def latency(self):
     return self._latency
 
+  @property
+  def latency_stats(self):
+    """p50 and p99 of the time frames wait in the load buffer and of the
+    time to run a batch, in seconds."""
+    return {
+        "queue_p50": self._queue_latency.percentile(50),
+        "queue_p99": self._queue_latency.percentile(99),
+        "compute_p50": self._compute_latency.percentile(50),
+        "compute_p99": self._compute_latency.percentile(99),
+    }
+
   @property
   def wait_time(self):
     return self._wait_time
@@ -222,7 +341,8 @@ class ModelServer(object):
     return self._return_buffer.full()
 
   def empty(self):
-    return self._load_buffer.empty()
+    with self._lock:
+      return not self._load_buffer
 
   def __call__(self, frame):
     red = self._preprocess_fn(frame, self._pdims)
@@ -250,7 +370,13 @@ def func(inputs):
   }
 
 
-def run(model, video, disp_h, wait_time, max_batch, que_size):
+def run(model,
+        video,
+        disp_h,
+        wait_time,
+        max_batch,
+        que_size,
+        use_processes=False):
   max_batch = 5 if max_batch is None else max_batch
   pfn = preprocess_fn
   pofn = utils.DrawBoxes(
@@ -262,35 +388,57 @@ def run(model, video, disp_h, wait_time, max_batch, que_size):
       postprocess_fn=pofn,
       wait_time=wait_time,
       max_batch=max_batch)
-  video = video_t.VideoServer(
-      video, wait_time=0.00000001, que=que_size, disp_h=disp_h)
+  if use_processes:
+    # read the video in its own process, the frames are passed through a
+    # ring buffer in shared memory
+    que = SharedFrameQue(
+        min(que_size, 4 * max_batch), video_t.video_shape(video, disp_h))
+    reader = mp.Process(
+        target=video_t.capture,
+        args=(video, que, disp_h, 0.00000001),
+        daemon=True)
+    reader.start()
+    video_running = lambda: reader.is_alive() or not que.empty()
+    # get copies the frame out of the slot, the server keeps the raw frame
+    # until it is drawn
+    get_frame = que.get
+  else:
+    video = video_t.VideoServer(
+        video, wait_time=0.00000001, que=que_size, disp_h=disp_h)
+    video.start()
+    video_running = lambda: video.running
+    get_frame = video.get
   display = video_t.DisplayThread(
       server, alpha=0.9, wait_time=0.000001, fix_wt=False)
   server.start()
-  video.start()
   display.start()
 
   # issue at soem point there is a
   # bottlenecked by the readeing thread.
   try:
-    while (video.running and display.running):
-      frame = video.get()
+    while (video_running() and display.running):
+      frame = get_frame()
       if not isinstance(frame, type(None)):
-        while not server.put(frame):
-          time.sleep(server.wait_time)
-      time.sleep(server.wait_time)
+        server.put(frame, block=True)
+      else:
+        time.sleep(server.wait_time)
   except Exception as e:
     print(e)
     traceback.print_exc()
 
   server.close()
   display.close()
+  if use_processes:
+    reader.terminate()
+    reader.join()
+    que.close()
 
 
 if __name__ == "__main__":
   from yolo.utils.run_utils import prep_gpu
   from yolo.configs import yolo as exp_cfg
   from yolo.tasks.yolo import YoloTask
+  from yolo.modeling.yolo_model import fuse_for_inference
   import tensorflow_datasets as tfds
   import yolo.utils.export.tensor_rt as trt
   import matplotlib.pyplot as plt
@@ -306,6 +454,7 @@ if __name__ == "__main__":
   task.initialize(model)
   model.summary()
   model.predict(tf.ones((1, 416, 416, 3), dtype=tf.float16))
+  model = fuse_for_inference(model)
 
   # #name = "saved_models/v4/tflite-regualr-no-nms"
   # #name = "saved_models/v4/tflite-tiny-no-nms"
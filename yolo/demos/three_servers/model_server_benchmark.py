@@ -0,0 +1,90 @@
+"""Throughput and latency benchmark of the ModelServer batching scheduler.
+
+Several simulated camera streams put frames into one server running a small
+convolutional model, the frames per second and the p50/p99 queue and compute
+latencies are reported for each max latency.
+
+python3 -m yolo.demos.three_servers.model_server_benchmark --streams=4
+"""
+import threading as t
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import tensorflow as tf
+
+from yolo.demos.three_servers import model_server
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('streams', 4, 'number of camera streams.')
+flags.DEFINE_float('stream_fps', 30.0, 'frames per second of each stream.')
+flags.DEFINE_integer('frame_size', 128, 'resolution of the frames.')
+flags.DEFINE_integer('max_batch', 8, 'maximum batch size.')
+flags.DEFINE_list('max_latencies', ['0', '0.005', '0.02'],
+                  'batching deadlines in seconds to benchmark.')
+flags.DEFINE_float('duration', 5.0, 'seconds to run each benchmark.')
+flags.DEFINE_string('run_strat', '/GPU:0', 'device to run the model on.')
+
+
+def build_model(frame_size):
+  inputs = tf.keras.Input([frame_size, frame_size, 3])
+  x = inputs
+  for filters in (16, 32, 64):
+    x = tf.keras.layers.Conv2D(filters, 3, strides=2, activation='relu')(x)
+  outputs = tf.keras.layers.GlobalAveragePooling2D()(x)
+  return tf.function(tf.keras.Model(inputs, outputs))
+
+
+def benchmark(model, max_latency):
+  server = model_server.ModelServer(
+      model=model,
+      postprocess_fn=lambda frames, results: frames,
+      run_strat=FLAGS.run_strat,
+      max_batch=FLAGS.max_batch,
+      max_latency=max_latency)
+  frame = np.random.uniform(size=[FLAGS.frame_size, FLAGS.frame_size, 3])
+  frame = frame.astype(np.float32)
+  running = True
+
+  def stream():
+    while running:
+      server.put(frame, block=True)
+      time.sleep(1 / FLAGS.stream_fps)
+
+  # warm up the traces of all bucketed batch sizes
+  for size in model_server.bucket_sizes(FLAGS.max_batch):
+    model(tf.zeros([size] + list(frame.shape)))
+
+  server.start()
+  streams = [t.Thread(target=stream) for _ in range(FLAGS.streams)]
+  for thread in streams:
+    thread.start()
+
+  frames = 0
+  start = time.time()
+  while time.time() - start < FLAGS.duration:
+    frames += len(server.getall())
+    time.sleep(0.001)
+  elapsed = time.time() - start
+  running = False
+  for thread in streams:
+    thread.join()
+  server.close()
+  return frames / elapsed, server.latency_stats
+
+
+def main(_):
+  model = build_model(FLAGS.frame_size)
+  print('{:>12} {:>8} {:>10} {:>10} {:>12} {:>12}'.format(
+      'max_latency', 'fps', 'queue_p50', 'queue_p99', 'compute_p50',
+      'compute_p99'))
+  for max_latency in FLAGS.max_latencies:
+    fps, stats = benchmark(model, float(max_latency))
+    print('{:>12} {:>8.1f} {:>10.4f} {:>10.4f} {:>12.4f} {:>12.4f}'.format(
+        max_latency, fps, stats['queue_p50'], stats['queue_p99'],
+        stats['compute_p50'], stats['compute_p99']))
+
+
+if __name__ == '__main__':
+  app.run(main)
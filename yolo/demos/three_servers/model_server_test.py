@@ -0,0 +1,57 @@
+import time
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from yolo.demos.three_servers import model_server
+
+
+class ModelServerTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((1, [1]), (5, [1, 2, 4, 5]), (8, [1, 2, 4, 8]))
+  def testBucketSizes(self, max_batch, expected):
+    self.assertAllEqual(expected, model_server.bucket_sizes(max_batch))
+
+  def testBatchSizesTooSmall(self):
+    with self.assertRaises(ValueError):
+      model_server.ModelServer(model=lambda x: x, max_batch=4, batch_sizes=[2])
+
+  def testBucketedBatches(self):
+    batch_sizes = []
+
+    def model(frames):
+      batch_sizes.append(int(frames.shape[0]))
+      return {'sum': tf.reduce_sum(frames, axis=[1, 2])}
+
+    def postprocess_fn(frames, results):
+      return list(zip(frames, results['sum']))
+
+    server = model_server.ModelServer(
+        model=model,
+        postprocess_fn=postprocess_fn,
+        run_strat='/CPU:0',
+        max_batch=4,
+        max_latency=0.05)
+    server.start()
+    for i in range(7):
+      self.assertTrue(server.put(np.full([2, 2], i, np.float32), block=True))
+
+    results = []
+    deadline = time.time() + 10
+    while len(results) < 7 and time.time() < deadline:
+      results.extend(server.getall())
+      time.sleep(0.01)
+    server.close()
+
+    # padded frames are dropped and the frames keep their order.
+    self.assertEqual([i for i in range(7)], [int(r[0][0, 0]) for r in results])
+    self.assertAllClose([i * 4 for i in range(7)], [r[1] for r in results])
+    self.assertContainsSubset(batch_sizes, [1, 2, 4])
+    stats = server.latency_stats
+    self.assertGreater(stats['compute_p99'], 0)
+    self.assertLessEqual(stats['queue_p50'], stats['queue_p99'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
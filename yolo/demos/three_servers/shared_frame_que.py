@@ -0,0 +1,173 @@
+"""A frame que in shared memory for handing frames between processes.
+
+Only the capture runs in its own process: model_server.run with
+use_processes=True reads the frames with SharedFrameQue.get, which copies
+each frame out of the shared memory, and the inference and the drawing stay
+in the main process. read_slot avoids the copy for consumers that are done
+with the frame before the slot is freed, ModelServer.put keeps the frame
+until its batch is run, so it has to be given a copy.
+"""
+
+import contextlib
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# header fields, followed by the sequence number of each slot
+_WRITE_SEQ = 0
+_READ_SEQ = 1
+_HEADER_SIZE = 2
+
+
+class SharedFrameQue(object):
+  """A ring buffer of fixed size frame slots in shared memory.
+
+  The que can be passed to a multiprocessing.Process, the child attaches to
+  the same memory, so capture, inference and display can run in different
+  processes without pickling the frames. Each slot holds the sequence number
+  of the frame in it, the writer fills the slot at write_seq and the reader
+  consumes the slot at read_seq. put and get copy the frames like FrameQue,
+  write_slot and read_slot hand out views of the slots to avoid the copy.
+  There should be one writer and one reader at a time.
+  """
+
+  def __init__(self, size, shape, dtype=np.float32):
+    self._size = size
+    self._shape = tuple(shape)
+    self._dtype = np.dtype(dtype)
+    frame_bytes = int(np.prod(self._shape)) * self._dtype.itemsize
+    header_bytes = (_HEADER_SIZE + size) * 8
+    self._shm = shared_memory.SharedMemory(
+        create=True, size=header_bytes + size * frame_bytes)
+    self._owner = True
+    self._lock = mp.Lock()
+    self._attach()
+    self._header[:] = 0
+    self._header[_HEADER_SIZE:] = -1
+    return
+
+  def _attach(self):
+    buf = self._shm.buf
+    self._header = np.ndarray([_HEADER_SIZE + self._size], np.int64, buf)
+    self._slots = np.ndarray([self._size, *self._shape],
+                             self._dtype,
+                             buf,
+                             offset=self._header.nbytes)
+
+  def __getstate__(self):
+    return {
+        "name": self._shm.name,
+        "size": self._size,
+        "shape": self._shape,
+        "dtype": self._dtype,
+        "lock": self._lock,
+    }
+
+  def __setstate__(self, state):
+    self._size = state["size"]
+    self._shape = state["shape"]
+    self._dtype = state["dtype"]
+    self._lock = state["lock"]
+    self._shm = shared_memory.SharedMemory(name=state["name"])
+    # only the process that created the memory may unlink it, the resource
+    # tracker would otherwise unlink it when this process exits
+    resource_tracker.unregister(self._shm._name, "shared_memory")
+    self._owner = False
+    self._attach()
+
+  @property
+  def shape(self):
+    return self._shape
+
+  @property
+  def dtype(self):
+    return self._dtype
+
+  def __len__(self):
+    with self._lock:
+      return int(self._header[_WRITE_SEQ] - self._header[_READ_SEQ])
+
+  def full(self):
+    return len(self) >= self._size
+
+  def empty(self):
+    return len(self) == 0
+
+  @contextlib.contextmanager
+  def write_slot(self):
+    """Yields a view of the next free slot, or None if the que is full. The
+    frame is published when the context exits."""
+    with self._lock:
+      seq = int(self._header[_WRITE_SEQ])
+      if seq - self._header[_READ_SEQ] >= self._size:
+        seq = None
+    if seq is None:
+      yield None
+      return
+    yield self._slots[seq % self._size]
+    with self._lock:
+      self._header[_HEADER_SIZE + seq % self._size] = seq
+      self._header[_WRITE_SEQ] = seq + 1
+
+  @contextlib.contextmanager
+  def read_slot(self):
+    """Yields the sequence number and a view of the oldest frame, or None if
+    the que is empty. The slot is freed when the context exits, so the view
+    must not be used after it.
+
+    Raises:
+      RuntimeError: the slot does not hold the frame the reader expects, which
+        happens if more than one process writes or reads the que.
+    """
+    with self._lock:
+      seq = int(self._header[_READ_SEQ])
+      if seq == self._header[_WRITE_SEQ]:
+        seq = None
+      elif self._header[_HEADER_SIZE + seq % self._size] != seq:
+        raise RuntimeError(
+            f"slot {seq % self._size} holds frame "
+            f"{self._header[_HEADER_SIZE + seq % self._size]} instead of "
+            f"frame {seq}, the que has more than one writer or reader")
+    if seq is None:
+      yield None
+      return
+    yield seq, self._slots[seq % self._size]
+    with self._lock:
+      self._header[_READ_SEQ] = seq + 1
+
+  def put(self, frame):
+    with self.write_slot() as slot:
+      if slot is None:
+        return False
+      slot[...] = frame
+    return True
+
+  def put_all(self, frames):
+    for frame in frames:
+      if not self.put(frame):
+        return False
+    return True
+
+  def get(self):
+    with self.read_slot() as item:
+      if item is None:
+        return None
+      return item[1].copy()
+
+  def read(self):
+    frame = self.get()
+    return frame is not None, frame
+
+  def close(self):
+    """Detaches from the memory, and frees it in the creating process.
+
+    The views handed out by write_slot and read_slot must have been dropped,
+    SharedMemory.close raises a BufferError while they are referenced.
+    """
+    self._header = None
+    self._slots = None
+    self._shm.close()
+    if self._owner:
+      self._shm.unlink()
@@ -0,0 +1,70 @@
+import multiprocessing as mp
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from yolo.demos.three_servers.shared_frame_que import SharedFrameQue
+
+
+def _write_frames(que, num_frames):
+  for i in range(num_frames):
+    while not que.put(np.full(que.shape, i, que.dtype)):
+      pass
+
+
+class SharedFrameQueTest(parameterized.TestCase, tf.test.TestCase):
+
+  def testRingBuffer(self):
+    que = SharedFrameQue(3, [4, 4, 3])
+    self.assertTrue(que.empty())
+    self.assertTrue(que.put_all([np.full([4, 4, 3], i) for i in range(3)]))
+    self.assertTrue(que.full())
+    self.assertFalse(que.put(np.zeros([4, 4, 3])))
+
+    # frames come out in order and the slots are reused.
+    self.assertAllEqual(np.full([4, 4, 3], 0), que.get())
+    self.assertTrue(que.put(np.full([4, 4, 3], 3)))
+    with que.read_slot() as (seq, frame):
+      self.assertEqual(1, seq)
+      self.assertAllEqual(np.full([4, 4, 3], 1), frame)
+    self.assertEqual([2, 3], [que.get()[0, 0, 0] for _ in range(2)])
+    self.assertEqual((False, None), que.read())
+    que.close()
+
+  def testWriteSlot(self):
+    que = SharedFrameQue(2, [2, 2], np.uint8)
+    with que.write_slot() as slot:
+      slot[...] = 7
+      self.assertTrue(que.empty())
+    self.assertFalse(que.empty())
+    self.assertAllEqual(np.full([2, 2], 7), que.get())
+    que.close()
+
+  def testReadSlotChecksSequence(self):
+    que = SharedFrameQue(2, [2, 2], np.uint8)
+    self.assertTrue(que.put(np.zeros([2, 2])))
+    # a second writer publishing the same slot out of order.
+    que._header[2] = 2
+    with self.assertRaises(RuntimeError):
+      with que.read_slot():
+        pass
+    que.close()
+
+  def testAcrossProcesses(self):
+    que = SharedFrameQue(4, [8, 8, 3])
+    writer = mp.Process(target=_write_frames, args=(que, 10))
+    writer.start()
+
+    frames = []
+    while len(frames) < 10:
+      frame = que.get()
+      if frame is not None:
+        frames.append(frame[0, 0, 0])
+    writer.join()
+    self.assertEqual(list(range(10)), frames)
+    que.close()
+
+
+if __name__ == '__main__':
+  tf.test.main()
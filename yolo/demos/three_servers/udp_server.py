@@ -28,12 +28,17 @@ class UDPServer(object):
     return True
 
   def send_file(self, file, ip):
-    size = len(file)
-    num_segments = np.ceil(size / IMAGE_DGRAM_SIZE)
+    # send slices of a view of the buffer, frames are not copied to bytes
+    data = memoryview(file).cast("B")
+    size = len(data)
+    num_segments = int(np.ceil(size / self.IMAGE_DGRAM_SIZE))
     start_pos = 0
     while (num_segments > 0):
-      end_pos = min(start_pos + IMAGE_DGRAM_SIZE, size)
-      self._socket.sendto(struct.pack("B", file[start_pos:end_pos]), ip)
+      end_pos = min(start_pos + self.IMAGE_DGRAM_SIZE, size)
+      # the first byte counts down the segments left, 1 marks the last one
+      self._socket.sendmsg(
+          [struct.pack("B", min(num_segments, 255)), data[start_pos:end_pos]],
+          [], 0, ip)
       start_pos = end_pos
       num_segments -= 1
     return
@@ -46,15 +51,13 @@ class UDPServer(object):
 
   def get_file(self, sock):
     sock.sendto(b"GET", (self._address, self._PORT))
-    data = b""
+    data = bytearray()
     while (True):
-      seg, addr = s.recvfrom(MAX_DGRAM_SIZE)
-      if struct.unpack("B", seg[0:1])[0] > 1:
-        dat += seg[1:]
-      else:
-        dat += seg[1:]
+      seg, addr = sock.recvfrom(self.MAX_DGRAM_SIZE)
+      data += seg[1:]
+      if struct.unpack("B", seg[0:1])[0] <= 1:
         break
-    return data
+    return bytes(data)
 
   def stop(self):
     self._running = False
@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 import threading as t
 from queue import Queue
 import traceback
@@ -79,12 +80,18 @@ class VideoServer(object):
           image = cv2.flip(image, 1)
         image = cv2.resize(
             image, (self._width, self._height), interpolation=cv2.INTER_AREA)
-        image = image / 255
 
-        if self._postprocess_fn is not None:
-          image = self._postprocess_fn(image)
-        # then dump the image on the que
-        self._ret_que.put(image)
+        if hasattr(self._ret_que, "write_slot") and self._postprocess_fn is None:
+          # normalize the image straight into the shared memory slot
+          with self._ret_que.write_slot() as slot:
+            np.multiply(image, 1 / 255, out=slot, casting="unsafe")
+        else:
+          image = image / 255
+
+          if self._postprocess_fn is not None:
+            image = self._postprocess_fn(image)
+          # then dump the image on the que
+          self._ret_que.put(image)
 
         # compute the reading FPS
         l += 1
@@ -131,6 +138,26 @@ class VideoServer(object):
     self._wait_time = value
 
 
+def video_shape(file=0, disp_h=720):
+  """The shape of the frames a VideoServer reads from the file."""
+  cap = cv2.VideoCapture(file)
+  if not cap.isOpened():
+    raise IOError("video file was not found")
+  og_height = int(cap.get(4))
+  height = og_height if disp_h is None else disp_h
+  width = int(cap.get(3) * (height / og_height))
+  cap.release()
+  return (height, width, 3)
+
+
+def capture(file, que, disp_h=720, wait_time=0.001):
+  """Reads the frames of the file into the que in the current process, used
+  as the target of a multiprocessing.Process with a SharedFrameQue."""
+  server = VideoServer(file, disp_h=disp_h, wait_time=wait_time, que=que)
+  server.load_frames()
+  return
+
+
 class VideoPlayer(object):
 
   def __init__(self,
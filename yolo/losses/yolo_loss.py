@@ -3,6 +3,7 @@ import tensorflow.keras as ks
 from tensorflow.keras import backend as K
 
 from yolo.ops.loss_utils import GridGenerator
+from yolo.ops import loss_utils
 from yolo.ops import box_ops
 from yolo.ops import math_ops
 import numpy as np
@@ -492,6 +493,8 @@ class Yolo_Loss(object):
                new_cords=False,
                scale_x_y=1.0,
                max_delta=10,
+               box_search="tiled",
+               box_search_chunk_size=None,
                **kwargs):
     """Parameters for the YOLO loss functions used at each detection head 
     output. This method builds the loss to be used in both the Scaled YOLO 
@@ -535,6 +538,14 @@ class Yolo_Loss(object):
         there should be one value for scale_xy for each level from min_level to 
         max_level.
       max_delta: gradient clipping to apply to the box loss. 
+      box_search: `str` for how the predictions are compared to all the ground
+        truth boxes to build the ignore mask, in {tiled, vectorized}. tiled
+        walks the boxes in TILE_SIZE slices with a while loop, vectorized 
+        compacts the boxes of each image and compares them in one batched op 
+        that compiles with XLA. 
+      box_search_chunk_size: `int` for the number of boxes the vectorized 
+        search compares at once to bound memory, chunks without boxes are 
+        skipped. None compares all the boxes at once.
 
     Return:
       loss: `float` for the actual loss.
@@ -578,6 +589,12 @@ class Yolo_Loss(object):
     self._new_cords = new_cords
     self._any = True
 
+    if box_search not in ("tiled", "vectorized"):
+      raise ValueError(f"unknown box_search {box_search}, must be one of "
+                       "tiled or vectorized")
+    self._box_search = box_search
+    self._box_search_chunk_size = box_search_chunk_size
+
     self._anchor_generator = GridGenerator(
         masks=mask, anchors=anchors, scale_anchors=scale_anchors)
 
@@ -720,31 +737,11 @@ class Yolo_Loss(object):
     return (pred_boxes_, pred_classes_, pred_conf, pred_classes_max, boxes,
             classes, iou_max_, ignore_mask_, conf_loss_, loss_, count, idx + 1)
 
-  def _tiled_global_box_search(self,
-                               pred_boxes,
-                               pred_classes,
-                               pred_conf,
-                               boxes,
-                               classes,
-                               true_conf,
-                               fwidth,
-                               fheight,
-                               smoothed,
-                               scale=None):
-
+  def _tiled_box_search(self, pred_boxes, pred_classes, pred_conf,
+                        pred_classes_mask, boxes, classes):
     # compute the number of boxes and the total number of tiles for the search
     num_boxes = tf.shape(boxes)[-2]
     num_tiles = num_boxes // TILE_SIZE
-
-    # convert the grount truth boxes to the model output format
-    boxes = box_ops.yxyx_to_xcycwh(boxes)
-
-    if scale is not None:
-      boxes = boxes * tf.stop_gradient(scale)
-
-    # store once the predicted classes with a high confidence, greater
-    # than 25%
-    pred_classes_mask = tf.cast(pred_classes > 0.25, tf.float32)
     pred_classes_mask = tf.expand_dims(pred_classes_mask, axis=-2)
 
     # base tensors that we will update in the while loops
@@ -775,6 +772,103 @@ class Yolo_Loss(object):
              tf.constant(0)
          ],
          parallel_iterations=20)
+    return iou_max, iou_mask, obns_loss, truth_loss, count
+
+  def _match_boxes(self, pred_boxes, pred_classes_mask, boxes, classes):
+    # compute the iou between every prediction and every box at once
+    # shape: [batch_size, width, height, num, num_boxes]
+    box_slice = boxes[:, tf.newaxis, tf.newaxis, tf.newaxis]
+    iou = box_ops.compute_iou(box_slice, tf.expand_dims(pred_boxes, axis=-2))
+
+    # mask off zero boxes from the grount truth
+    mask = tf.reduce_sum(tf.abs(box_slice), axis=-1) > 0.0
+    iou *= tf.cast(mask, iou.dtype)
+
+    # same as in _build_mask_body, with self._any only the presence of a
+    # predicted class matters, otherwise the predicted class has to be the
+    # class of the box
+    if self._any:
+      matched_classes = tf.reduce_any(
+          tf.cast(pred_classes_mask, tf.bool), axis=-1, keepdims=True)
+    else:
+      matched_classes = tf.gather(
+          pred_classes_mask,
+          tf.cast(classes, tf.int32),
+          axis=-1,
+          batch_dims=1) > 0.0
+    full_iou_mask = tf.logical_and(iou > self._ignore_thresh, matched_classes)
+
+    iou_mask = tf.reduce_any(full_iou_mask, axis=-1)
+    iou_max = tf.reduce_max(
+        iou * tf.cast(full_iou_mask, iou.dtype), axis=-1)
+    return iou_max, iou_mask
+
+  def _vectorized_box_search(self, pred_boxes, pred_classes_mask, boxes,
+                             classes):
+    # compact the boxes of each image so the padding is at the end and the
+    # chunks past the last box of every image can be skipped
+    valid = tf.reduce_sum(tf.abs(boxes), axis=-1) > 0.0
+    order = tf.argsort(
+        tf.cast(tf.logical_not(valid), tf.int32), axis=-1, stable=True)
+    boxes = tf.gather(boxes, order, batch_dims=1)
+    classes = tf.gather(classes, order, batch_dims=1)
+
+    num_boxes = boxes.shape[-2]
+    chunk_size = self._box_search_chunk_size
+    if chunk_size is None or num_boxes is None or num_boxes <= chunk_size:
+      return self._match_boxes(pred_boxes, pred_classes_mask, boxes, classes)
+
+    # the number of chunks is static, so the chunks are unrolled and compile
+    # with XLA, unlike the while loop over the tiles
+    num_chunks = -(-num_boxes // chunk_size)
+    padding = num_chunks * chunk_size - num_boxes
+    boxes = tf.pad(boxes, [[0, 0], [0, padding], [0, 0]])
+    classes = tf.pad(classes, [[0, 0], [0, padding]])
+    iou_max = tf.zeros_like(tf.reduce_sum(pred_boxes, axis=-1))
+    iou_mask = tf.zeros_like(iou_max, dtype=tf.bool)
+    for i in range(num_chunks):
+      box_slice = boxes[:, i * chunk_size:(i + 1) * chunk_size]
+      class_slice = classes[:, i * chunk_size:(i + 1) * chunk_size]
+      chunk_max, chunk_mask = tf.cond(
+          tf.reduce_any(tf.reduce_sum(tf.abs(box_slice), axis=-1) > 0.0),
+          lambda: self._match_boxes(pred_boxes, pred_classes_mask, box_slice,
+                                    class_slice),
+          lambda: (tf.zeros_like(iou_max), tf.zeros_like(iou_mask)))
+      iou_max = tf.maximum(iou_max, chunk_max)
+      iou_mask = tf.logical_or(iou_mask, chunk_mask)
+    return iou_max, iou_mask
+
+  def _global_box_search(self,
+                         pred_boxes,
+                         pred_classes,
+                         pred_conf,
+                         boxes,
+                         classes,
+                         true_conf,
+                         fwidth,
+                         fheight,
+                         smoothed,
+                         scale=None):
+
+    # convert the grount truth boxes to the model output format
+    boxes = box_ops.yxyx_to_xcycwh(boxes)
+
+    if scale is not None:
+      boxes = boxes * tf.stop_gradient(scale)
+
+    # store once the predicted classes with a high confidence, greater
+    # than 25%
+    pred_classes_mask = tf.cast(pred_classes > 0.25, tf.float32)
+
+    if self._box_search == "vectorized":
+      iou_max, iou_mask = self._vectorized_box_search(
+          pred_boxes, pred_classes_mask, boxes, classes)
+      truth_loss = tf.zeros_like(iou_max)
+      obns_loss = count = tf.expand_dims(truth_loss, axis=-1)
+    else:
+      (iou_max, iou_mask, obns_loss, truth_loss,
+       count) = self._tiled_box_search(pred_boxes, pred_classes, pred_conf,
+                                       pred_classes_mask, boxes, classes)
 
     # build the final ignore mask
     ignore_mask = tf.logical_not(iou_mask)
@@ -851,8 +945,8 @@ class Yolo_Loss(object):
   def call_scaled(self, true_counts, inds, y_true, boxes, classes, y_pred):
     # 0. generate shape constants using tf.shat to support feature multi scale
     # training
-    shape = tf.shape(true_counts)
-    batch_size, width, height, num = shape[0], shape[1], shape[2], shape[3]
+    # static dimensions are used when known so the grids can be cached
+    batch_size, width, height, num = loss_utils.get_shape(true_counts)[:4]
     fwidth = tf.cast(width, tf.float32)
     fheight = tf.cast(height, tf.float32)
 
@@ -884,7 +978,7 @@ class Yolo_Loss(object):
         fwidth, fheight, pred_box, anchor_grid, grid_points, darknet=False)
 
     if self._ignore_thresh != 0.0:
-      (_, _, _, _, _, obj_mask) = self._tiled_global_box_search(
+      (_, _, _, _, _, obj_mask) = self._global_box_search(
           pred_box,
           sigmoid_class,
           sigmoid_conf,
@@ -899,8 +993,8 @@ class Yolo_Loss(object):
     # based on input val new_cords decode the box predicitions
     # and because we are using the scaled loss, do not change the gradients
     # at all
-    offset = tf.cast(
-        tf.gather_nd(grid_points, inds, batch_dims=1), true_box.dtype)
+    # the grid points are shared by all the samples in the batch
+    offset = tf.cast(tf.gather_nd(grid_points[0], inds), true_box.dtype)
     offset = tf.concat([offset, tf.zeros_like(offset)], axis=-1)
     true_box = apply_mask(ind_mask, (scale * true_box) - offset)
     pred_box = apply_mask(ind_mask, tf.gather_nd(pred_box, inds, batch_dims=1))
@@ -988,8 +1082,7 @@ class Yolo_Loss(object):
       y_pred = grad_sigmoid(y_pred)
 
     # 1. generate and store constants and format output
-    shape = tf.shape(true_counts)
-    batch_size, width, height, num = shape[0], shape[1], shape[2], shape[3]
+    batch_size, width, height, num = loss_utils.get_shape(true_counts)[:4]
     fwidth = tf.cast(width, tf.float32)
     fheight = tf.cast(height, tf.float32)
     grid_points, anchor_grid = self._anchor_generator(
@@ -1045,7 +1138,7 @@ class Yolo_Loss(object):
     #    a box. For this indexes, the detection map loss will be ignored.
     #    obj_mask dictates the locations where the loss is ignored.
     if self._ignore_thresh != 0.0:
-      (_, _, _, _, true_conf, obj_mask) = self._tiled_global_box_search(
+      (_, _, _, _, true_conf, obj_mask) = self._global_box_search(
           pred_box,
           sigmoid_class,
           sigmoid_conf,
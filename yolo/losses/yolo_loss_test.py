@@ -0,0 +1,104 @@
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from yolo.losses import yolo_loss
+
+_ANCHORS = [(12, 16), (19, 36), (40, 28), (36, 75), (76, 55), (72, 146),
+            (142, 110), (192, 243), (459, 401)]
+
+
+def random_inputs(batch_size=2, size=13, num_boxes=100, classes=80, seed=0):
+  """predictions and compact ground truth padded to num_boxes"""
+  rng = np.random.RandomState(seed)
+  xy = rng.uniform(0.0, 1.0, [batch_size, size, size, 3, 2])
+  wh = rng.uniform(0.02, 0.5, [batch_size, size, size, 3, 2])
+  pred_boxes = np.concatenate([xy, wh], axis=-1)
+  pred_classes = rng.uniform(0.0, 0.5, [batch_size, size, size, 3, classes])
+
+  boxes = np.zeros([batch_size, num_boxes, 4])
+  box_classes = np.zeros([batch_size, num_boxes])
+  # the tiled search stops at the first empty tile, keep the last one empty
+  counts = rng.randint(1, num_boxes - yolo_loss.TILE_SIZE, [batch_size])
+  for i, count in enumerate(counts):
+    yx = rng.uniform(0.0, 0.8, [count, 2])
+    hw = rng.uniform(0.02, 0.5, [count, 2])
+    boxes[i, :count] = np.concatenate([yx, np.minimum(yx + hw, 1.0)], -1)
+    box_classes[i, :count] = rng.randint(0, classes, [count])
+
+  def cast(x):
+    return tf.constant(x, tf.float32)
+
+  return (cast(pred_boxes), cast(pred_classes), cast(boxes),
+          cast(box_classes), cast(rng.randint(0, 2, [batch_size, size, size,
+                                                     3])))
+
+
+class BoxSearchTest(parameterized.TestCase, tf.test.TestCase):
+
+  def _search(self, loss, inputs, smoothed):
+    pred_boxes, pred_classes, boxes, classes, true_conf = inputs
+    _, _, _, _, true_conf, obj_mask = loss._global_box_search(
+        pred_boxes,
+        pred_classes,
+        tf.zeros_like(pred_boxes[..., :1]),
+        boxes,
+        classes,
+        true_conf,
+        13.0,
+        13.0,
+        smoothed=smoothed,
+        scale=tf.constant([13.0, 13.0, 1.0, 1.0]))
+    return true_conf, obj_mask
+
+  @parameterized.parameters(
+      (None, True, False),
+      (None, False, True),
+      (32, True, True),
+      (32, False, False),
+  )
+  def test_matches_tiled(self, chunk_size, any_class, smoothed):
+    kwargs = dict(
+        classes=80,
+        mask=[6, 7, 8],
+        anchors=_ANCHORS,
+        ignore_thresh=0.3,
+        objectness_smooth=0.5)
+    tiled = yolo_loss.Yolo_Loss(**kwargs)
+    vectorized = yolo_loss.Yolo_Loss(
+        box_search="vectorized", box_search_chunk_size=chunk_size, **kwargs)
+    tiled._any = vectorized._any = any_class
+
+    inputs = random_inputs(num_boxes=200)
+    expected = self._search(tiled, inputs, smoothed)
+    actual = self._search(vectorized, inputs, smoothed)
+    self.assertAllEqual(expected[0], actual[0])
+    self.assertAllEqual(expected[1], actual[1])
+
+  @parameterized.parameters(None, 32)
+  def test_jit_compile(self, chunk_size):
+    loss = yolo_loss.Yolo_Loss(
+        classes=80,
+        mask=[6, 7, 8],
+        anchors=_ANCHORS,
+        ignore_thresh=0.3,
+        objectness_smooth=0.5,
+        box_search="vectorized",
+        box_search_chunk_size=chunk_size)
+    inputs = random_inputs(num_boxes=100)
+
+    search = tf.function(
+        lambda *args: self._search(loss, args, True), experimental_compile=True)
+    expected = self._search(loss, inputs, True)
+    actual = search(*inputs)
+    self.assertAllClose(expected[0], actual[0])
+    self.assertAllEqual(expected[1], actual[1])
+
+  def test_unknown_box_search(self):
+    with self.assertRaises(ValueError):
+      yolo_loss.Yolo_Loss(
+          classes=80, mask=[6, 7, 8], anchors=_ANCHORS, box_search="unknown")
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -95,8 +95,11 @@ def build_yolo_filter(model_config: yolo.Yolo, decoder: YoloDecoder, masks,
       darknet=model_config.filter.darknet,
       label_smoothing=model_config.filter.label_smoothing,
       pre_nms_points=model_config.filter.pre_nms_points,
+      per_level_top_k=model_config.filter.per_level_top_k,
       use_scaled_loss=model_config.filter.use_scaled_loss,
       update_on_repeat=model_config.filter.update_on_repeat,
+      box_search=model_config.filter.box_search,
+      box_search_chunk_size=model_config.filter.box_search_chunk_size,
       truth_thresh=_build(model_config.filter.truth_thresh.as_dict()),
       loss_type=_build(model_config.filter.loss_type.as_dict()),
       max_delta=_build(model_config.filter.max_delta.as_dict()),
@@ -38,6 +38,9 @@ class YoloLayer(ks.Model):
                scale_xy=None,
                nms_type='greedy',
                objectness_smooth=False,
+               per_level_top_k=None,
+               box_search='tiled',
+               box_search_chunk_size=None,
                **kwargs):
     """
     parameters for the loss functions used at each detection head output
@@ -74,9 +77,18 @@ class YoloLayer(ks.Model):
         there should be one value for scale_xy for each level from min_level to 
         max_level
       max_delta: gradient clipping to apply to the box loss 
-      nms_type: "greedy",
+      nms_type: `str` for the nms back end to use in {greedy, iou, giou, ciou, 
+        diou, class_independent, weighted_diou, class_batched}, 
+        class_batched suppresses all classes at once in a single graph.
       nms_thresh: 0.6,
       iou_thresh: 0.213,
+      per_level_top_k: `int` for the number of predictions to keep at each 
+        level, selected by objectness before the boxes and classes are 
+        decoded and the levels are concatenated. None keeps all predictions.
+      box_search: `str` for how the loss compares the predictions to the 
+        ground truth boxes in {tiled, vectorized}, see Yolo_Loss.
+      box_search_chunk_size: `int` for the number of boxes the vectorized 
+        search compares at once, None compares all of them at once.
       name=None,
 
 
@@ -114,6 +126,9 @@ class YoloLayer(ks.Model):
     self._update_on_repeat = update_on_repeat
 
     self._pre_nms_points = pre_nms_points
+    self._per_level_top_k = per_level_top_k
+    self._box_search = box_search
+    self._box_search_chunk_size = box_search_chunk_size
     self._label_smoothing = label_smoothing
     self._keys = list(masks.keys())
     self._len_keys = len(self._keys)
@@ -129,13 +144,16 @@ class YoloLayer(ks.Model):
         'ciou': 4,
         'diou': 5,
         'class_independent': 6,
-        'weighted_diou': 7
+        'weighted_diou': 7,
+        'class_batched': 8
     }
 
     self._nms_type = self._nms_types[nms_type]
 
     if self._nms_type >= 2 and self._nms_type <= 5:
       self._nms = nms_ops.TiledNMS(iou_type=nms_type)
+    elif self._nms_type == 8:
+      self._nms = nms_ops.TiledNMS(iou_type='iou')
 
     self._scale_xy = scale_xy or {key: 1.0 for key, _ in masks.items()}
 
@@ -190,6 +208,16 @@ class YoloLayer(ks.Model):
     classes = class_scores.get_shape().as_list()[
         -1]  #tf.shape(class_scores)[-1]
 
+    # platten predictions to [batchsize, N, -1] for non max supression
+    fill = height * width * len_mask
+
+    if self._per_level_top_k is not None:
+      # only decode the top predictions of this level
+      (obns_scores, boxes, class_scores, anchors,
+       centers) = self.filter_prediction_path(obns_scores, boxes, class_scores,
+                                              anchors, centers, fill, len_mask)
+      fill = obns_scores.get_shape().as_list()[1] or tf.shape(obns_scores)[1]
+
     # configurable to use the new coordinates in scaled Yolo v4 or not
     if not self._new_cords[key]:
       # coordinates from scaled yolov4
@@ -209,13 +237,56 @@ class YoloLayer(ks.Model):
     # convert detection map to class detection probabailities
     class_scores = tf.math.sigmoid(class_scores) * obns_scores
 
-    # platten predictions to [batchsize, N, -1] for non max supression
-    fill = height * width * len_mask
     boxes = tf.reshape(boxes, [-1, fill, 4])
     class_scores = tf.reshape(class_scores, [-1, fill, classes])
     obns_scores = tf.reshape(obns_scores, [-1, fill])
     return obns_scores, boxes, class_scores
 
+  def filter_prediction_path(self, obns_scores, boxes, class_scores, anchors,
+                             centers, fill, len_mask):
+    """Selects the top per_level_top_k predictions of a single level by 
+    objectness. The selection is done on the raw logits, so the boxes are only 
+    decoded and the classes are only activated for the kept predictions, and 
+    the levels are concatenated after the filtering. A detections score can 
+    not be larger than its objectness, so the top predictions are kept.
+
+    Args:
+      obns_scores: `Tensor` of shape [batchsize, height, width, anchors, 1] 
+        holding the objectness logits.
+      boxes: `Tensor` of shape [batchsize, height, width, anchors, 4] holding 
+        the encoded boxes.
+      class_scores: `Tensor` of shape [batchsize, height, width, anchors, 
+        classes] holding the class logits.
+      anchors: `Tensor` of shape [1, 1, 1, anchors, 2] holding the anchor 
+        boxes.
+      centers: `Tensor` of shape [1, height, width, anchors, 2] holding the 
+        grid points.
+      fill: the number of predictions at this level.
+      len_mask: `int` for the number of anchors at this level.
+
+    Return:
+      obns_scores: `Tensor` of shape [batchsize, k, 1].
+      boxes: `Tensor` of shape [batchsize, k, 4].
+      class_scores: `Tensor` of shape [batchsize, k, classes].
+      anchors: `Tensor` of shape [batchsize, k, 2].
+      centers: `Tensor` of shape [batchsize, k, 2].
+    """
+    if isinstance(fill, int):
+      k = min(self._per_level_top_k, fill)
+    else:
+      k = tf.minimum(self._per_level_top_k, fill)
+
+    obns_scores = tf.reshape(obns_scores, [-1, fill])
+    obns_scores, inds = tf.math.top_k(obns_scores, k=k, sorted=False)
+    obns_scores = tf.expand_dims(obns_scores, axis=-1)
+
+    boxes = tf.gather(tf.reshape(boxes, [-1, fill, 4]), inds, batch_dims=1)
+    class_scores = tf.gather(
+        tf.reshape(class_scores, [-1, fill, self._classes]), inds, batch_dims=1)
+    centers = tf.gather(tf.reshape(centers, [fill, 2]), inds)
+    anchors = tf.gather(tf.reshape(anchors, [len_mask, 2]), inds % len_mask)
+    return obns_scores, boxes, class_scores, anchors, centers
+
   def call(self, inputs):
     boxes = []
     class_scores = []
@@ -284,6 +355,20 @@ class YoloLayer(ks.Model):
       boxes = tf.cast(boxes, object_scores.dtype)
       class_scores = tf.cast(class_scores, object_scores.dtype)
       object_scores = tf.cast(object_scores_, object_scores.dtype)
+    elif self._nms_type == 8:
+      # all classes suppressed at once in a single graph
+      boxes = tf.cast(boxes, dtype=tf.float32)
+      class_scores = tf.cast(class_scores, dtype=tf.float32)
+      boxes, confidence, classes, num_detections = self._nms.class_batched_nms(
+          tf.expand_dims(boxes, axis=-2),
+          class_scores,
+          pre_nms_top_k=self._pre_nms_points,
+          max_num_detections=self._max_boxes,
+          nms_iou_threshold=self._nms_thresh,
+          pre_nms_score_threshold=self._thresh)
+      boxes = tf.cast(boxes, object_scores.dtype)
+      class_scores = tf.cast(classes, object_scores.dtype)
+      object_scores = tf.cast(confidence, object_scores.dtype)
     else:
       boxes = tf.cast(boxes, dtype=tf.float32)
       class_scores = tf.cast(class_scores, dtype=tf.float32)
@@ -333,7 +418,9 @@ class YoloLayer(ks.Model):
           mask=self._masks[key],
           max_delta=self._max_delta[key],
           scale_anchors=self._path_scale[key],
-          scale_x_y=self._scale_xy[key])
+          scale_x_y=self._scale_xy[key],
+          box_search=self._box_search,
+          box_search_chunk_size=self._box_search_chunk_size)
     return loss_dict
 
   def get_config(self):
@@ -342,4 +429,5 @@ class YoloLayer(ks.Model):
         'anchors': [list(a) for a in self._anchors],
         'thresh': self._thresh,
         'max_boxes': self._max_boxes,
+        'per_level_top_k': self._per_level_top_k,
     }
@@ -59,6 +59,62 @@ class YoloDecoderTest(parameterized.TestCase, tf.test.TestCase):
     self.assertAllEqual(boxes.shape.as_list(), [1, 10, 4])
     self.assertAllEqual(classes.shape.as_list(), [1, 10])
 
+  @parameterized.parameters(
+      ('greedy'),
+      ('class_batched'),
+  )
+  def test_per_level_top_k(self, nms_type):
+    input_shape = {
+        '3': [2, 52, 52, 45],
+        '4': [2, 26, 26, 45],
+        '5': [2, 13, 13, 45]
+    }
+    classes = 10
+    masks = {'3': [0, 1, 2], '4': [3, 4, 5], '5': [6, 7, 8]}
+    anchors = [[12.0, 19.0], [31.0, 46.0], [96.0, 54.0], [46.0, 114.0],
+               [133.0, 127.0], [79.0, 225.0], [301.0, 150.0], [172.0, 286.0],
+               [348.0, 340.0]]
+    new_cords = {key: False for key in masks.keys()}
+
+    inputs = {}
+    for key in input_shape.keys():
+      inputs[key] = tf.random.normal(input_shape[key], stddev=3.0)
+
+    # keeping every prediction on each level must not change the detections
+    full = dg.YoloLayer(
+        masks,
+        anchors,
+        classes,
+        iou_thresh=0.1,
+        max_boxes=20,
+        new_cords=new_cords,
+        nms_type=nms_type)(
+            inputs)
+    filtered = dg.YoloLayer(
+        masks,
+        anchors,
+        classes,
+        iou_thresh=0.1,
+        max_boxes=20,
+        new_cords=new_cords,
+        nms_type=nms_type,
+        per_level_top_k=52 * 52 * 3)(
+            inputs)
+    self.assertAllClose(full['confidence'], filtered['confidence'])
+    self.assertAllClose(full['bbox'], filtered['bbox'])
+
+    small = dg.YoloLayer(
+        masks,
+        anchors,
+        classes,
+        max_boxes=20,
+        new_cords=new_cords,
+        nms_type=nms_type,
+        per_level_top_k=100)(
+            inputs)
+    self.assertAllEqual(small['bbox'].shape.as_list(), [2, 20, 4])
+    self.assertAllEqual(small['classes'].shape.as_list(), [2, 20])
+
 
 if __name__ == '__main__':
   from yolo.utils.run_utils import prep_gpu
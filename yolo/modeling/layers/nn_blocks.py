@@ -116,12 +116,14 @@ class ConvBN(tf.keras.layers.Layer):
     # activation params
     self._activation = activation
     self._leaky_alpha = leaky_alpha
+    self._fused = False
 
     super().__init__(**kwargs)
 
   def build(self, input_shape):
     use_bias = not self._use_bn
 
+    self._paddings = None
     if not TPU_BASE:
       kernel_size = self._kernel_size if isinstance(
           self._kernel_size, int) else self._kernel_size[0]
@@ -132,8 +134,6 @@ class ConvBN(tf.keras.layers.Layer):
         left_shift = padding // 2
         self._paddings = tf.constant([[0, 0], [left_shift, left_shift],
                                       [left_shift, left_shift], [0, 0]])
-      else:
-        self._paddings = tf.constant([[0, 0], [0, 0], [0, 0], [0, 0]])
 
       self.conv = tf.keras.layers.Conv2D(
           filters=self._filters,
@@ -181,7 +181,7 @@ class ConvBN(tf.keras.layers.Layer):
       self._activation_fn = tf_utils.get_activation(self._activation)
 
   def call(self, x):
-    if not TPU_BASE:
+    if self._paddings is not None:
       x = tf.pad(x, self._paddings, mode='CONSTANT', constant_values=0)
     x = self.conv(x)
     if self._use_bn:
@@ -189,6 +189,64 @@ class ConvBN(tf.keras.layers.Layer):
     x = self._activation_fn(x)
     return x
 
+  def fuse(self):
+    """Folds the batch normalization statistics into the convolution kernel
+    and bias for inference. The explicit padding is merged into the
+    convolution if the strides are 1 and the padding is symmetric. After
+    fusing the layer is no longer trainable."""
+    if self._fused:
+      return
+    if not self.built:
+      raise ValueError('ConvBN {} must be built before it is fused.'.format(
+          self.name))
+
+    kernel = tf.cast(self.conv.kernel, tf.float64)
+    if self.conv.use_bias:
+      bias = tf.cast(self.conv.bias, tf.float64)
+    else:
+      bias = tf.zeros([self._filters], dtype=tf.float64)
+
+    if self._use_bn:
+      scale = tf.math.rsqrt(
+          tf.cast(self.bn.moving_variance, tf.float64) + self.bn.epsilon)
+      if self.bn.scale:
+        scale *= tf.cast(self.bn.gamma, tf.float64)
+      bias = (bias - tf.cast(self.bn.moving_mean, tf.float64)) * scale
+      if self.bn.center:
+        bias += tf.cast(self.bn.beta, tf.float64)
+      kernel *= scale
+
+    padding = self.conv.padding
+    strides = self.conv.strides
+    dilation_rate = self.conv.dilation_rate
+    if (self._paddings is not None and all(s == 1 for s in strides) and
+        all(d * (k - 1) % 2 == 0
+            for d, k in zip(dilation_rate, self.conv.kernel_size))):
+      padding = 'same'
+      self._paddings = None
+
+    conv = tf.keras.layers.Conv2D(
+        filters=self._filters,
+        kernel_size=self.conv.kernel_size,
+        strides=strides,
+        padding=padding,
+        dilation_rate=dilation_rate,
+        use_bias=True,
+        dtype=self.conv.dtype_policy,
+        trainable=False)
+    input_shape = [None, None, None, None]
+    input_shape[self._bn_axis] = self.conv.kernel.shape[-2]
+    conv.build(input_shape)
+    conv.kernel.assign(tf.cast(kernel, conv.kernel.dtype))
+    conv.bias.assign(tf.cast(bias, conv.bias.dtype))
+
+    self.conv = conv
+    self.bn = None
+    self._use_bn = False
+    self._fused = True
+    self.trainable = False
+    return
+
   def get_config(self):
     # used to store/share parameters to reconstruct the model
     layer_config = {
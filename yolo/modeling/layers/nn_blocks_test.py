@@ -1,6 +1,7 @@
 import tensorflow as tf
 import tensorflow.keras as ks
 import numpy as np
+from unittest import mock
 from absl.testing import parameterized
 
 from yolo.modeling.layers import nn_blocks
@@ -219,6 +220,40 @@ class ConvBNTest(tf.test.TestCase, parameterized.TestCase):
     optimizer.apply_gradients(zip(grad, test_layer.trainable_variables))
     self.assertNotIn(None, grad)
 
+  @parameterized.named_parameters(
+      ("same", (3, 3), "same", (1, 1), True, True),
+      ("downsample", (3, 3), "same", (2, 2), True, True),
+      ("pad_same", (3, 3), "same", (1, 1), False, True),
+      ("pad_downsample", (3, 3), "same", (2, 2), False, True),
+      ("no_bn", (1, 1), "valid", (1, 1), False, False))
+  def test_fuse(self, kernel_size, padding, strides, tpu_base, use_bn):
+    with mock.patch.object(nn_blocks, "TPU_BASE", tpu_base):
+      test_layer = nn_blocks.ConvBN(
+          filters=8,
+          kernel_size=kernel_size,
+          padding=padding,
+          strides=strides,
+          use_bn=use_bn,
+          activation="mish")
+      x = tf.random.normal((2, 17, 17, 4))
+      test_layer(x)
+
+    if use_bn:
+      for weight in [
+          test_layer.bn.gamma, test_layer.bn.beta, test_layer.bn.moving_mean
+      ]:
+        weight.assign(tf.random.normal(weight.shape))
+      test_layer.bn.moving_variance.assign(
+          tf.random.uniform([8], minval=0.5, maxval=2.0))
+    expected = test_layer(x, training=False)
+
+    test_layer.fuse()
+    self.assertEmpty(test_layer.trainable_variables)
+    self.assertFalse(any(
+        isinstance(layer, ks.layers.BatchNormalization)
+        for layer in test_layer.submodules))
+    self.assertAllClose(expected, test_layer(x), atol=1e-5)
+
 
 class DarkResidualTest(tf.test.TestCase, parameterized.TestCase):
 
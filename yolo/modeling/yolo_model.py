@@ -190,3 +190,29 @@ class Yolo(ks.Model):
         if module._use_bn:
           print(module.bn)
     return
+
+
+def fuse_for_inference(model):
+  """Folds the batch normalization of every ConvBN in a built model into its
+  convolution kernel and bias, in place, and freezes the model. The fused
+  model computes the same outputs in inference mode and is used for export
+  and serving, it can no longer be trained.
+
+  Args:
+    model: a built `tf.keras.Model`, typically `Yolo`.
+
+  Return:
+    the fused model.
+  """
+  if not model.built:
+    raise ValueError('The model must be built before it is fused.')
+
+  for module in model.submodules:
+    if isinstance(module, nn_blocks.ConvBN) and module.built:
+      module.fuse()
+  model.trainable = False
+
+  # drop the functions traced with the unfused layers.
+  model.predict_function = None
+  model.test_function = None
+  return model
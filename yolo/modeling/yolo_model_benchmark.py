@@ -0,0 +1,85 @@
+"""CPU latency benchmark of a Yolo model before and after Conv+BN fusion.
+
+The model is built from an experiment yaml, timed in inference mode, fused
+with `fuse_for_inference` and timed again. Only the backbone, decoder and
+head are timed unless --include_filter is set, since fusion does not change
+the detection generator. The largest absolute difference of the raw head
+outputs is reported to check the fused model is equivalent.
+
+python3 -m yolo.modeling.yolo_model_benchmark \
+  --config_file=yolo/configs/experiments/yolov4-tiny/inference/640.yaml
+"""
+import time
+
+from absl import app
+from absl import flags
+import tensorflow as tf
+
+from official.core import exp_factory
+from official.modeling import hyperparams
+from yolo.modeling import yolo_model
+from yolo.tasks import yolo
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'config_file', 'yolo/configs/experiments/yolov4-tiny/inference/640.yaml',
+    'experiment yaml of the model to benchmark.')
+flags.DEFINE_integer('batch_size', 1, 'batch size of the inputs.')
+flags.DEFINE_integer('iterations', 20, 'number of timed calls per model.')
+flags.DEFINE_integer('warmup', 2, 'number of untimed calls per model.')
+flags.DEFINE_bool('include_filter', False,
+                  'time the detection generator and nms as well.')
+
+
+def build_model(config_file):
+  config = exp_factory.get_exp_config('yolo_custom')
+  config = hyperparams.override_params_dict(
+      config, config_file, is_strict=True)
+  config.task.train_data.is_training = False
+  task = yolo.YoloTask(config.task)
+  return task.build_model(), config.task.model.input_size
+
+
+def benchmark(model, inputs, iterations, warmup, include_filter):
+
+  @tf.function
+  def call(x):
+    if include_filter:
+      return model(x, training=False)
+    maps = model.backbone(x, training=False)
+    maps = model.decoder(maps, training=False)
+    return {'raw_output': model.head(maps, training=False)}
+
+  for _ in range(warmup):
+    outputs = call(inputs)
+  tf.nest.map_structure(lambda x: x.numpy(), outputs)
+
+  start = time.time()
+  for _ in range(iterations):
+    tf.nest.map_structure(lambda x: x.numpy(), call(inputs))
+  step_time = (time.time() - start) / iterations
+  return step_time, outputs['raw_output']
+
+
+def main(_):
+  with tf.device('cpu:0'):
+    model, input_size = build_model(FLAGS.config_file)
+    inputs = tf.random.uniform([FLAGS.batch_size] + input_size)
+    step_time, expected = benchmark(model, inputs, FLAGS.iterations,
+                                    FLAGS.warmup, FLAGS.include_filter)
+    model = yolo_model.fuse_for_inference(model)
+    fused_time, actual = benchmark(model, inputs, FLAGS.iterations,
+                                   FLAGS.warmup, FLAGS.include_filter)
+
+  error = max(
+      tf.reduce_max(tf.abs(expected[key] - actual[key])).numpy()
+      for key in expected.keys())
+  print('{:>8} {:>12} {:>12}'.format('model', 'ms/call', 'images/s'))
+  for name, time_ in [('unfused', step_time), ('fused', fused_time)]:
+    print('{:>8} {:>12.2f} {:>12.2f}'.format(name, 1000 * time_,
+                                             FLAGS.batch_size / time_))
+  print('max abs difference of the raw outputs: {:.3g}'.format(error))
+
+
+if __name__ == '__main__':
+  app.run(main)
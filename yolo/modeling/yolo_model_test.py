@@ -0,0 +1,43 @@
+from absl.testing import parameterized
+import tensorflow as tf
+
+from yolo.modeling import yolo_model
+from yolo.modeling.backbones import darknet
+from yolo.modeling.layers import nn_blocks
+
+
+class FuseForInferenceTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters('cspdarknettiny', 'darknettiny')
+  def testFusedBackboneMatches(self, model_id):
+    network = darknet.Darknet(model_id=model_id, min_level=3, max_level=5)
+    inputs = tf.random.uniform([2, 128, 128, 3], seed=1)
+    network(inputs, training=False)
+
+    # move the statistics away from identity so folding is not trivial.
+    for module in network.submodules:
+      if isinstance(module, nn_blocks.ConvBN) and module._use_bn:
+        module.bn.moving_mean.assign(
+            tf.random.normal(module.bn.moving_mean.shape, stddev=0.1))
+        module.bn.moving_variance.assign(
+            tf.random.uniform(module.bn.moving_variance.shape, 0.5, 1.5))
+    expected = network(inputs, training=False)
+
+    network = yolo_model.fuse_for_inference(network)
+    self.assertEmpty(network.trainable_variables)
+    self.assertFalse(any(
+        isinstance(module, tf.keras.layers.BatchNormalization)
+        for module in network.submodules))
+
+    actual = network(inputs, training=False)
+    for key in expected.keys():
+      self.assertAllClose(expected[key], actual[key], atol=1e-4, rtol=1e-4)
+
+  def testUnbuiltModel(self):
+    network = tf.keras.Sequential([nn_blocks.ConvBN(filters=4)])
+    with self.assertRaises(ValueError):
+      yolo_model.fuse_for_inference(network)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -1,5 +1,11 @@
+import hashlib
+import json
+import os
+import uuid
+
 import tensorflow as tf
 import numpy as np
+from absl import logging
 
 from yolo.ops.box_ops import compute_iou
 from yolo.ops.box_ops import yxyx_to_xcycwh
@@ -12,18 +18,13 @@ from official.core import input_reader
 
 
 def IOU(X, centroids):
+  """Iou of boxes and centroids that share the same top left corner, this is 
+  the overlap of the widths times the overlap of the heights."""
   w, h = tf.split(X, 2, axis=-1)
   c_w, c_h = tf.split(centroids, 2, axis=-1)
 
-  similarity = (c_w * c_h) / (w * h)
-  similarity = tf.where(
-      tf.logical_and(c_w >= w, c_h >= h), w * h / (c_w * c_h), similarity)
-  similarity = tf.where(
-      tf.logical_and(c_w >= w, c_h <= h), w * c_h / (w * h + (c_w - w) * c_h),
-      similarity)
-  similarity = tf.where(
-      tf.logical_and(c_w <= w, c_h >= h), c_w * h / (w * h + c_w * (c_h - h)),
-      similarity)
+  intersection = tf.minimum(w, c_w) * tf.minimum(h, c_h)
+  similarity = intersection / (w * h + c_w * c_h - intersection)
   return tf.squeeze(similarity, axis=-1)
 
 
@@ -132,6 +133,14 @@ class AnchorKMeans:
       boxes(np.ndarray): a matrix containing image widths and heights
       k(int): number of clusters
       with_color(bool): color map
+      population_size(int): number of mutations evaluated together in each 
+        generation of the genetic search
+      generations(int): number of generations of the genetic search
+      fitness_thresh(float): iou below which a box is not counted as matched 
+        by an anchor when computing the fitness
+      chunk_size(int): number of boxes scored at once by the genetic search, 
+        bounds the memory used to population_size * chunk_size * k
+      seed(int): seed for the cluster initialization and the mutations
     To use:
       km = YoloKmeans(boxes = np.random.rand(20, 2), k = 3, with_color = True)
       centroids, map = km.run_kmeans()
@@ -147,7 +156,15 @@ class AnchorKMeans:
       centroids = km.run_kmeans()
     """
 
-  def __init__(self, boxes=None, k=9, with_color=False):
+  def __init__(self,
+               boxes=None,
+               k=9,
+               with_color=False,
+               population_size=8,
+               generations=125,
+               fitness_thresh=0.213,
+               chunk_size=65536,
+               seed=None):
     assert isinstance(k, int)
     assert isinstance(with_color, bool)
 
@@ -155,120 +172,172 @@ class AnchorKMeans:
     self._boxes = boxes
     self._clusters = None
     self._with_color = with_color
+    self._population_size = population_size
+    self._generations = generations
+    self._fitness_thresh = fitness_thresh
+    self._chunk_size = chunk_size
+    self._seed = seed
 
   def iou(self, boxes, clusters):
-    n = tf.shape(boxes)[0]
-    boxes = tf.repeat(boxes, self._k, axis=0)
-    boxes = tf.reshape(boxes, (n, self._k, -1))
     boxes = tf.cast(boxes, tf.float32)
-
-    clusters = tf.tile(clusters, [n, 1])
-    clusters = tf.reshape(clusters, (n, self._k, -1))
     clusters = tf.cast(clusters, tf.float32)
-
-    # zeros = tf.cast(tf.zeros(boxes.shape), dtype=tf.float32)
-
-    # boxes = tf.concat([zeros, boxes], axis=-1)
-    # clusters = tf.concat([zeros, clusters], axis=-1)
-    return IOU(boxes, clusters)
+    return IOU(tf.expand_dims(boxes, axis=-2), tf.expand_dims(clusters, axis=0))
 
   def metric(self, wh, k):  # compute metrics
-    # n = tf.shape(wh)[0]
-    # wh = tf.repeat(wh, self._k, axis=0)
-    # wh = tf.reshape(wh, (n, self._k, -1))
-    # wh = tf.cast(wh, tf.float32)
-
-    # k = tf.tile(k, [n, 1])
-    # k = tf.reshape(k, (n, self._k, -1))
-    # k = tf.cast(k, tf.float32)
-    # r = wh / k
-
-    # tf.print(r)
-    # x = tf.reduce_min(tf.minimum(r, 1. / r), axis = 2) # ratio metric
-    # tf.print(x)
-    # # x = x[0]
-
     x = self.iou(wh, tf.convert_to_tensor(k))  # iou metric
-    return x, tf.reduce_max(x, axis=1)[0]  # x, best_x
+    return x, tf.reduce_max(x, axis=1)  # x, best_x
 
   def fitness(self, wh, k, thr):  # mutation fitness
     _, best = self.metric(wh, k)
-    return (best * tf.cast(best > thr, tf.float32))  # fitness
+    return tf.reduce_mean(best * tf.cast(best > thr, tf.float32))  # fitness
 
-  def get_box_from_dataset(self, dataset, image_w=512):
-    box_ls = None
+  def get_box_from_dataset(self, dataset, image_w=512, batch_size=4096):
+    """Streams the width and height of every ground truth box in the dataset 
+    into a single buffer. The dataset is read once, in batches of boxes, and 
+    the buffer grows geometrically so the total copy cost stays linear in the 
+    number of boxes. Boxes with no area are dropped."""
     if not isinstance(dataset, list):
       dataset = [dataset]
+
+    def _get_wh(el):
+      wh = yxyx_to_xcycwh(tf.cast(el['groundtruth_boxes'], tf.float32))[..., 2:]
+      return tf.boolean_mask(wh, tf.reduce_all(wh > 0, axis=-1))
+
+    buffer = np.zeros((batch_size, 2), dtype=np.float32)
+    num_boxes = 0
     for ds in dataset:
-      for el in ds:
-        if type(box_ls) == type(None):
-          box_ls = yxyx_to_xcycwh(el['groundtruth_boxes'])[..., 2:]
-        else:
-          box_ls = tf.concat(
-              [box_ls, yxyx_to_xcycwh(el['groundtruth_boxes'])[..., 2:]],
-              axis=0)
-          # tf.print(yxyx_to_xcycwh(el['groundtruth_boxes'])[..., 2:])
-    self._boxes = box_ls
+      ds = ds.map(_get_wh, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+      ds = ds.unbatch().batch(batch_size)
+      for wh in ds.as_numpy_iterator():
+        if num_boxes + wh.shape[0] > buffer.shape[0]:
+          grown = np.zeros((max(2 * buffer.shape[0], num_boxes + wh.shape[0]),
+                            2),
+                           dtype=np.float32)
+          grown[:num_boxes] = buffer[:num_boxes]
+          buffer = grown
+        buffer[num_boxes:num_boxes + wh.shape[0]] = wh
+        num_boxes += wh.shape[0]
+    self._boxes = tf.convert_to_tensor(buffer[:num_boxes])
 
   @property
   def boxes(self):
     return self._boxes.numpy()
 
-  def kmeans(self, max_iter, box_num, clusters, k):
-    dists = tf.zeros((box_num, k))
-    last = tf.zeros((box_num,), dtype=tf.int64) - 1
-    old_d = dists
-
-    tf.print(tf.shape(clusters))
-    num_iters = 0
-
-    while tf.math.less(num_iters, max_iter):
-      dists = 1 - self.iou(self._boxes, clusters)
-
-      curr = tf.math.argmin(dists, axis=-1)
-      if tf.math.reduce_all(curr == last):
-        break
-      for i in range(k):
-        hold = tf.math.reduce_mean(self._boxes[curr == i], axis=0)
-        clusters = tf.tensor_scatter_nd_update(clusters, [[i]], [hold])
-        # tf.print(dists * 512, summarize=-1)
-
-      last = curr
-      num_iters += 1
-      old_d = dists
-      tf.print('k-Means box generation iteration: ', num_iters, end='\r')
-
-    f = self.fitness(self._boxes, clusters, 0.213)
-    sh = tf.shape(clusters)
+  @tf.function
+  def _kmeans(self, boxes, clusters, max_iter):
+    """Lloyd iterations with 1 - iou as the distance. The cluster means are 
+    computed with segment sums, clusters that lose all of their boxes keep 
+    their last value."""
+    k = self._k
+
+    def _loop_cond(num_iters, clusters, assignments, changed):
+      return tf.logical_and(changed, num_iters < max_iter)
+
+    def _loop_body(num_iters, clusters, assignments, changed):
+      curr = tf.math.argmax(
+          IOU(tf.expand_dims(boxes, axis=-2), tf.expand_dims(clusters, axis=0)),
+          axis=-1,
+          output_type=tf.int32)
+      changed = tf.reduce_any(tf.not_equal(curr, assignments))
+
+      sums = tf.math.unsorted_segment_sum(boxes, curr, k)
+      counts = tf.math.unsorted_segment_sum(
+          tf.ones_like(boxes[..., :1]), curr, k)
+      clusters = tf.where(counts > 0, sums / tf.maximum(counts, 1.0), clusters)
+      return num_iters + 1, clusters, curr, changed
+
+    assignments = -tf.ones_like(boxes[..., 0], dtype=tf.int32)
+    num_iters, clusters, _, _ = tf.while_loop(
+        _loop_cond, _loop_body, [0, clusters, assignments, True])
+    return num_iters, clusters
+
+  def _population_fitness(self, boxes, weights, population, num_boxes):
+    """Fitness of every member of the population. boxes is [chunks, chunk, 2]
+    and weights masks the padding of the last chunk."""
+    thr = self._fitness_thresh
+
+    def _loop_body(i, total):
+      x = IOU(boxes[i][tf.newaxis, :, tf.newaxis, :],
+              tf.expand_dims(population, axis=1))
+      best = tf.reduce_max(x, axis=-1)
+      best = best * tf.cast(best > thr, best.dtype) * weights[i]
+      return i + 1, total + tf.reduce_sum(best, axis=-1)
+
+    total = tf.zeros_like(population[:, 0, 0])
+    _, total = tf.while_loop(lambda i, total: i < tf.shape(boxes)[0],
+                             _loop_body, [0, total])
+    return total / num_boxes
+
+  @tf.function
+  def _evolve(self, boxes, weights, clusters, num_boxes, seed):
+    """Hill climbing genetic search. Each generation mutates the current 
+    clusters population_size times, scores all of the mutations at once and 
+    keeps the best one if it improves the fitness."""
+    population_size = self._population_size
     mp = 0.9
     s = 0.1
-    c = clusters
+    shape = [population_size, self._k, 2]
+
+    def _loop_body(i, clusters, fitness):
+      seeds = [tf.stack([seed, 3 * i + j]) for j in range(3)]
+      v = tf.cast(tf.random.stateless_uniform(shape, seeds[0]) < mp,
+                  clusters.dtype)
+      v *= tf.random.stateless_uniform([population_size, 1, 1], seeds[1])
+      v *= tf.random.stateless_normal(shape, seeds[2]) * s
+      v = tf.clip_by_value(v + 1, 0.3, 3.0)
+      population = tf.expand_dims(clusters, axis=0) * v
+
+      population_fitness = self._population_fitness(boxes, weights, population,
+                                                    num_boxes)
+      best = tf.math.argmax(population_fitness, output_type=tf.int32)
+      improved = population_fitness[best] > fitness
+      clusters = tf.where(improved, population[best], clusters)
+      fitness = tf.where(improved, population_fitness[best], fitness)
+      return i + 1, clusters, fitness
+
+    fitness = self._population_fitness(boxes, weights,
+                                       tf.expand_dims(clusters, axis=0),
+                                       num_boxes)[0]
+    _, clusters, fitness = tf.while_loop(
+        lambda i, clusters, fitness: i < self._generations, _loop_body,
+        [0, clusters, fitness])
+    return clusters, fitness
+
+  def _chunk_boxes(self, boxes):
+    """Pads the boxes to a multiple of the chunk size, the padded boxes have 
+    zero weight."""
+    num_boxes = boxes.shape[0]
+    chunk_size = min(self._chunk_size, num_boxes)
+    padding = -num_boxes % chunk_size
+    weights = tf.pad(tf.ones([num_boxes], boxes.dtype), [[0, padding]])
+    boxes = tf.pad(boxes, [[0, padding], [0, 0]], constant_values=1.0)
+    return (tf.reshape(boxes, [-1, chunk_size, 2]),
+            tf.reshape(weights, [-1, chunk_size]))
 
-    npr = np.random
-    number_of_generations = 1000
-    for k in range(number_of_generations):
-      v = tf.ones_like(clusters)
-      while tf.reduce_all(v == 1):
-        v = ((npr.random(sh) < mp) * npr.random() * npr.randn(*sh) * s +
-             1).clip(0.3, 3.0)
-        v = tf.convert_to_tensor(v)
-      kg = clusters * tf.cast(v, clusters.dtype)
-      fg = self.fitness(self._boxes, kg, 0.213)
-      tf.print(fg)
-      if fg > f:
-        f = fg
-        clusters = kg
-    # tf.print(c * 512, clusters * 512)
+  def kmeans(self, max_iter, box_num, clusters, k):
+    boxes = tf.cast(self._boxes, tf.float32)
+    num_iters, clusters = self._kmeans(boxes, tf.cast(clusters, tf.float32),
+                                       tf.convert_to_tensor(max_iter))
+    logging.info('k-Means box generation converged in %d iterations',
+                 int(num_iters))
+
+    c = clusters
+    seed = np.random.RandomState(self._seed).randint(2**31 - 1)
+    chunks, weights = self._chunk_boxes(boxes)
+    clusters, fitness = self._evolve(chunks, weights, clusters,
+                                     tf.cast(box_num, tf.float32),
+                                     tf.convert_to_tensor(seed))
+    logging.info('Genetic anchor search fitness: %f', float(fitness))
     return c, clusters
 
   def run_kmeans(self, max_iter=300):
     box_num = tf.shape(self._boxes)[0]
     cluster_select = tf.convert_to_tensor(
-        np.random.choice(box_num, self._k, replace=False))
+        np.random.RandomState(self._seed).choice(
+            box_num, self._k, replace=False))
     clusters = tf.gather(self._boxes, cluster_select, axis=0)
     c, clusters = self.kmeans(max_iter, box_num, clusters, self._k)
 
-    # fitness(clusters, self._boxes, )
     clusters = clusters.numpy()
     c = c.numpy()
     clusters = np.array(sorted(clusters, key=lambda x: x[0] * x[1]))
@@ -290,10 +359,82 @@ class AnchorKMeans:
 class BoxGenInputReader(input_reader.InputReader):
   """Input reader that returns a tf.data.Dataset instance."""
 
+  def __init__(self, params, *args, cache_dir=None, **kwargs):
+    """Input reader that generates the anchor boxes for a dataset. 
+
+    Args:
+      params: A config_definitions.DataConfig object.
+      *args: positional arguments passed to the InputReader.
+      cache_dir: optional `str` directory in which the generated anchors are 
+        stored. The anchors are keyed by a fingerprint of the dataset files, 
+        decoder and k-means settings, so a run that restarts on the same data 
+        loads its anchors instead of running k-means again.
+      **kwargs: key word arguments passed to the InputReader.
+    """
+    super().__init__(params, *args, **kwargs)
+    self._cache_dir = cache_dir
+    self._dataset_params = {
+        'input_path': params.input_path,
+        'tfds_name': params.tfds_name,
+        'tfds_split': params.tfds_split,
+        'tfds_data_dir': params.tfds_data_dir,
+        'decoder': params.decoder.as_dict(),
+    }
+
+  def fingerprint(self, k, image_width, input_size=None):
+    """Returns the cache key for the anchors of this dataset. The key changes
+    if any of the input files changes size or modification time."""
+    files = []
+    for path in sorted(self._matched_files):
+      stat = tf.io.gfile.stat(path)
+      files.append([path, stat.length, stat.mtime_nsec])
+    key = dict(
+        self._dataset_params,
+        files=files,
+        k=k,
+        image_width=image_width,
+        input_size=input_size)
+    key = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+  def _cache_path(self, key):
+    return os.path.join(self._cache_dir, 'anchors-{}.json'.format(key))
+
+  def _load_cached(self, key):
+    path = self._cache_path(key)
+    if not tf.io.gfile.exists(path):
+      return None
+    try:
+      with tf.io.gfile.GFile(path, 'r') as f:
+        boxes = json.load(f)['boxes']
+    except (ValueError, KeyError, tf.errors.OpError) as e:
+      logging.warning('Ignoring unreadable anchor cache %s: %s', path, e)
+      return None
+    return boxes
+
+  def _save_cached(self, key, boxes):
+    """Writes the anchors to a temporary file and renames it into place so
+    readers never see a partial file."""
+    path = self._cache_path(key)
+    tmp_path = '{}.tmp-{}'.format(path, uuid.uuid4().hex)
+    tf.io.gfile.makedirs(self._cache_dir)
+    with tf.io.gfile.GFile(tmp_path, 'w') as f:
+      json.dump({'boxes': boxes}, f)
+    tf.io.gfile.rename(tmp_path, path, overwrite=True)
+
   def read(self,
            k=None,
            image_width=416,
-           input_context=None):  # -> tf.data.Dataset:
+           input_context=None,
+           input_size=None):  # -> tf.data.Dataset:
+
+    key = None
+    if self._cache_dir:
+      key = self.fingerprint(k, image_width, input_size=input_size)
+      boxes = self._load_cached(key)
+      if boxes is not None:
+        logging.info('Loaded anchor boxes from %s', self._cache_path(key))
+        return boxes
 
     self._is_training = False
     dataset = super().read(input_context=input_context)
@@ -305,4 +446,8 @@ class BoxGenInputReader(input_reader.InputReader):
 
     print('clusting complete -> default boxes used ::')
     print(ogb)
+
+    if key is not None:
+      self._save_cached(key, boxes)
+      logging.info('Saved anchor boxes to %s', self._cache_path(key))
     return boxes
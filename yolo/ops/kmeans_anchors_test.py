@@ -0,0 +1,123 @@
+import os
+from unittest import mock
+
+import numpy as np
+import tensorflow as tf
+from absl.testing import parameterized
+
+from official.core import input_reader
+from yolo.configs import yolo as exp_cfg
+from yolo.ops import kmeans_anchors
+
+
+def _reference_kmeans(boxes, clusters, max_iter):
+  """The per cluster masked mean loop used before the segment sum update."""
+  last = None
+  for _ in range(max_iter):
+    iou = kmeans_anchors.IOU(boxes[:, None], clusters[None]).numpy()
+    curr = np.argmax(iou, axis=-1)
+    if last is not None and np.all(curr == last):
+      break
+    for i in range(clusters.shape[0]):
+      if np.any(curr == i):
+        clusters[i] = boxes[curr == i].mean(axis=0)
+    last = curr
+  return clusters
+
+
+def _synthetic_boxes(num_boxes, centers, seed=0):
+  rng = np.random.RandomState(seed)
+  centers = np.array(centers, dtype=np.float32)
+  boxes = centers[rng.randint(0, len(centers), size=num_boxes)]
+  boxes *= rng.uniform(0.9, 1.1, size=(num_boxes, 2))
+  return boxes.astype(np.float32)
+
+
+class AnchorKMeansTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((500, 3), (2000, 9))
+  def testKMeansMatchesReference(self, num_boxes, k):
+    rng = np.random.RandomState(1)
+    boxes = rng.uniform(4.0, 400.0, size=(num_boxes, 2)).astype(np.float32)
+    clusters = boxes[rng.choice(num_boxes, k, replace=False)]
+
+    expected = _reference_kmeans(boxes, clusters.copy(), 300)
+    kmeans = kmeans_anchors.AnchorKMeans(boxes=tf.constant(boxes), k=k)
+    _, actual = kmeans._kmeans(
+        tf.constant(boxes), tf.constant(clusters), tf.constant(300))
+    self.assertAllClose(expected, actual, rtol=1e-4)
+
+  def testRecoversClusters(self):
+    centers = [[10.0, 13.0], [62.0, 45.0], [156.0, 198.0]]
+    boxes = _synthetic_boxes(3000, centers)
+    # seed 3 draws the initial clusters from three different centers
+    kmeans = kmeans_anchors.AnchorKMeans(
+        boxes=tf.constant(boxes), k=3, generations=10, chunk_size=512, seed=3)
+    c, clusters, _ = kmeans.run_kmeans()
+    self.assertAllClose(centers, c, rtol=0.05)
+    # the genetic search only accepts mutations that improve the fitness
+    self.assertGreaterEqual(
+        kmeans.fitness(boxes, clusters, 0.213),
+        kmeans.fitness(boxes, c, 0.213) - 1e-6)
+
+  def testBoxesFromDataset(self):
+    rng = np.random.RandomState(2)
+    elements = []
+    for num_boxes in [3, 0, 7, 5]:
+      yx = rng.uniform(0.0, 0.5, size=(num_boxes, 2))
+      hw = rng.uniform(0.1, 0.5, size=(num_boxes, 2))
+      elements.append(np.concatenate([yx, yx + hw], axis=-1).astype(np.float32))
+
+    dataset = tf.data.Dataset.from_generator(
+        lambda: ({'groundtruth_boxes': boxes} for boxes in elements),
+        output_types={'groundtruth_boxes': tf.float32},
+        output_shapes={'groundtruth_boxes': [None, 4]})
+    kmeans = kmeans_anchors.AnchorKMeans(k=3)
+    kmeans.get_box_from_dataset([dataset, dataset], batch_size=4)
+
+    expected = np.concatenate(elements * 2, axis=0)
+    expected = np.stack(
+        [expected[:, 3] - expected[:, 1], expected[:, 2] - expected[:, 0]],
+        axis=-1)
+    self.assertAllClose(expected, kmeans.boxes)
+
+
+class BoxGenInputReaderTest(tf.test.TestCase):
+
+  def _dataset(self):
+    boxes = _synthetic_boxes(64, [[0.1, 0.2], [0.3, 0.2], [0.5, 0.6]]) / 2
+    boxes = np.concatenate([np.zeros_like(boxes), boxes], axis=-1)
+    return tf.data.Dataset.from_tensors({'groundtruth_boxes': boxes})
+
+  def testAnchorCache(self):
+    data_dir = self.get_temp_dir()
+    for name in ['train-0', 'train-1']:
+      with open(os.path.join(data_dir, name), 'w') as f:
+        f.write('records')
+    params = exp_cfg.DataConfig(input_path=os.path.join(data_dir, 'train-*'))
+    cache_dir = os.path.join(data_dir, 'anchors')
+
+    def _read_anchors():
+      reader = kmeans_anchors.BoxGenInputReader(params, cache_dir=cache_dir)
+      return reader.read(k=3, image_width=416, input_size=[416, 416, 3])
+
+    with mock.patch.object(
+        input_reader.InputReader, 'read',
+        return_value=self._dataset()) as read_fn:
+      anchors = _read_anchors()
+      self.assertEqual(1, read_fn.call_count)
+      self.assertLen(tf.io.gfile.listdir(cache_dir), 1)
+
+      # the cached anchors are used while the files are unchanged
+      self.assertAllEqual(anchors, _read_anchors())
+      self.assertEqual(1, read_fn.call_count)
+
+      with open(os.path.join(data_dir, 'train-1'), 'a') as f:
+        f.write('more records')
+      _read_anchors()
+      self.assertEqual(2, read_fn.call_count)
+      self.assertLen(tf.io.gfile.listdir(cache_dir), 2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
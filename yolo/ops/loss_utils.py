@@ -1,3 +1,4 @@
+import collections
 import tensorflow as tf
 from tensorflow.keras import backend as K
 
@@ -27,9 +28,30 @@ def _build_anchor_grid(width, height, anchors, dtype):  #, num, dtype):
   return anchors
 
 
+def get_shape(tensor):
+  """Returns the shape of a tensor using the static dimensions where they 
+  are known and the dynamic dimensions otherwise. Static dimensions allow 
+  shape keyed caches to be used with in a graph."""
+  static = tensor.get_shape().as_list()
+  dynamic = tf.shape(tensor)
+  return [dynamic[i] if dim is None else dim for i, dim in enumerate(static)]
+
+
 class GridGenerator(object):
 
-  def __init__(self, anchors, masks=None, scale_anchors=None):
+  def __init__(self, anchors, masks=None, scale_anchors=None, cache_size=8):
+    """Generates the grid points and anchor grid used to decode the yolo 
+    boxes. Grids for static shapes are built once outside of any graph and 
+    memoized by (width, height, dtype), so repeated calls and retraces for 
+    multi scale training reuse the same constants. 
+
+    Args:
+      anchors: `List[List[float]]` for the anchor boxes.
+      masks: `List[int]` for the anchors used at this level.
+      scale_anchors: `int` for how much to scale the anchors by.
+      cache_size: `int` for the maximum number of grids to keep, the least 
+        recently used grid is evicted first.
+    """
     self.dtype = tf.keras.backend.floatx()
     if masks is not None:
       self._num = len(masks)
@@ -41,22 +63,57 @@ class GridGenerator(object):
 
     self._scale_anchors = scale_anchors
     self._anchors = tf.convert_to_tensor(anchors)
+
+    self._cache = collections.OrderedDict()
+    self._cache_size = cache_size
+    self.cache_hits = 0
+    self.cache_misses = 0
     return
 
-  def _extend_batch(self, grid, batch_size):
-    return tf.tile(grid, [batch_size, 1, 1, 1, 1])
+  def cache_info(self):
+    """Returns the hit and miss counts of the grid cache, the counts are 
+    updated when a function is traced and on every eager call."""
+    return {
+        'hits': self.cache_hits,
+        'misses': self.cache_misses,
+        'size': len(self._cache),
+        'max_size': self._cache_size
+    }
+
+  def _build_grids(self, width, height, dtype):
+    grid_points = _build_grid_points(width, height, self._anchors, dtype)
+    anchor_grid = _build_anchor_grid(
+        width, height,
+        tf.cast(self._anchors, dtype) / tf.cast(self._scale_anchors, dtype),
+        dtype)
+    return grid_points, anchor_grid
 
   def __call__(self, width, height, batch_size, dtype=None):
+    """Returns the grid points of shape [1, width, height, num, 2] and the 
+    anchor grid of shape [1, 1, 1, num, 2], both broadcast along the batch 
+    dimension so batch_size is not used to tile them."""
     if dtype is None:
       self.dtype = tf.keras.backend.floatx()
     else:
       self.dtype = dtype
-    grid_points = _build_grid_points(width, height, self._anchors, self.dtype)
-    anchor_grid = _build_anchor_grid(
-        width, height,
-        tf.cast(self._anchors, self.dtype) /
-        tf.cast(self._scale_anchors, self.dtype), self.dtype)
 
-    grid_points = self._extend_batch(grid_points, batch_size)
-    anchor_grid = self._extend_batch(anchor_grid, batch_size)
-    return grid_points, anchor_grid
+    static_width = tf.get_static_value(width)
+    static_height = tf.get_static_value(height)
+    if static_width is None or static_height is None:
+      # the shape is only known at run time, the grids can not be cached
+      self.cache_misses += 1
+      return self._build_grids(width, height, self.dtype)
+
+    key = (int(static_width), int(static_height), tf.as_dtype(self.dtype).name)
+    if key in self._cache:
+      self.cache_hits += 1
+      self._cache.move_to_end(key)
+      return self._cache[key]
+
+    self.cache_misses += 1
+    with tf.init_scope():
+      grids = self._build_grids(key[0], key[1], self.dtype)
+    self._cache[key] = grids
+    if len(self._cache) > self._cache_size:
+      self._cache.popitem(last=False)
+    return grids
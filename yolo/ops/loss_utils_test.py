@@ -0,0 +1,55 @@
+import tensorflow as tf
+from absl.testing import parameterized
+
+from yolo.ops import loss_utils
+
+ANCHORS = [[12.0, 19.0], [31.0, 46.0], [96.0, 54.0]]
+
+
+class GridGeneratorTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((13, 13, 1), (26, 20, 4))
+  def testGridShapes(self, width, height, batch_size):
+    generator = loss_utils.GridGenerator(ANCHORS, scale_anchors=8)
+    grid_points, anchor_grid = generator(width, height, batch_size)
+    self.assertAllEqual([1, width, height, 3, 2], grid_points.shape.as_list())
+    self.assertAllEqual([1, 1, 1, 3, 2], anchor_grid.shape.as_list())
+    self.assertAllClose(anchor_grid[0, 0, 0], tf.constant(ANCHORS) / 8)
+
+  def testCacheHitsAndEviction(self):
+    generator = loss_utils.GridGenerator(
+        ANCHORS, scale_anchors=8, cache_size=2)
+    first = generator(13, 13, 2)
+    second = generator(13, 13, 4)
+    self.assertIs(first[0], second[0])
+    self.assertEqual(1, generator.cache_info()['hits'])
+    self.assertEqual(1, generator.cache_info()['misses'])
+
+    generator(13, 13, 2, dtype=tf.float16)
+    generator(26, 26, 2)
+    self.assertEqual(2, generator.cache_info()['size'])
+    self.assertIsNot(first[0], generator(13, 13, 2)[0])
+    self.assertEqual(4, generator.cache_info()['misses'])
+
+  def testCacheInFunction(self):
+    generator = loss_utils.GridGenerator(ANCHORS, scale_anchors=8)
+
+    @tf.function
+    def decode(x):
+      batch_size, width, height, _, _ = loss_utils.get_shape(x)
+      grid_points, _ = generator(width, height, batch_size)
+      return x + grid_points
+
+    decode(tf.zeros([2, 13, 13, 3, 2]))
+    decode(tf.zeros([2, 26, 26, 3, 2]))
+    decode(tf.zeros([2, 13, 13, 3, 2]))
+    self.assertEqual(0, generator.cache_info()['hits'])
+    self.assertEqual(2, generator.cache_info()['misses'])
+
+    # a new batch size retraces, but reuses the grid
+    decode(tf.zeros([4, 13, 13, 3, 2]))
+    self.assertEqual(1, generator.cache_info()['hits'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
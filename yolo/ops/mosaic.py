@@ -31,6 +31,8 @@ class Mosaic(object):
                mosaic_crop_mode=None,
                mixup_frequency=0.0,
                area_thresh=0.1,
+               mixup_pool_size=0,
+               mixup_pool_eviction='fifo',
                seed=None):
 
     # Establish the expected output size and the maximum resolution to use for 
@@ -66,6 +68,20 @@ class Mosaic(object):
     self._mosaic_crop_mode = mosaic_crop_mode
     self._crop_area_mosaic = crop_area_mosaic
 
+    # Size of the pool of processed samples mix up draws partners from, and
+    # how many of the oldest samples are evicted each time the pool is
+    # refreshed. The pool only replaces the second stream of mix up, the
+    # mosaic quadrants are not drawn from it. A pool size of 0, the default,
+    # zips two shuffled copies of the stream.
+    if mixup_pool_eviction not in ('fifo', 'flush'):
+      raise ValueError('mixup_pool_eviction must be fifo or flush, '
+                       'got {}'.format(mixup_pool_eviction))
+    self._mixup_pool_size = mixup_pool_size
+    if mixup_pool_eviction == 'fifo':
+      self._mixup_pool_refresh = max(mixup_pool_size // 2, 1)
+    else:
+      self._mixup_pool_refresh = mixup_pool_size
+
     self._seed = seed
     return
 
@@ -517,6 +533,27 @@ class Mosaic(object):
       dataset = self._apply_mixup(dataset)
     return dataset
 
+  def _mix(self, sample, one, two):
+    """Blends the images of two samples and merges their labels into a copy
+    of sample."""
+    sample = dict(sample)
+    otype = one["image"].dtype
+    r = tf.random.uniform([], 0.4, 0.6, tf.float32, seed=self._seed)
+    sample['image'] = (
+        r * tf.cast(one["image"], tf.float32) +
+        (1 - r) * tf.cast(two["image"], tf.float32))
+
+    sample['image'] = tf.cast(sample['image'], otype)
+    sample['groundtruth_boxes'] = tf.concat(
+        [one['groundtruth_boxes'], two['groundtruth_boxes']], axis=0)
+    sample['groundtruth_classes'] = tf.concat(
+        [one['groundtruth_classes'], two['groundtruth_classes']], axis=0)
+    sample['groundtruth_is_crowd'] = tf.concat(
+        [one['groundtruth_is_crowd'], two['groundtruth_is_crowd']], axis=0)
+    sample['groundtruth_area'] = tf.concat(
+        [one['groundtruth_area'], two['groundtruth_area']], axis=0)
+    return sample
+
   def _mixup(self, one, two):
     domo = tf.random.uniform([], 0.0, 1.0, dtype=tf.float32, seed=self._seed)
     if domo > 0.5:
@@ -526,24 +563,79 @@ class Mosaic(object):
 
     domo = tf.random.uniform([], 0.0, 1.0, dtype=tf.float32, seed=self._seed)
     if domo >= (1 - self._mixup_frequency):
-      otype = one["image"].dtype
-      r = tf.random.uniform([], 0.4, 0.6, tf.float32, seed=self._seed)
-      sample['image'] = (
-          r * tf.cast(one["image"], tf.float32) +
-          (1 - r) * tf.cast(two["image"], tf.float32))
-
-      sample['image'] = tf.cast(sample['image'], otype)
-      sample['groundtruth_boxes'] = tf.concat(
-          [one['groundtruth_boxes'], two['groundtruth_boxes']], axis=0)
-      sample['groundtruth_classes'] = tf.concat(
-          [one['groundtruth_classes'], two['groundtruth_classes']], axis=0)
-      sample['groundtruth_is_crowd'] = tf.concat(
-          [one['groundtruth_is_crowd'], two['groundtruth_is_crowd']], axis=0)
-      sample['groundtruth_area'] = tf.concat(
-          [one['groundtruth_area'], two['groundtruth_area']], axis=0)
+      sample = self._mix(sample, one, two)
     return sample
 
+  def _add_pool_info(self, sample):
+    """Records the unpadded image shape and box count of a sample entering
+    the mix up pool."""
+    height, width = preprocessing_ops.get_image_shape(sample['image'])
+    num_boxes = tf.shape(sample['groundtruth_boxes'])[0]
+    sample['pool_info'] = tf.stack([height, width, num_boxes])
+    return sample
+
+  def _from_pool(self, pool, index):
+    """Gathers and unpads one sample of a padded pool."""
+    sample = {key: value[index] for key, value in pool.items()}
+    info = sample.pop('pool_info')
+    sample['image'] = sample['image'][:info[0], :info[1]]
+    for key in [
+        'groundtruth_boxes', 'groundtruth_classes', 'groundtruth_is_crowd',
+        'groundtruth_area'
+    ]:
+      sample[key] = sample[key][:info[2]]
+    return sample
+
+  def _pool_pairs(self, pool_index, pool):
+    """Pairs each sample that entered the pool in this refresh with a random
+    partner from the pool. Every sample of the first pool is new, later pools
+    hold the newest samples at the end."""
+    size = tf.shape(pool['pool_info'])[0]
+    start = self._mixup_pool_size - self._mixup_pool_refresh
+    start = tf.where(pool_index == 0, 0, start)
+    indices = tf.range(tf.minimum(start, size), size)
+    offsets = tf.random.uniform(
+        tf.shape(indices),
+        minval=1,
+        maxval=tf.maximum(size, 2),
+        dtype=tf.int32,
+        seed=self._seed)
+    partners = (indices + offsets) % size
+
+    pairs = tf.data.Dataset.from_tensor_slices((indices, partners))
+    pools = tf.data.Dataset.from_tensors(pool).repeat()
+    return tf.data.Dataset.zip((pools, pairs))
+
+  def _pooled_mixup(self, pool, pair):
+    one = self._from_pool(pool, pair[0])
+    two = self._from_pool(pool, pair[1])
+
+    domo = tf.random.uniform([], 0.0, 1.0, dtype=tf.float32, seed=self._seed)
+    if domo >= (1 - self._mixup_frequency):
+      sample = self._mix(one, one, two)
+    else:
+      sample = one
+    sample['num_detections'] = tf.shape(sample['groundtruth_boxes'])[0]
+    return sample
+
+  def _apply_pooled_mixup(self, dataset):
+    """Mixes each sample once with a partner drawn from a bounded pool of the
+    most recent samples, so the samples upstream of mix up are only produced
+    once per epoch. The pool is a sliding window over the stream, each
+    refresh evicts the oldest samples of the pool."""
+    size = self._mixup_pool_size
+    dataset = dataset.map(
+        self._add_pool_info, num_parallel_calls=tf.data.AUTOTUNE)
+    pools = dataset.window(size, shift=self._mixup_pool_refresh)
+    pools = pools.flat_map(
+        lambda window: tf.data.Dataset.zip(window).padded_batch(size))
+    pools = pools.enumerate()
+    pairs = pools.flat_map(self._pool_pairs)
+    return pairs.map(self._pooled_mixup, num_parallel_calls=tf.data.AUTOTUNE)
+
   def _apply_mixup(self, dataset):
+    if self._mixup_pool_size > 0:
+      return self._apply_pooled_mixup(dataset)
     one = dataset.shuffle(10, seed=self._seed, reshuffle_each_iteration=True)  #.shard(num_shards=4, index=0)
     two = dataset.shuffle(10, seed=self._seed, reshuffle_each_iteration=True)  #.shard(num_shards=4, index=1)
     mixed = tf.data.Dataset.zip((one, two))  #.prefetch(tf.data.AUTOTUNE)
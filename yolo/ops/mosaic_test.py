@@ -0,0 +1,67 @@
+import tensorflow as tf
+from absl.testing import parameterized
+
+from yolo.ops import mosaic
+from yolo.ops import mosaic_benchmark
+
+
+class MosaicTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((None, [160, 160, 3]), ('crop_scale', None))
+  def testFullFrequency(self, mosaic_crop_mode, image_shape):
+    sample_fn = mosaic.Mosaic(
+        output_size=[160, 160],
+        mosaic_frequency=1.0,
+        mosaic_crop_mode=mosaic_crop_mode,
+        crop_area=[0.2, 1.0],
+        crop_area_mosaic=[0.5, 1.0],
+        seed=1)
+    dataset = mosaic_benchmark.decoded_samples(100, 5).take(6)
+    dataset = sample_fn.mosaic_fn(is_training=True)(dataset)
+
+    # each of the four zipped streams holds every sample once.
+    samples = list(dataset)
+    self.assertLen(samples, 6)
+    for sample in samples:
+      num_detections = sample['groundtruth_boxes'].shape[0]
+      self.assertTrue(sample['is_mosaic'])
+      self.assertEqual(3, sample['image'].shape.rank)
+      if image_shape is not None:
+        self.assertAllEqual(image_shape, sample['image'].shape)
+      self.assertAllEqual([num_detections, 4],
+                          sample['groundtruth_boxes'].shape)
+      self.assertAllEqual([num_detections],
+                          sample['groundtruth_classes'].shape)
+      self.assertAllEqual([num_detections], sample['groundtruth_area'].shape)
+
+  @parameterized.parameters(('fifo', 1), ('fifo', 21), ('flush', 21))
+  def testPooledMixup(self, eviction, num_samples):
+    sample_fn = mosaic.Mosaic(
+        output_size=[64, 64],
+        mosaic_frequency=0.0,
+        mixup_frequency=1.0,
+        mixup_pool_size=8,
+        mixup_pool_eviction=eviction,
+        seed=1)
+    dataset = mosaic_benchmark.decoded_samples(64, 5).take(num_samples)
+    dataset = sample_fn._apply_mixup(dataset)
+
+    # every sample is mixed exactly once with a partner from the pool.
+    samples = list(dataset)
+    self.assertCountEqual([str(i).encode() for i in range(num_samples)],
+                          [sample['source_id'].numpy() for sample in samples])
+    for sample in samples:
+      num_detections = sample['num_detections'].numpy()
+      self.assertAllEqual([64, 64, 3], sample['image'].shape)
+      self.assertAllEqual([num_detections, 4],
+                          sample['groundtruth_boxes'].shape)
+      self.assertAllEqual([num_detections],
+                          sample['groundtruth_classes'].shape)
+
+  def testPoolEviction(self):
+    with self.assertRaises(ValueError):
+      mosaic.Mosaic(output_size=[64, 64], mixup_pool_eviction='lru')
+
+
+if __name__ == '__main__':
+  tf.test.main()
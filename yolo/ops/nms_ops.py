@@ -4,6 +4,7 @@ from yolo.ops import math_ops
 from official.vision.beta.ops import box_ops as box_utils
 
 NMS_TILE_SIZE = 512
+SEGMENT_TILE_SIZE = 128
 
 
 def segment_nms(boxes, classes, confidence, iou_thresh):
@@ -74,6 +75,145 @@ def segment_nms(boxes, classes, confidence, iou_thresh):
   return confidence, boxes, classes
 
 
+def tiled_segment_nms(boxes,
+                      classes,
+                      confidence,
+                      iou_thresh,
+                      tile_size=SEGMENT_TILE_SIZE,
+                      max_iterations=200):
+  """A tiled version of segment_nms that produces the same output without 
+  building the full N x N iou matrix. The boxes are processed in tiles of 
+  tile_size, each tile is compared against every box once, so the memory 
+  grows linearly with N. The boxes in previous tiles are already resolved, so 
+  the cluster iterations only run on the tile x tile block and stop as soon 
+  as the suppression mask stops changing. Tiles with no remaining confidence 
+  are skipped, so the boxes are expected to be sorted by confidence. Only ops 
+  that compile with tflite are used. 
+  Args: 
+    boxes: a `Tensor` of shape [batch size, N, 4] that needs to be filtered.
+    classes: a `Tensor` of shape [batch size, N, num_classes] that needs to be 
+      filtered.
+    confidence: a `Tensor` of shape [batch size, N] that needs to be 
+      filtered.
+    iou_thresh: a `float` for the value above which boxes are consdered to be 
+      too similar, the closer to 1.0 the less that gets though. 
+    tile_size: an `int` for the number of boxes to process at once.
+    max_iterations: an `int` for the maximum number of cluster iterations 
+      to run on each tile.
+  
+  Return:
+    confidence: filtered `Tensor` of shape [batch size, N] 
+    boxes: filtered `Tensor` of shape [batch size, N, 4]
+    classes: filtered `Tensor` of shape [batch size, N, num_classes]
+  """
+  batch_size = tf.shape(boxes)[0]
+  num_boxes = tf.shape(boxes)[1]
+  pad = tf.cast(
+      tf.math.ceil(tf.cast(num_boxes, tf.float32) / tile_size),
+      tf.int32) * tile_size - num_boxes
+  padded_boxes = tf.pad(boxes, [[0, 0], [0, pad], [0, 0]])
+  padded_confidence = tf.pad(confidence, [[0, 0], [0, pad]])
+  num_padded = num_boxes + pad
+  num_tiles = num_padded // tile_size
+  indexes = tf.range(num_padded)
+  dtype = boxes.dtype
+
+  # a tile is only processed if a box in it has a confidence, the extra entry
+  # stops the loop after the last tile
+  tile_active = tf.reduce_max(
+      tf.reshape(padded_confidence, [batch_size, num_tiles, tile_size]),
+      axis=[0, 2])
+  tile_active = tf.pad(tile_active, [[0, 1]]) > 0
+
+  def _write_tile(values, tile, idx):
+    # uses the one hot tile mask to update the values, avoids scatters
+    shape = tf.shape(values)
+    mask = tf.cast(tf.equal(tf.range(num_tiles), idx), values.dtype)
+    mask = tf.reshape(mask, [1, -1, 1, 1])
+    values = tf.reshape(values, [batch_size, num_tiles, tile_size, -1])
+    tile = tf.reshape(tile, [batch_size, 1, tile_size, -1])
+    values = tile * mask + values * (1 - mask)
+    return tf.reshape(values, shape)
+
+  def _tile_body(keep, suppressed, merged, idx):
+    box_tile = tf.slice(padded_boxes, [0, idx * tile_size, 0],
+                        [batch_size, tile_size, 4])
+    confidence_tile = tf.slice(padded_confidence, [0, idx * tile_size],
+                               [batch_size, tile_size])
+    tile_indexes = tf.range(tile_size) + idx * tile_size
+
+    # iou between every box and the boxes in the tile, only lower indexed
+    # boxes can suppress a box
+    raw_iou = box_ops.aggregated_comparitive_iou(
+        padded_boxes, box_tile, iou_type=0)
+    iou = raw_iou * tf.cast(
+        tf.expand_dims(indexes, axis=-1) < tf.expand_dims(tile_indexes, axis=0),
+        dtype)
+
+    # suppression from the resolved boxes in the previous tiles
+    max_prev = tf.reduce_max(iou * tf.expand_dims(keep, axis=-1), axis=-2)
+
+    # cluster the boxes within the tile until the mask stops changing
+    self_iou = tf.slice(iou, [0, idx * tile_size, 0],
+                        [batch_size, tile_size, tile_size])
+
+    def _cluster(active, changed, iteration):
+      max_self = tf.reduce_max(
+          self_iou * tf.expand_dims(active, axis=-1), axis=-2)
+      new_active = tf.cast(tf.maximum(max_prev, max_self) < iou_thresh, dtype)
+      changed = tf.reduce_any(tf.not_equal(new_active, active))
+      return new_active, changed, iteration + 1
+
+    active, _, _ = tf.while_loop(
+        lambda _active, changed, iteration: tf.logical_and(
+            changed, iteration < max_iterations), _cluster,
+        [tf.ones_like(confidence_tile),
+         tf.constant(True),
+         tf.constant(0)])
+    keep = _write_tile(keep, active, idx)
+
+    # a box is removed if any kept box before it overlaps it
+    suppressed_tile = tf.reduce_any(
+        iou * tf.expand_dims(keep, axis=-1) > 0, axis=-2)
+    suppressed = _write_tile(suppressed, tf.cast(suppressed_tile, dtype), idx)
+
+    # merge the kept boxes with the boxes after them, the iou is symmetric
+    iou_t = tf.transpose(raw_iou, perm=(0, 2, 1))
+    lower = tf.expand_dims(tile_indexes, axis=-1) < tf.expand_dims(
+        indexes, axis=0)
+    diag = tf.equal(
+        tf.expand_dims(tile_indexes, axis=-1), tf.expand_dims(indexes, axis=0))
+    B = iou_t * tf.cast(lower, dtype) * tf.expand_dims(active, axis=-1)
+    eye = iou_t * tf.cast(diag, dtype)
+    weights = (B * tf.cast(B > 0.8, dtype) + eye) * tf.expand_dims(
+        confidence_tile, axis=-1)
+    merged_tile = math_ops.divide_no_nan(
+        tf.linalg.matmul(weights, padded_boxes),
+        tf.reduce_sum(weights, axis=-1, keepdims=True))
+    merged = _write_tile(merged, merged_tile, idx)
+    return keep, suppressed, merged, idx + 1
+
+  keep, suppressed, merged, _ = tf.while_loop(
+      lambda _keep, _suppressed, _merged, idx: tf.gather(tile_active, idx),
+      _tile_body, [
+          tf.zeros_like(padded_confidence),
+          tf.ones_like(padded_confidence),
+          tf.zeros_like(padded_boxes),
+          tf.constant(0)
+      ])
+
+  # build a mask of the boxes that need to exit
+  raw = 1 - tf.slice(suppressed, [0, 0], [batch_size, num_boxes])
+  boxes = tf.slice(merged, [0, 0, 0], [batch_size, num_boxes, 4])
+
+  boxes *= tf.expand_dims(raw, axis=-1)
+  confidence *= tf.cast(raw, confidence.dtype)
+  if classes is not None:
+    classes *= tf.cast(tf.expand_dims(raw, axis=-1), classes.dtype)
+
+  return confidence, boxes, classes
+
+
 def segment_iou(boxes,
                 boxes_2=None,
                 iou_thresh=0.6,
@@ -534,19 +674,56 @@ class TiledNMS():
         tf.reduce_any(iou_sum - iou_sum_new > 0.5), iou_sum_new
     ]
 
-  def _cross_suppression(self, boxes, box_slice, iou_threshold, inner_idx):
+  def _class_aware_iou(self, boxes1, boxes2, classes1=None, classes2=None):
+    """Computes the iou between two sets of boxes, if the classes are provided 
+    the iou between boxes of different classes is set to zero, resulting in a 
+    block diagonal iou matrix (after sorting by class) that allows all the 
+    classes to be suppressed at once in a single graph.
+    Args: 
+      boxes1: a `Tensor` of shape [batch size, N, 4].
+      boxes2: a `Tensor` of shape [batch size, M, 4].
+      classes1: an optional `Tensor` of shape [batch size, N].
+      classes2: an optional `Tensor` of shape [batch size, M].
+    
+    Return:
+      iou: a `Tensor` of shape [batch size, N, M].
+    """
+    iou = box_ops.aggregated_comparitive_iou(
+        boxes1, boxes2, beta=self._beta, iou_type=self._iou_type)
+    if classes1 is not None:
+      same_class = tf.equal(
+          tf.expand_dims(classes1, axis=-1), tf.expand_dims(classes2, axis=-2))
+      iou *= tf.cast(same_class, iou.dtype)
+    return iou
+
+  def _cross_suppression(self,
+                         boxes,
+                         box_slice,
+                         iou_threshold,
+                         inner_idx,
+                         classes=None,
+                         class_slice=None):
     batch_size = tf.shape(boxes)[0]
     new_slice = tf.slice(boxes, [0, inner_idx * NMS_TILE_SIZE, 0],
                          [batch_size, NMS_TILE_SIZE, 4])
+    new_class_slice = None
+    if classes is not None:
+      new_class_slice = tf.slice(classes, [0, inner_idx * NMS_TILE_SIZE],
+                                 [batch_size, NMS_TILE_SIZE])
     #iou = box_ops.bbox_overlap(new_slice, box_slice)
-    iou = box_ops.aggregated_comparitive_iou(
-        new_slice, box_slice, beta=self._beta, iou_type=self._iou_type)
+    iou = self._class_aware_iou(new_slice, box_slice, new_class_slice,
+                                class_slice)
     ret_slice = tf.expand_dims(
         tf.cast(tf.reduce_all(iou < iou_threshold, [1]), box_slice.dtype),
         2) * box_slice
     return boxes, ret_slice, iou_threshold, inner_idx + 1
 
-  def _suppression_loop_body(self, boxes, iou_threshold, output_size, idx):
+  def _suppression_loop_body(self,
+                             boxes,
+                             iou_threshold,
+                             output_size,
+                             idx,
+                             classes=None):
     """Process boxes in the range [idx*NMS_TILE_SIZE, (idx+1)*NMS_TILE_SIZE).
     Args:
       boxes: a tensor with a shape of [batch_size, anchors, 4].
@@ -555,6 +732,8 @@ class TiledNMS():
       output_size: an int32 tensor of size [batch_size]. Representing the number
         of selected boxes for each batch.
       idx: an integer scalar representing induction variable.
+      classes: an optional tensor with a shape of [batch_size, anchors], if 
+        provided boxes are only suppressed by boxes of the same class.
     Returns:
       boxes: updated boxes.
       iou_threshold: pass down iou_threshold to the next iteration.
@@ -567,16 +746,28 @@ class TiledNMS():
     # Iterates over tiles that can possibly suppress the current tile.
     box_slice = tf.slice(boxes, [0, idx * NMS_TILE_SIZE, 0],
                          [batch_size, NMS_TILE_SIZE, 4])
+    class_slice = None
+    if classes is not None:
+      class_slice = tf.slice(classes, [0, idx * NMS_TILE_SIZE],
+                             [batch_size, NMS_TILE_SIZE])
+
+    def _cross_suppression(boxes, box_slice, iou_threshold, inner_idx):
+      return self._cross_suppression(
+          boxes,
+          box_slice,
+          iou_threshold,
+          inner_idx,
+          classes=classes,
+          class_slice=class_slice)
+
     _, box_slice, _, _ = tf.while_loop(
         lambda _boxes, _box_slice, _threshold, inner_idx: inner_idx < idx,
-        self._cross_suppression,
-        [boxes, box_slice, iou_threshold,
-         tf.constant(0)])
+        _cross_suppression, [boxes, box_slice, iou_threshold,
+                             tf.constant(0)])
 
     # Iterates over the current tile to compute self-suppression.
     # iou = box_ops.bbox_overlap(box_slice, box_slice)
-    iou = box_ops.aggregated_comparitive_iou(
-        box_slice, box_slice, beta=self._beta, iou_type=self._iou_type)
+    iou = self._class_aware_iou(box_slice, box_slice, class_slice, class_slice)
     mask = tf.expand_dims(
         tf.reshape(tf.range(NMS_TILE_SIZE), [1, -1]) > tf.reshape(
             tf.range(NMS_TILE_SIZE), [-1, 1]), 0)
@@ -603,8 +794,12 @@ class TiledNMS():
         tf.cast(tf.reduce_any(box_slice > 0, [2]), tf.int32), [1])
     return boxes, iou_threshold, output_size, idx + 1
 
-  def _sorted_non_max_suppression_padded(self, scores, boxes, max_output_size,
-                                         iou_threshold):
+  def _sorted_non_max_suppression_padded(self,
+                                         scores,
+                                         boxes,
+                                         max_output_size,
+                                         iou_threshold,
+                                         classes=None):
     """A wrapper that handles non-maximum suppression.
     Assumption:
       * The boxes are sorted by scores unless the box is a dot (all coordinates
@@ -646,11 +841,17 @@ class TiledNMS():
         of boxes to be selected by non max suppression.
       iou_threshold: a float representing the threshold for whether boxes
         overlap too much with respect to IOU.
+      classes: an optional tensor with a shape of [batch_size, anchors]. If 
+        provided, boxes are only suppressed by boxes of the same class so all
+        classes are processed at once.
     Returns:
       nms_scores: a tensor with a shape of [batch_size, anchors]. It has same
         dtype as input scores.
       nms_proposals: a tensor with a shape of [batch_size, anchors, 4]. It has
         same dtype as input boxes.
+      nms_classes: a tensor with a shape of [batch_size, anchors], only 
+        returned if classes is not None. It has the same dtype as input 
+        classes.
     """
     batch_size = tf.shape(boxes)[0]
     num_boxes = tf.shape(boxes)[1]
@@ -660,6 +861,8 @@ class TiledNMS():
     boxes = tf.pad(tf.cast(boxes, tf.float32), [[0, 0], [0, pad], [0, 0]])
     scores = tf.pad(
         tf.cast(scores, tf.float32), [[0, 0], [0, pad]], constant_values=-1)
+    if classes is not None:
+      classes = tf.pad(classes, [[0, 0], [0, pad]], constant_values=-1)
     num_boxes += pad
 
     def _loop_cond(unused_boxes, unused_threshold, output_size, idx):
@@ -667,8 +870,12 @@ class TiledNMS():
           tf.reduce_min(output_size) < max_output_size,
           idx < num_boxes // NMS_TILE_SIZE)
 
+    def _loop_body(boxes, iou_threshold, output_size, idx):
+      return self._suppression_loop_body(
+          boxes, iou_threshold, output_size, idx, classes=classes)
+
     selected_boxes, _, output_size, _ = tf.while_loop(
-        _loop_cond, self._suppression_loop_body, [
+        _loop_cond, _loop_body, [
             boxes, iou_threshold,
             tf.zeros([batch_size], tf.int32),
             tf.constant(0)
@@ -709,7 +916,16 @@ class TiledNMS():
     #   boxes = math_ops.divide_no_nan(tf.linalg.matmul(weights, boxes),
     #                               tf.reduce_sum(weights, axis = -1, keepdims = True))
 
-    return scores, boxes
+    if classes is None:
+      return scores, boxes
+
+    classes = tf.reshape(
+        tf.gather(tf.reshape(classes, [-1]), idx),
+        [batch_size, max_output_size])
+    classes = classes * tf.cast(
+        tf.reshape(tf.range(max_output_size), [1, -1]) < tf.reshape(
+            output_size, [-1, 1]), classes.dtype)
+    return scores, boxes, classes
 
   def _select_top_k_scores(self, scores_in, pre_nms_num_detections):
     # batch_size, num_anchors, num_class = scores_in.get_shape().as_list()
@@ -819,6 +1035,87 @@ class TiledNMS():
         input_tensor=tf.cast(tf.greater(nmsed_scores, -1), tf.int32), axis=1)
     return nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections
 
+  def class_batched_nms(self,
+                        boxes,
+                        scores,
+                        pre_nms_top_k=5000,
+                        pre_nms_score_threshold=0.05,
+                        nms_iou_threshold=0.5,
+                        max_num_detections=100):
+    """Generate the final detections given the model outputs.
+    This implementation is a drop in replacement for complete_nms that does 
+    not unroll the classes dimension. Every (anchor, class) pair is treated as 
+    a candidate detection, the top candidates over all classes are selected, 
+    and a single tiled NMS is run using a block diagonal (same class only) 
+    iou. The graph size is independent of the number of classes, and the 
+    computation is parallelized at the batch dimension. The detections match 
+    complete_nms so long as the number of candidates above 
+    pre_nms_score_threshold is less than pre_nms_top_k. 
+    Args:
+      boxes: a tensor with shape [batch_size, N, num_classes, 4] or [batch_size,
+        N, 1, 4], which box predictions on all feature levels. The N is the 
+        number of total anchors on all levels.
+      scores: a tensor with shape [batch_size, N, num_classes], which stacks 
+        class probability on all feature levels. The N is the number of total 
+        anchors on all levels. The num_classes is the number of classes the 
+        model predicted. Note that the class_outputs here is the raw score.
+      pre_nms_top_k: an int number of top candidate detections over all 
+        classes before NMS.
+      pre_nms_score_threshold: a float representing the threshold for deciding
+        when to remove boxes based on score.
+      nms_iou_threshold: a float representing the threshold for deciding whether
+        boxes overlap too much with respect to IOU.
+      max_num_detections: a scalar representing maximum number of boxes retained
+        over all classes.
+    Returns:
+      nms_boxes: `float` Tensor of shape [batch_size, max_num_detections, 4]
+        representing top detected boxes in [y1, x1, y2, x2].
+      nms_scores: `float` Tensor of shape [batch_size, max_num_detections]
+        representing sorted confidence scores for detected boxes. The values are
+        between [0, 1].
+      nms_classes: `int` Tensor of shape [batch_size, max_num_detections]
+        representing classes for detected boxes.
+      valid_detections: `int` Tensor of shape [batch_size] only the top
+        `valid_detections` boxes are valid detections.
+    """
+    with tf.name_scope('class_batched_nms'):
+      boxes_shape = boxes.get_shape().as_list()
+      num_classes_for_box = boxes_shape[2]
+
+      scores_shape = scores.get_shape().as_list()
+      _, total_anchors, num_classes = (scores_shape[0], scores_shape[1],
+                                       scores_shape[2])
+      num_candidates = total_anchors * num_classes
+
+      # select the top candidates over all the (anchor, class) pairs
+      scores = tf.reshape(scores, [-1, num_candidates])
+      scores, indices = tf.nn.top_k(
+          scores, k=tf.math.minimum(num_candidates, pre_nms_top_k), sorted=True)
+      classes = indices % num_classes
+
+      if num_classes_for_box == 1:
+        boxes = tf.gather(
+            boxes[:, :, 0, :], indices // num_classes, batch_dims=1, axis=1)
+      else:
+        boxes = tf.reshape(boxes, [-1, num_candidates, 4])
+        boxes = tf.gather(boxes, indices, batch_dims=1, axis=1)
+
+      # Filter out scores.
+      boxes, scores = box_utils.filter_boxes_by_scores(
+          boxes, scores, min_score_threshold=pre_nms_score_threshold)
+
+      (nmsed_scores, nmsed_boxes,
+       nmsed_classes) = self._sorted_non_max_suppression_padded(
+           tf.cast(scores, tf.float32),
+           tf.cast(boxes, tf.float32),
+           max_num_detections,
+           iou_threshold=nms_iou_threshold,
+           classes=classes)
+
+    valid_detections = tf.reduce_sum(
+        input_tensor=tf.cast(tf.greater(nmsed_scores, -1), tf.int32), axis=1)
+    return nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections
+
 
 BASE_NMS = TiledNMS(iou_type='iou', beta=0.6)
 
@@ -934,21 +1231,13 @@ def nms(boxes,
   classes = tf.reshape(classes, [shape[0], -1])
   confidence = tf.reshape(confidence, [shape[0], -1])
 
-  # drop all the low class confidence boxes again
-
-  if prenms_top_k > NMS_TILE_SIZE:
-    confidence, boxes, classes = sort_drop(confidence, boxes, classes,
-                                           tf.shape(confidence)[-1])
-    confidence, boxes, classes = BASE_NMS._sorted_nms_class_indep(
-        confidence, boxes + classes, tf.squeeze(classes, axis=-1), k,
-        nms_thresh)
-    boxes -= tf.expand_dims(classes, axis=-1)
-  else:
-    confidence, boxes, classes = sort_drop(confidence, boxes, classes,
-                                           prenms_top_k)
-    confidence, boxes, classes = segment_nms(boxes + classes, classes,
-                                             confidence, nms_thresh)
-    boxes -= classes
+  # drop all the low class confidence boxes again, the tiled segment nms
+  # memory is linear in prenms_top_k so it is used for all sizes
+  confidence, boxes, classes = sort_drop(confidence, boxes, classes,
+                                         prenms_top_k)
+  confidence, boxes, classes = tiled_segment_nms(boxes + classes, classes,
+                                                 confidence, nms_thresh)
+  boxes -= classes
 
   confidence, boxes, classes = sort_drop(confidence, boxes, classes, k)
 
@@ -1003,7 +1292,7 @@ def non_max_suppression2(boxes,
           boxes, tf.expand_dims(inds_i, axis=-1), batch_dims=1)
       classes_i = tf.expand_dims(
           j * tf.ones_like(scores_i, dtype=boxes.dtype), axis=-1)
-      boxes_i, classes_i, confidence_i = segment_nms(boxes_i, classes_i,
+      confidence_i, boxes_i, classes_i = segment_nms(boxes_i, classes_i,
                                                      scores_i, nms_thresh)
 
       nmsed_boxes.append(boxes_i)
@@ -1015,8 +1304,7 @@ def non_max_suppression2(boxes,
     nmsed_scores = tf.concat(nmsed_scores, axis=-1)
 
     (nmsed_scores, nmsed_boxes,
-     nmsed_classes) = sort_drop(nmsed_scores, nmsed_boxes, nmsed_classes,
-                                prenms_top_k)
+     nmsed_classes) = sort_drop(nmsed_scores, nmsed_boxes, nmsed_classes, k)
 
     nmsed_classes = tf.squeeze(nmsed_classes, axis=-1)
 
@@ -0,0 +1,91 @@
+"""Micro-benchmark of the non max suppression back ends used by the YoloLayer.
+
+Each nms_type is run through the full YoloLayer decode and suppression on
+random head outputs, wall clock time per call is reported after warm up.
+
+python3 -m yolo.ops.nms_ops_benchmark --num_classes=80,1000 --batch_size=1
+"""
+import time
+
+from absl import app
+from absl import flags
+import tensorflow as tf
+
+from yolo.modeling.layers import detection_generator
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('num_classes', ['80', '1000'], 'class counts to benchmark.')
+flags.DEFINE_list(
+    'nms_types', [
+        'greedy', 'iou', 'giou', 'ciou', 'diou', 'class_independent',
+        'weighted_diou', 'class_batched'
+    ], 'nms back ends to benchmark.')
+flags.DEFINE_integer('batch_size', 1, 'batch size of the head outputs.')
+flags.DEFINE_integer('input_size', 416, 'input resolution of the model.')
+flags.DEFINE_integer('iterations', 20, 'number of timed calls per setting.')
+flags.DEFINE_integer('warmup', 2, 'number of untimed calls per setting.')
+
+MASKS = {'3': [0, 1, 2], '4': [3, 4, 5], '5': [6, 7, 8]}
+ANCHORS = [[12.0, 19.0], [31.0, 46.0], [96.0, 54.0], [46.0, 114.0],
+           [133.0, 127.0], [79.0, 225.0], [301.0, 150.0], [172.0, 286.0],
+           [348.0, 340.0]]
+
+
+def build_layer(nms_type, num_classes):
+  levels = {key: False for key in MASKS.keys()}
+  return detection_generator.YoloLayer(
+      MASKS,
+      ANCHORS,
+      num_classes,
+      iou_thresh=0.001,
+      nms_thresh=0.6,
+      max_boxes=200,
+      pre_nms_points=5000,
+      new_cords=levels,
+      nms_type=nms_type)
+
+
+def build_inputs(batch_size, input_size, num_classes):
+  inputs = {}
+  for key, mask in MASKS.items():
+    size = input_size // 2**int(key)
+    inputs[key] = tf.random.normal(
+        [batch_size, size, size,
+         len(mask) * (num_classes + 5)], stddev=2.0)
+  return inputs
+
+
+def benchmark(nms_type, num_classes, batch_size, input_size, iterations,
+              warmup):
+  layer = build_layer(nms_type, num_classes)
+  inputs = build_inputs(batch_size, input_size, num_classes)
+  call = tf.function(layer)
+
+  start = time.time()
+  for _ in range(warmup):
+    tf.nest.map_structure(lambda x: x.numpy(), call(inputs))
+  trace_time = time.time() - start
+
+  start = time.time()
+  for _ in range(iterations):
+    tf.nest.map_structure(lambda x: x.numpy(), call(inputs))
+  step_time = (time.time() - start) / iterations
+  return trace_time, step_time
+
+
+def main(_):
+  print('{:>8} {:>20} {:>12} {:>12} {:>12}'.format('classes', 'nms_type',
+                                                  'warmup (s)', 'ms/call',
+                                                  'images/s'))
+  for num_classes in FLAGS.num_classes:
+    for nms_type in FLAGS.nms_types:
+      trace_time, step_time = benchmark(nms_type, int(num_classes),
+                                        FLAGS.batch_size, FLAGS.input_size,
+                                        FLAGS.iterations, FLAGS.warmup)
+      print('{:>8} {:>20} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+          num_classes, nms_type, trace_time, 1000 * step_time,
+          FLAGS.batch_size / step_time))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,81 @@
+import numpy as np
+import tensorflow as tf
+from absl.testing import parameterized
+
+from yolo.ops import nms_ops
+
+
+def _random_detections(batch_size, num_boxes, num_classes, seed=0):
+  rng = np.random.RandomState(seed)
+  yx = rng.uniform(0.0, 0.8, size=(batch_size, num_boxes, 2))
+  hw = rng.uniform(0.05, 0.2, size=(batch_size, num_boxes, 2))
+  boxes = np.concatenate([yx, yx + hw], axis=-1).astype(np.float32)
+  scores = rng.uniform(0.0, 1.0, size=(batch_size, num_boxes, num_classes))
+  scores *= rng.uniform(0.0, 1.0, size=(batch_size, num_boxes, 1)) > 0.7
+  return (tf.convert_to_tensor(boxes),
+          tf.convert_to_tensor(scores.astype(np.float32)))
+
+
+class TiledNMSTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((1, 300, 4), (2, 600, 10))
+  def testClassBatchedMatchesComplete(self, batch_size, num_boxes,
+                                      num_classes):
+    boxes, scores = _random_detections(batch_size, num_boxes, num_classes)
+    boxes = tf.expand_dims(boxes, axis=-2)
+    nms = nms_ops.TiledNMS(iou_type='iou')
+
+    expected = nms.complete_nms(
+        boxes,
+        scores,
+        pre_nms_top_k=num_boxes,
+        pre_nms_score_threshold=0.3,
+        nms_iou_threshold=0.5,
+        max_num_detections=50)
+    actual = nms.class_batched_nms(
+        boxes,
+        scores,
+        pre_nms_top_k=num_boxes * num_classes,
+        pre_nms_score_threshold=0.3,
+        nms_iou_threshold=0.5,
+        max_num_detections=50)
+
+    # only compare the valid detections, padding may hold any class
+    valid = expected[1].numpy() > 0
+    self.assertAllEqual(valid, actual[1].numpy() > 0)
+    self.assertAllClose(expected[1].numpy()[valid], actual[1].numpy()[valid])
+    self.assertAllClose(expected[0].numpy()[valid], actual[0].numpy()[valid])
+    self.assertAllEqual(expected[2].numpy()[valid], actual[2].numpy()[valid])
+
+  @parameterized.parameters((1, 600, 1), (3, 200, 5))
+  def testClassBatchedShapes(self, batch_size, num_boxes, num_classes):
+    boxes, scores = _random_detections(batch_size, num_boxes, num_classes)
+    nms = nms_ops.TiledNMS(iou_type='diou')
+    boxes, scores, classes, num_detections = nms.class_batched_nms(
+        tf.expand_dims(boxes, axis=-2), scores, max_num_detections=20)
+    self.assertAllEqual([batch_size, 20, 4], boxes.shape.as_list())
+    self.assertAllEqual([batch_size, 20], scores.shape.as_list())
+    self.assertAllEqual([batch_size, 20], classes.shape.as_list())
+    self.assertAllEqual([batch_size], num_detections.shape.as_list())
+
+
+class SegmentNMSTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters((1, 100, 16), (2, 300, 64), (2, 50, 128))
+  def testTiledMatchesSegment(self, batch_size, num_boxes, tile_size):
+    boxes, scores = _random_detections(batch_size, num_boxes, 2)
+    classes = scores
+    confidence = tf.reduce_max(scores, axis=-1)
+    confidence, indices = tf.math.top_k(confidence, k=num_boxes)
+    boxes = tf.gather(boxes, indices, batch_dims=1)
+    classes = tf.gather(classes, indices, batch_dims=1)
+
+    expected = nms_ops.segment_nms(boxes, classes, confidence, 0.5)
+    actual = nms_ops.tiled_segment_nms(
+        boxes, classes, confidence, 0.5, tile_size=tile_size)
+    for expected_value, actual_value in zip(expected, actual):
+      self.assertAllClose(expected_value, actual_value, atol=1e-5)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -901,47 +901,6 @@ def apply_infos(boxes,
 
 
 # write the boxes to the anchor grid
-def _get_num_reps(anchors, mask, box_mask):
-  """
-  Calculate the number of anchor boxes that an object is repeated in.
-  
-  Args:
-    anchors: A list or Tensor representing the anchor boxes
-    mask: A `list` of `int`s representing the mask for the anchor boxes that
-      will be considered when creating the gridded ground truth.
-    box_mask: A mask for all of the boxes that are in the bounds of the image
-      and have positive height and width.
-  
-  Returns:
-    A tuple with three elements: the number of repetitions, the box indices
-    where the primary anchors are usable according to the mask, and the box
-    indices where the alternate anchors are usable according to the mask.
-  """
-  mask = tf.expand_dims(mask, 0)
-  mask = tf.expand_dims(mask, 0)
-  mask = tf.expand_dims(mask, 0)
-  box_mask = tf.expand_dims(box_mask, -1)
-  box_mask = tf.expand_dims(box_mask, -1)
-
-  anchors = tf.expand_dims(anchors, axis=-1)
-  anchors_primary, anchors_alternate = tf.split(anchors, [1, -1], axis=-2)
-  fillin = tf.zeros_like(anchors_primary) - 1
-  anchors_alternate = tf.concat([fillin, anchors_alternate], axis=-2)
-
-  viable_primary = tf.squeeze(
-      tf.logical_and(box_mask, anchors_primary == mask), axis=0)
-  viable_alternate = tf.squeeze(
-      tf.logical_and(box_mask, anchors_alternate == mask), axis=0)
-
-  viable_primary = tf.where(viable_primary)
-  viable_alternate = tf.where(viable_alternate)
-
-  viable = anchors == mask
-  acheck = tf.reduce_any(viable, axis=-1)
-  reps = tf.squeeze(tf.reduce_sum(tf.cast(acheck, mask.dtype), axis=-1), axis=0)
-  return reps, viable_primary, viable_alternate
-
-
 def _gen_utility(boxes):
   """
   Generate a mask to filter the boxes whose x and y coordinates are in
@@ -979,14 +938,71 @@ def _gen_offsets(scale_xy, dtype):
   return tf.cast(0.5 * (scale_xy - 1), dtype)
 
 
+def _gen_grid_cells(boxes, sizew, sizeh, offset=None):
+  """
+  Compute the grid cells every box is written to. Each box has 4 write slots,
+  without an offset only the first slot is used and holds the cell containing
+  the box center. With an offset, the slots hold the neighboring cells to the
+  left, top, right and bottom that are used when the center is within 
+  `offset` of that edge of its cell.
+  
+  Args:
+    boxes: A `Tensor` of shape [batch, num_boxes, 4] in the (x, y, w, h)
+      format.
+    sizew: An `int` for the width of the grid.
+    sizeh: An `int` for the height of the grid.
+    offset: An optional `float` Tensor for the pull in offset.
+  
+  Returns:
+    cells: An `int32` Tensor of shape [batch, num_boxes, 4, 2] holding the (y, 
+      x) cell of each slot.
+    valid: A `bool` Tensor of shape [batch, num_boxes, 4] that is true for the
+      slots that are written.
+  """
+  width = tf.cast(sizew, boxes.dtype)
+  height = tf.cast(sizeh, boxes.dtype)
+  x = boxes[..., 0] * width
+  y = boxes[..., 1] * height
+
+  if offset is None:
+    cells = tf.stack([tf.cast(y, tf.int32), tf.cast(x, tf.int32)], axis=-1)
+    cells = tf.tile(tf.expand_dims(cells, axis=-2), [1, 1, 4, 1])
+    valid = tf.logical_and(
+        tf.ones_like(tf.expand_dims(x, axis=-1), dtype=tf.bool),
+        tf.constant([True, False, False, False]))
+    return cells, valid
+
+  g = tf.cast(offset, x.dtype)
+  gain = tf.cast(tf.convert_to_tensor([width, height]), x.dtype)
+  gxy = tf.stack([x, y], axis=-1)
+  gxyi = gxy - tf.floor(gxy)
+  ps = ((gxyi < g) & (gxy > 1.))
+  ns = ((gxyi > (1 - g)) & (gxy < (gain - 1.)))
+  valid = tf.concat([ps, ns], axis=-1)
+
+  shifts = tf.cast([[1, 0], [0, 1], [-1, 0], [0, -1]], g.dtype) * g
+  shifted = tf.cast(tf.expand_dims(gxy, axis=-2) - shifts, tf.int32)
+  x_ = tf.clip_by_value(shifted[..., 0], 0, sizew - 1)
+  y_ = tf.clip_by_value(shifted[..., 1], 0, sizeh - 1)
+  return tf.stack([y_, x_], axis=-1), valid
+
+
 def build_grided_gt_ind(y_true, mask, sizew, sizeh, num_classes, dtype,
                         scale_xy, scale_num_inst, use_tie_breaker):
   """
   convert ground truth for use in loss functions
+
+  Every (box, anchor, grid cell) assignment is computed at once. The writes 
+  are made in the order primary anchors, alternate anchors (if 
+  use_tie_breaker), then the same with the pull in offset applied. A box
+  stops being written once num_instances writes have been made, the grid
+  holds all of the writes and the indexes and updates keep the first 
+  num_instances of them.
   
   Args:
     y_true: tf.Tensor[] ground truth
-      [batch, box coords[0:4], classes_onehot[0:-1], best_fit_anchor_box]
+      [batch, box coords[0:4], classes_onehot[0:-1], best_fit_anchor_box],
+      the batch dimension is optional.
     mask: list of the anchor boxes choresponding to the output,
       ex. [1, 2, 3] tells this layer to predict only the first 3 anchors
       in the total.
@@ -1000,7 +1016,12 @@ def build_grided_gt_ind(y_true, mask, sizew, sizeh, num_classes, dtype,
       number of predicted boxes by to get the number of instances to write
       to the grid.
   Return:
-    tf.Tensor[] of shape [batch, size, size, #of_anchors, 4, 1, num_classes]
+    indexes: `int32` Tensor of shape [batch, num_instances, 3] holding the
+      (y, x, anchor) index of each write.
+    updates: Tensor of shape [batch, num_instances, 8] holding the box, the
+      mask, the class, the iou and the number of repetitions of each write.
+    full: Tensor of shape [batch, sizeh, sizew, len(mask), 1] counting the 
+      writes to each grid cell.
   """
   # unpack required components from the input ground truth
   boxes = tf.cast(y_true['bbox'], dtype)
@@ -1008,190 +1029,131 @@ def build_grided_gt_ind(y_true, mask, sizew, sizeh, num_classes, dtype,
   anchors = tf.cast(y_true['best_anchors'], dtype)
   ious = tf.cast(y_true['best_iou_match'], dtype)
 
-  width = tf.cast(sizew, boxes.dtype)
-  height = tf.cast(sizeh, boxes.dtype)
+  is_batch = boxes.get_shape().ndims == 3
+  if not is_batch:
+    boxes = tf.expand_dims(boxes, axis=0)
+    classes = tf.expand_dims(classes, axis=0)
+    anchors = tf.expand_dims(anchors, axis=0)
+    ious = tf.expand_dims(ious, axis=0)
+
   # get the number of boxes in the ground truth boxs
+  batch_size = tf.shape(boxes)[0]
   num_boxes = tf.shape(boxes)[-2]
   # get the number of anchor boxes used for this anchor scale
   len_masks = len(mask)  #mask is a python object tf.shape(mask)[0]
-  # number of anchors
-  num_anchors = tf.shape(anchors)[-1]
   num_instances = num_boxes * scale_num_inst
 
   pull_in = _gen_offsets(scale_xy, boxes.dtype)
-  # x + 0.5
-  # x - 0.5
-  # y + 0.5
-  # y - 0.5
+  use_pull_in = tf.get_static_value(pull_in)
+  use_pull_in = use_pull_in is None or use_pull_in > 0.0
 
-  # rescale the x and y centers to the size of the grid [size, size]
+  # viable[b, n, a, m] is true if the a'th best anchor of box n is the m'th
+  # anchor of this level, the number of repetitions ignores the box mask
   mask = tf.cast(mask, dtype=dtype)
+  matches = tf.equal(tf.expand_dims(anchors, axis=-1), mask)
+  num_reps = tf.reduce_sum(
+      tf.cast(tf.reduce_any(matches, axis=-1), dtype), axis=-1)
   box_mask = _gen_utility(boxes)
-  num_reps, viable_primary, viable_alternate = _get_num_reps(
-      anchors, mask, box_mask)
-  viable_primary = tf.cast(viable_primary, tf.int32)
-  viable_alternate = tf.cast(viable_alternate, tf.int32)
-
-  num_written = 0
-  ind_val = tf.TensorArray(
-      tf.int32, size=0, dynamic_size=True, element_shape=[
-          3,
-      ])
-  ind_sample = tf.TensorArray(
-      dtype, size=0, dynamic_size=True, element_shape=[
-          8,
-      ])
-
-  (ind_val, ind_sample,
-   num_written) = write_grid(viable_primary, num_reps, boxes, classes, ious,
-                             ind_val, ind_sample, height, width, num_written,
-                             num_instances, 0.0)
+  viable = tf.logical_and(box_mask[..., tf.newaxis, tf.newaxis], matches)
+  viable_primary = viable[:, :, :1]
+  viable_alternate = tf.concat(
+      [tf.zeros_like(viable_primary), viable[:, :, 1:]], axis=2)
 
+  cells, cell_valid = _gen_grid_cells(boxes, sizew, sizeh)
+  passes = [(viable_primary, 0)]
   if use_tie_breaker:
-    (ind_val, ind_sample,
-     num_written) = write_grid(viable_alternate, num_reps, boxes, classes, ious,
-                               ind_val, ind_sample, height, width, num_written,
-                               num_instances, 0.0)
-
-  if pull_in > 0.0:
-    (ind_val, ind_sample,
-     num_written) = write_grid(viable_primary, num_reps, boxes, classes, ious,
-                               ind_val, ind_sample, height, width, num_written,
-                               num_instances, pull_in)
-
+    passes.append((viable_alternate, 0))
+  if use_pull_in:
+    pulled_cells, pulled_valid = _gen_grid_cells(
+        boxes, sizew, sizeh, offset=pull_in)
+    cells = tf.stack([cells, pulled_cells], axis=1)
+    cell_valid = tf.stack([cell_valid, pulled_valid], axis=1)
+    passes.append((viable_primary, 1))
     if use_tie_breaker:
-      (ind_val, ind_sample,
-       num_written) = write_grid(viable_alternate, num_reps, boxes, classes,
-                                 ious, ind_val, ind_sample, height, width,
-                                 num_written, num_instances, pull_in)
-
-  indexs = ind_val.stack()
-  samples = ind_sample.stack()
-
-  (true_box, ind_mask, true_class, best_iou_match, num_reps) = tf.split(
-      samples, [4, 1, 1, 1, 1], axis=-1)
-
-  full = tf.zeros([sizeh, sizew, len_masks, 1], dtype=dtype)
-  full = tf.tensor_scatter_nd_add(full, indexs, ind_mask)
-
-  if num_written >= num_instances:
-    tf.print("clipped")
-
-  indexs = pad_max_instances(indexs, num_instances, pad_value=0, pad_axis=0)
-  samples = pad_max_instances(samples, num_instances, pad_value=0, pad_axis=0)
-  return indexs, samples, full
-
-
-def write_sample(box, anchor_id, offset, sample, ind_val, ind_sample, height,
-                 width, num_written):
-  """
-  Write out the y and x grid cell location and the anchor into the `ind_val`
-  TensorArray and write the `sample` to the `ind_sample` TensorArray.
-  
-  Args:
-    box: An `int` Tensor with two elements for the relative position of the
-      box in the image.
-    anchor_id: An `int` representing the anchor box.
-    offset: A `float` representing the offset from the grid cell.
-    sample: A `float` Tensor representing the data to write out.
-    ind_val: A TensorArray representing the indices for the detected boxes.
-    ind_sample: A TensorArray representing the indices for the detected boxes.
-    height: An `int` representing the height of the image.
-    width: An `int` representing the width of the image.
-    num_written: A `int` representing the number of samples that have been
-      written.
-  
-  Returns:
-    Modified `ind_val`, `ind_sample`, and `num_written`.
-  """
-
-  a_ = tf.convert_to_tensor([tf.cast(anchor_id, tf.int32)])
-
-  y = box[1] * height
-  x = box[0] * width
-
-  # idk if this is right!!! just testing it now
-  if offset > 0:
-    g = tf.cast(offset, x.dtype)
-    gain = tf.cast(tf.convert_to_tensor([width, height]), x.dtype)
-    gxy = tf.cast(tf.convert_to_tensor([x, y]), x.dtype)
-    clamp = lambda x, ma: tf.maximum(
-        tf.minimum(x, tf.cast(ma, x.dtype)), tf.zeros_like(x))
-
-    gxyi = gxy - tf.floor(gxy)
-    ps = ((gxyi < g) & (gxy > 1.))
-    ns = ((gxyi > (1 - g)) & (gxy < (gain - 1.)))
-
-    shifts = [ps[0], ps[1], ns[0], ns[1]]
-    offset = tf.cast([[1, 0], [0, 1], [-1, 0], [0, -1]], g.dtype) * g
-
-    # xc = clamp(tf.convert_to_tensor([tf.cast(x, tf.int32)]), width - 1)
-    # yc = clamp(tf.convert_to_tensor([tf.cast(y, tf.int32)]), height - 1)
-    for i in range(4):
-      x_ = x - offset[i, 0]
-      y_ = y - offset[i, 1]
-
-      x_ = clamp(tf.convert_to_tensor([tf.cast(x_, tf.int32)]), width - 1)
-      y_ = clamp(tf.convert_to_tensor([tf.cast(y_, tf.int32)]), height - 1)
-      if shifts[i]: # and (xc != x_ or yc != y_):
-        grid_idx = tf.concat([y_, x_, a_], axis=-1)
-        ind_val = ind_val.write(num_written, grid_idx)
-        ind_sample = ind_sample.write(num_written, sample)
-        num_written += 1
+      passes.append((viable_alternate, 1))
   else:
-    y_ = tf.convert_to_tensor([tf.cast(y, tf.int32)])
-    x_ = tf.convert_to_tensor([tf.cast(x, tf.int32)])
-    grid_idx = tf.concat([y_, x_, a_], axis=-1)
-    ind_val = ind_val.write(num_written, grid_idx)
-    ind_sample = ind_sample.write(num_written, sample)
-    num_written += 1
-  return ind_val, ind_sample, num_written
-
-
-def write_grid(viable, num_reps, boxes, classes, ious, ind_val, ind_sample,
-               height, width, num_written, num_instances, offset):
-  """
-  Iterate through all viable anchor boxes and write the sample information to
-  the `ind_val` and `ind_sample` TensorArrays.
-  
-  Args:
-    num_reps: An `int` Tensor representing the number of repetitions.
-    boxes: A 2D `int` Tensor with two elements for the relative position of the
-      box in the image for each object.
-    classes: An `int` Tensor representing the class for each object.
-    ious: A 2D `int` Tensor representing the IOU of object with each anchor box.
-    ind_val: A TensorArray representing the indices for the detected boxes.
-    ind_sample: A TensorArray representing the indices for the detected boxes.
-    height: An `int` representing the height of the image.
-    width: An `int` representing the width of the image.
-    num_written: A `int` representing the number of samples that have been
-      written.
-    num_instances: A `int` representing the number of instances that can be
-      written at the maximum.
-    offset: A `float` representing the offset from the grid cell.
-  
-  Returns:
-    Modified `ind_val`, `ind_sample`, and `num_written`.
-  """
-
-  const = tf.cast(tf.convert_to_tensor([1.]), dtype=boxes.dtype)
-  num_viable = tf.shape(viable)[0]
-  for val in range(num_viable):
-    idx = viable[val]
-    obj_id, anchor, anchor_idx = idx[0], idx[1], idx[2]
-    if num_written >= num_instances:
-      break
-
-    reps = tf.convert_to_tensor([num_reps[obj_id]])
-    box = boxes[obj_id]
-    cls_ = classes[obj_id]
-    iou = tf.convert_to_tensor([ious[obj_id, anchor]])
-    sample = tf.concat([box, const, cls_, iou, reps], axis=-1)
-
-    ind_val, ind_sample, num_written = write_sample(box, anchor_idx, offset,
-                                                    sample, ind_val, ind_sample,
-                                                    height, width, num_written)
-  return ind_val, ind_sample, num_written
+    cells = tf.expand_dims(cells, axis=1)
+    cell_valid = tf.expand_dims(cell_valid, axis=1)
+
+  # flatten every pass to write slots ordered by box, anchor, mask and slot.
+  # each slot keeps the box, anchor, mask, slot and offset it came from.
+  slots = []
+  slot_info = []
+  for viable, offset_id in passes:
+    pass_valid = cell_valid[:, offset_id]
+    pass_valid = tf.expand_dims(tf.expand_dims(pass_valid, axis=2), axis=2)
+    valid = tf.logical_and(tf.expand_dims(viable, axis=-1), pass_valid)
+    shape = tf.shape(valid)[1:]
+    slots.append(tf.reshape(valid, [batch_size, -1]))
+
+    info = tf.stack(
+        tf.meshgrid(
+            tf.range(shape[0]),
+            tf.range(shape[1]),
+            tf.range(shape[2]),
+            tf.range(shape[3]),
+            indexing='ij'),
+        axis=-1)
+    info = tf.reshape(info, [-1, 4])
+    slot_info.append(tf.pad(info, [[0, 0], [0, 1]], constant_values=offset_id))
+  slots = tf.concat(slots, axis=-1)
+  slot_info = tf.concat(slot_info, axis=0)
+
+  # a box is only written if fewer than num_instances writes came before it
+  num_slots = tf.shape(slots)[-1]
+  counts = tf.reduce_sum(
+      tf.cast(tf.reshape(slots, [batch_size, -1, 4]), tf.int32), axis=-1)
+  keep = tf.math.cumsum(counts, axis=-1, exclusive=True) < num_instances
+  slots = tf.logical_and(
+      slots, tf.reshape(tf.tile(keep[..., None], [1, 1, 4]), [batch_size, -1]))
+
+  def _get_cells(batch_ind, slot_ind):
+    info = tf.gather(slot_info, slot_ind)
+    cell_ind = tf.stack(
+        [batch_ind, info[..., 4], info[..., 0], info[..., 3]], axis=-1)
+    return tf.gather_nd(cells, cell_ind), info
+
+  # write all the boxes to the grid at once
+  written = tf.cast(tf.where(slots), tf.int32)
+  yx, info = _get_cells(written[:, 0], written[:, 1])
+  full = tf.zeros([batch_size, sizeh, sizew, len_masks, 1], dtype=dtype)
+  full = tf.tensor_scatter_nd_add(
+      full,
+      tf.concat([written[:, :1], yx, info[:, 2:3]], axis=-1),
+      tf.ones_like(written[:, :1], dtype=dtype))
+
+  # move the written slots to the front keeping their order, and keep the
+  # first num_instances of them
+  order = tf.argsort(
+      tf.cast(tf.logical_not(slots), tf.int32), axis=-1, stable=True)
+  order = order[:, :tf.minimum(num_slots, num_instances)]
+  order_mask = tf.gather(slots, order, batch_dims=1)
+  batch_ind = tf.broadcast_to(tf.range(batch_size)[:, None], tf.shape(order))
+  yx, info = _get_cells(batch_ind, order)
+
+  box_ind = tf.stack([batch_ind, info[..., 0]], axis=-1)
+  iou = tf.gather_nd(ious, tf.stack([batch_ind, info[..., 0], info[..., 1]],
+                                    axis=-1))
+  samples = tf.concat([
+      tf.gather_nd(boxes, box_ind),
+      tf.ones_like(iou[..., None]),
+      tf.gather_nd(classes, box_ind), iou[..., None],
+      tf.gather_nd(num_reps, box_ind)[..., None]
+  ],
+                      axis=-1)
+  indexs = tf.concat([yx, info[..., 2:3]], axis=-1)
+
+  order_mask = order_mask[..., None]
+  indexs = tf.where(order_mask, indexs, tf.zeros_like(indexs))
+  samples = tf.where(order_mask, samples, tf.zeros_like(samples))
+  indexs = pad_max_instances(indexs, num_instances, pad_value=0, pad_axis=1)
+  samples = pad_max_instances(samples, num_instances, pad_value=0, pad_axis=1)
+
+  if not is_batch:
+    indexs = tf.squeeze(indexs, axis=0)
+    samples = tf.squeeze(samples, axis=0)
+    full = tf.squeeze(full, axis=0)
+  return indexs, samples, full
 
 
 def get_best_anchor(y_true,
@@ -5,6 +5,202 @@ from absl.testing import parameterized
 from yolo.ops import preprocessing_ops
 
 
+# the TensorArray implementation of build_grided_gt_ind that writes one box at
+# a time, used as the reference for the vectorized version.
+def _reference_get_num_reps(anchors, mask, box_mask):
+  mask = tf.expand_dims(mask, 0)
+  mask = tf.expand_dims(mask, 0)
+  mask = tf.expand_dims(mask, 0)
+  box_mask = tf.expand_dims(box_mask, -1)
+  box_mask = tf.expand_dims(box_mask, -1)
+
+  anchors = tf.expand_dims(anchors, axis=-1)
+  anchors_primary, anchors_alternate = tf.split(anchors, [1, -1], axis=-2)
+  fillin = tf.zeros_like(anchors_primary) - 1
+  anchors_alternate = tf.concat([fillin, anchors_alternate], axis=-2)
+
+  viable_primary = tf.squeeze(
+      tf.logical_and(box_mask, anchors_primary == mask), axis=0)
+  viable_alternate = tf.squeeze(
+      tf.logical_and(box_mask, anchors_alternate == mask), axis=0)
+
+  viable_primary = tf.where(viable_primary)
+  viable_alternate = tf.where(viable_alternate)
+
+  viable = anchors == mask
+  acheck = tf.reduce_any(viable, axis=-1)
+  reps = tf.squeeze(tf.reduce_sum(tf.cast(acheck, mask.dtype), axis=-1), axis=0)
+  return reps, viable_primary, viable_alternate
+
+
+def _reference_build_grided_gt_ind(y_true, mask, sizew, sizeh, num_classes,
+                                   dtype, scale_xy, scale_num_inst,
+                                   use_tie_breaker):
+  # unpack required components from the input ground truth
+  boxes = tf.cast(y_true['bbox'], dtype)
+  classes = tf.expand_dims(tf.cast(y_true['classes'], dtype=dtype), axis=-1)
+  anchors = tf.cast(y_true['best_anchors'], dtype)
+  ious = tf.cast(y_true['best_iou_match'], dtype)
+
+  width = tf.cast(sizew, boxes.dtype)
+  height = tf.cast(sizeh, boxes.dtype)
+  # get the number of boxes in the ground truth boxs
+  num_boxes = tf.shape(boxes)[-2]
+  # get the number of anchor boxes used for this anchor scale
+  len_masks = len(mask)  #mask is a python object tf.shape(mask)[0]
+  # number of anchors
+  num_anchors = tf.shape(anchors)[-1]
+  num_instances = num_boxes * scale_num_inst
+
+  pull_in = preprocessing_ops._gen_offsets(scale_xy, boxes.dtype)
+  # x + 0.5
+  # x - 0.5
+  # y + 0.5
+  # y - 0.5
+
+  # rescale the x and y centers to the size of the grid [size, size]
+  mask = tf.cast(mask, dtype=dtype)
+  box_mask = preprocessing_ops._gen_utility(boxes)
+  num_reps, viable_primary, viable_alternate = _reference_get_num_reps(
+      anchors, mask, box_mask)
+  viable_primary = tf.cast(viable_primary, tf.int32)
+  viable_alternate = tf.cast(viable_alternate, tf.int32)
+
+  num_written = 0
+  ind_val = tf.TensorArray(
+      tf.int32, size=0, dynamic_size=True, element_shape=[
+          3,
+      ])
+  ind_sample = tf.TensorArray(
+      dtype, size=0, dynamic_size=True, element_shape=[
+          8,
+      ])
+
+  (ind_val, ind_sample, num_written) = _reference_write_grid(
+      viable_primary, num_reps, boxes, classes, ious, ind_val, ind_sample,
+      height, width, num_written, num_instances, 0.0)
+
+  if use_tie_breaker:
+    (ind_val, ind_sample, num_written) = _reference_write_grid(
+        viable_alternate, num_reps, boxes, classes, ious, ind_val, ind_sample,
+        height, width, num_written, num_instances, 0.0)
+
+  if pull_in > 0.0:
+    (ind_val, ind_sample, num_written) = _reference_write_grid(
+        viable_primary, num_reps, boxes, classes, ious, ind_val, ind_sample,
+        height, width, num_written, num_instances, pull_in)
+
+    if use_tie_breaker:
+      (ind_val, ind_sample, num_written) = _reference_write_grid(
+          viable_alternate, num_reps, boxes, classes, ious, ind_val, ind_sample,
+          height, width, num_written, num_instances, pull_in)
+
+  indexs = ind_val.stack()
+  samples = ind_sample.stack()
+
+  (true_box, ind_mask, true_class, best_iou_match, num_reps) = tf.split(
+      samples, [4, 1, 1, 1, 1], axis=-1)
+
+  full = tf.zeros([sizeh, sizew, len_masks, 1], dtype=dtype)
+  full = tf.tensor_scatter_nd_add(full, indexs, ind_mask)
+
+  if num_written >= num_instances:
+    tf.print("clipped")
+
+  indexs = preprocessing_ops.pad_max_instances(
+      indexs, num_instances, pad_value=0, pad_axis=0)
+  samples = preprocessing_ops.pad_max_instances(
+      samples, num_instances, pad_value=0, pad_axis=0)
+  return indexs, samples, full
+
+
+def _reference_write_sample(box, anchor_id, offset, sample, ind_val, ind_sample,
+                            height, width, num_written):
+
+  a_ = tf.convert_to_tensor([tf.cast(anchor_id, tf.int32)])
+
+  y = box[1] * height
+  x = box[0] * width
+
+  # idk if this is right!!! just testing it now
+  if offset > 0:
+    g = tf.cast(offset, x.dtype)
+    gain = tf.cast(tf.convert_to_tensor([width, height]), x.dtype)
+    gxy = tf.cast(tf.convert_to_tensor([x, y]), x.dtype)
+    clamp = lambda x, ma: tf.maximum(
+        tf.minimum(x, tf.cast(ma, x.dtype)), tf.zeros_like(x))
+
+    gxyi = gxy - tf.floor(gxy)
+    ps = ((gxyi < g) & (gxy > 1.))
+    ns = ((gxyi > (1 - g)) & (gxy < (gain - 1.)))
+
+    shifts = [ps[0], ps[1], ns[0], ns[1]]
+    offset = tf.cast([[1, 0], [0, 1], [-1, 0], [0, -1]], g.dtype) * g
+
+    # xc = clamp(tf.convert_to_tensor([tf.cast(x, tf.int32)]), width - 1)
+    # yc = clamp(tf.convert_to_tensor([tf.cast(y, tf.int32)]), height - 1)
+    for i in range(4):
+      x_ = x - offset[i, 0]
+      y_ = y - offset[i, 1]
+
+      x_ = clamp(tf.convert_to_tensor([tf.cast(x_, tf.int32)]), width - 1)
+      y_ = clamp(tf.convert_to_tensor([tf.cast(y_, tf.int32)]), height - 1)
+      if shifts[i]:  # and (xc != x_ or yc != y_):
+        grid_idx = tf.concat([y_, x_, a_], axis=-1)
+        ind_val = ind_val.write(num_written, grid_idx)
+        ind_sample = ind_sample.write(num_written, sample)
+        num_written += 1
+  else:
+    y_ = tf.convert_to_tensor([tf.cast(y, tf.int32)])
+    x_ = tf.convert_to_tensor([tf.cast(x, tf.int32)])
+    grid_idx = tf.concat([y_, x_, a_], axis=-1)
+    ind_val = ind_val.write(num_written, grid_idx)
+    ind_sample = ind_sample.write(num_written, sample)
+    num_written += 1
+  return ind_val, ind_sample, num_written
+
+
+def _reference_write_grid(viable, num_reps, boxes, classes, ious, ind_val,
+                          ind_sample, height, width, num_written, num_instances,
+                          offset):
+
+  const = tf.cast(tf.convert_to_tensor([1.]), dtype=boxes.dtype)
+  num_viable = tf.shape(viable)[0]
+  for val in range(num_viable):
+    idx = viable[val]
+    obj_id, anchor, anchor_idx = idx[0], idx[1], idx[2]
+    if num_written >= num_instances:
+      break
+
+    reps = tf.convert_to_tensor([num_reps[obj_id]])
+    box = boxes[obj_id]
+    cls_ = classes[obj_id]
+    iou = tf.convert_to_tensor([ious[obj_id, anchor]])
+    sample = tf.concat([box, const, cls_, iou, reps], axis=-1)
+
+    ind_val, ind_sample, num_written = _reference_write_sample(
+        box, anchor_idx, offset, sample, ind_val, ind_sample, height, width,
+        num_written)
+  return ind_val, ind_sample, num_written
+
+
+def _grid_inputs(num_boxes, anchors, seed, num_padded=0):
+  rng = np.random.RandomState(seed)
+  xy = rng.uniform(0.0, 1.0, size=(num_boxes, 2))
+  wh = rng.uniform(0.01, 0.6, size=(num_boxes, 2))
+  boxes = np.concatenate([xy, wh], axis=-1).astype(np.float32)
+  boxes[num_boxes - num_padded:] = 0.0
+  classes = rng.randint(0, 80, size=(num_boxes,)).astype(np.float32)
+  best_anchors, ious = preprocessing_ops.get_best_anchor(
+      tf.constant(boxes), anchors, width=416, height=416, iou_thresh=0.213)
+  return {
+      'bbox': tf.constant(boxes),
+      'classes': tf.constant(classes),
+      'best_anchors': best_anchors,
+      'best_iou_match': ious
+  }
+
+
 class InputUtilsTest(parameterized.TestCase, tf.test.TestCase):
 
   @parameterized.parameters((416, 416, 5, 300, 300), (100, 200, 6, 50, 50))
@@ -49,5 +245,48 @@ class InputUtilsTest(parameterized.TestCase, tf.test.TestCase):
     self.assertAllEqual(expected_output_shape, tf.shape(output).numpy())
 
 
+class GridTargetTest(parameterized.TestCase, tf.test.TestCase):
+
+  ANCHORS = [[12.0, 19.0], [31.0, 46.0], [96.0, 54.0], [46.0, 114.0],
+             [133.0, 127.0], [79.0, 225.0], [301.0, 150.0], [172.0, 286.0],
+             [348.0, 340.0]]
+
+  @parameterized.parameters(
+      ([0, 1, 2], 52, 1.0, 1, False),
+      ([3, 4, 5], 26, 1.0, 3, True),
+      ([3, 4, 5], 26, 2.0, 3, True),
+      ([6, 7, 8], 13, 2.0, 1, True),
+      ([6, 7, 8], 13, 1.1, 8, False),
+  )
+  def testMatchesReference(self, mask, size, scale_xy, scale_num_inst,
+                           use_tie_breaker):
+    for seed in range(3):
+      y_true = _grid_inputs(30, self.ANCHORS, seed, num_padded=5)
+      expected = _reference_build_grided_gt_ind(y_true, mask, size, size, 0,
+                                                tf.float32, scale_xy,
+                                                scale_num_inst, use_tie_breaker)
+      actual = preprocessing_ops.build_grided_gt_ind(y_true, mask, size, size,
+                                                     0, tf.float32, scale_xy,
+                                                     scale_num_inst,
+                                                     use_tie_breaker)
+      for expected_value, actual_value in zip(expected, actual):
+        self.assertAllEqual(expected_value, actual_value)
+
+  def testBatched(self):
+    samples = [_grid_inputs(20, self.ANCHORS, seed) for seed in range(4)]
+    batch = {
+        key: tf.stack([sample[key] for sample in samples
+                      ]) for key in samples[0].keys()
+    }
+    actual = preprocessing_ops.build_grided_gt_ind(batch, [3, 4, 5], 26, 26, 0,
+                                                   tf.float32, 2.0, 3, True)
+    for i, sample in enumerate(samples):
+      expected = preprocessing_ops.build_grided_gt_ind(sample, [3, 4, 5], 26,
+                                                       26, 0, tf.float32, 2.0,
+                                                       3, True)
+      for expected_value, actual_value in zip(expected, actual):
+        self.assertAllEqual(expected_value, actual_value[i])
+
+
 if __name__ == '__main__':
   tf.test.main()
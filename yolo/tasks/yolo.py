@@ -8,6 +8,12 @@ from yolo.ops.preprocessing_ops import apply_infos
 import tensorflow as tf
 from tensorflow.keras.mixed_precision import experimental as mixed_precision
 
+import hashlib
+import json
+import os
+import time
+import uuid
+
 from absl import logging
 from official.core import base_task
 from official.core import input_reader
@@ -15,6 +21,7 @@ from official.core import task_factory
 from yolo.configs import yolo as exp_cfg
 
 from official.vision.beta.evaluation import coco_evaluator
+from official.vision.beta.evaluation import streaming_coco_evaluator
 from official.vision.beta.dataloaders import tf_example_decoder
 from official.vision.beta.dataloaders import tfds_detection_decoders
 from official.vision.beta.dataloaders import tf_example_label_map_decoder
@@ -36,6 +43,32 @@ from official.modeling import performance
 OptimizationConfig = optimization.OptimizationConfig
 RuntimeConfig = config_definitions.RuntimeConfig
 
+# seconds the workers wait for the chief to convert the darknet weights
+_DARKNET_CACHE_TIMEOUT = 600
+
+
+def _is_chief():
+  """Whether this job is the chief of the cluster in TF_CONFIG, a single
+  worker is always the chief."""
+  resolver = tf.distribute.cluster_resolver.TFConfigClusterResolver()
+  if not resolver.task_type:
+    return True
+  if 'chief' in resolver.cluster_spec().as_dict():
+    return resolver.task_type == 'chief'
+  return resolver.task_type == 'worker' and resolver.task_id == 0
+
+
+def _wait_for_checkpoint(ckpt_prefix, timeout, interval=5):
+  """Polls until the checkpoint exists or the timeout expires."""
+  deadline = time.time() + timeout
+  while not tf.io.gfile.exists(ckpt_prefix + '.index'):
+    if time.time() > deadline:
+      logging.warning('Timed out waiting for %s', ckpt_prefix)
+      return False
+    time.sleep(interval)
+  return True
+
+
 @task_factory.register_task_cls(exp_cfg.YoloTask)
 class YoloTask(base_task.Task):
   """A single-replica view of training procedure.
@@ -57,6 +90,7 @@ class YoloTask(base_task.Task):
     self.coco_metric = None
     self._metric_names = []
     self._metrics = []
+    self._label_encoders = {}
 
     self._use_reduced_logs = self.task_config.reduced_logs
     return
@@ -152,6 +186,8 @@ class YoloTask(base_task.Task):
         crop_area_mosaic=params.parser.mosaic.crop_area_mosaic,
         mosaic_crop_mode=params.parser.mosaic.mosaic_crop_mode,
         aspect_ratio_mode=params.parser.mosaic.aspect_ratio_mode,
+        mixup_pool_size=params.parser.mosaic.mixup_pool_size,
+        mixup_pool_eviction=params.parser.mosaic.mixup_pool_eviction,
         
         random_crop=rcrop,
         random_pad=params.parser.random_pad,
@@ -194,15 +230,24 @@ class YoloTask(base_task.Task):
         anchor_t=params.parser.anchor_thresh,
         coco91to80=self.task_config.coco91to80,
         anchor_free_limits=anchor_free_limits,
+        encode_labels_after_batch=params.parser.label_encoding != 'example',
+        eval_groundtruths_only=self.task_config.metrics_only_eval,
         seed=params.seed,
         dtype=params.dtype)
 
+    # labels encoded on the device are built in the train and validation step
+    encode_labels = params.is_training or not self.task_config.metrics_only_eval
+    if encode_labels and params.parser.label_encoding == 'device':
+      self._label_encoders[params.is_training] = parser.encode_labels
+
     reader = input_reader.InputReader(
         params,
         dataset_fn=tf.data.TFRecordDataset,
         decoder_fn=decoder.decode,
         sample_fn=sample_fn.mosaic_fn(is_training=params.is_training),
-        parser_fn=parser.parse_fn(params.is_training))
+        parser_fn=parser.parse_fn(params.is_training),
+        postprocess_fn=(parser.postprocess_fn() if encode_labels and
+                        params.parser.label_encoding == 'batch' else None))
     dataset = reader.read(input_context=input_context)
     return dataset
 
@@ -251,32 +296,40 @@ class YoloTask(base_task.Task):
     metrics = []
     metric_names = self._metric_names
 
-    for i, key in enumerate(metric_names.keys()):
-      metrics.append(ListMetrics(metric_names[key], name=key))
+    # the loss metrics are not computed in a metrics only evaluation
+    if training or not self.task_config.metrics_only_eval:
+      for i, key in enumerate(metric_names.keys()):
+        metrics.append(ListMetrics(metric_names[key], name=key))
 
     self._metrics = metrics
 
     if not training:
-      self.coco_metric = coco_evaluator.COCOEvaluator(
-          annotation_file=self.task_config.annotation_file,
-          include_mask=False,
-          need_rescale_bboxes=False,
-          per_category_metrics=self._task_config.per_category_metrics)
+      if self.task_config.streaming_coco_eval:
+        self.coco_metric = streaming_coco_evaluator.StreamingCOCOEvaluator(
+            annotation_file=self.task_config.annotation_file,
+            include_mask=False,
+            need_rescale_bboxes=False,
+            per_category_metrics=self._task_config.per_category_metrics)
+      else:
+        self.coco_metric = coco_evaluator.COCOEvaluator(
+            annotation_file=self.task_config.annotation_file,
+            include_mask=False,
+            need_rescale_bboxes=False,
+            per_category_metrics=self._task_config.per_category_metrics,
+            num_processes=self.task_config.coco_eval_num_processes)
 
     return metrics
 
-  ## training ##
-  def train_step(self, inputs, model, optimizer, metrics=None):
-    image, label = inputs
-
-    # Get the number of replicas that the model is running on. Num_replicas 
-    # paramter is used to take the mean of the loss across devices. If using
-    # scaled loss the num replicas are set to 1 in order to use the sum across 
-    # replicas.   
-    num_replicas = tf.distribute.get_strategy().num_replicas_in_sync
-    if self._task_config.model.filter.use_scaled_loss:
-      num_replicas = 1
+  def _encode_labels(self, label, training=True):
+    """Builds the gridded labels in the step if the parser left them to the 
+    device."""
+    if training in self._label_encoders:
+      label = self._label_encoders[training](label)
+    return label
 
+  ## training ##
+  def _compute_gradients(self, image, label, model, optimizer, num_replicas):
+    """Runs the forward and backward pass of the model on one batch."""
     with tf.GradientTape(persistent=False) as tape:
       # Compute a prediction
       y_pred = model(image, training=True)
@@ -299,6 +352,92 @@ class YoloTask(base_task.Task):
     # Compute the gradient
     train_vars = model.trainable_variables
     gradients = tape.gradient(scaled_loss, train_vars)
+    return gradients, metric_loss, loss_metrics
+
+  def _split_batch(self, inputs, index, subdivisions):
+    """Slices the micro batch at index out of a batch of inputs, the batch
+    size must be a multiple of subdivisions."""
+    message = 'the batch size must be a multiple of subdivisions {}'.format(
+        subdivisions)
+
+    def split(x):
+      if x.shape[0] is not None:
+        if x.shape[0] % subdivisions != 0:
+          raise ValueError('{}, got {}'.format(message, x.shape[0]))
+        size = x.shape[0] // subdivisions
+      else:
+        batch_size = tf.shape(x)[0]
+        with tf.control_dependencies([
+            tf.debugging.assert_equal(
+                batch_size % subdivisions, 0, message=message)
+        ]):
+          size = batch_size // subdivisions
+      return x[index * size:(index + 1) * size]
+
+    return tf.nest.map_structure(split, inputs)
+
+  def _accumulate_gradients(self, image, label, model, optimizer,
+                            num_replicas):
+    """Splits the batch into subdivisions micro batches like darknet does, and
+    accumulates their gradients so only one micro batch of activations is
+    held in memory at a time. The accumulated gradient is the sum of the
+    micro batch gradients for the scaled loss, which sums over the batch, and
+    their mean otherwise. The loss metrics are averaged."""
+    subdivisions = self.task_config.subdivisions
+    inputs = (image, label)
+
+    # The first micro batch is peeled off the loop to initialize the buffers.
+    (gradients, metric_loss, loss_metrics) = self._compute_gradients(
+        *self._split_batch(inputs, 0, subdivisions), model, optimizer,
+        num_replicas)
+    gradients = [
+        tf.zeros_like(var) if grad is None else tf.convert_to_tensor(grad)
+        for grad, var in zip(gradients, model.trainable_variables)
+    ]
+    loss_metrics = {key: dict(value) for key, value in loss_metrics.items()}
+
+    for index in tf.range(1, subdivisions):
+      (micro_gradients, micro_metric_loss,
+       micro_loss_metrics) = self._compute_gradients(
+           *self._split_batch(inputs, index, subdivisions), model, optimizer,
+           num_replicas)
+      gradients = [
+          grad if micro_grad is None else grad + micro_grad
+          for grad, micro_grad in zip(gradients, micro_gradients)
+      ]
+      metric_loss += micro_metric_loss
+      loss_metrics = tf.nest.map_structure(
+          tf.add, loss_metrics,
+          {key: dict(value) for key, value in micro_loss_metrics.items()})
+
+    if not self._task_config.model.filter.use_scaled_loss:
+      gradients = [grad / subdivisions for grad in gradients]
+    metric_loss /= subdivisions
+    loss_metrics = tf.nest.map_structure(lambda x: x / subdivisions,
+                                         loss_metrics)
+    return gradients, metric_loss, loss_metrics
+
+  def train_step(self, inputs, model, optimizer, metrics=None):
+    image, label = inputs
+    label = self._encode_labels(label, training=True)
+
+    # Get the number of replicas that the model is running on. Num_replicas 
+    # paramter is used to take the mean of the loss across devices. If using
+    # scaled loss the num replicas are set to 1 in order to use the sum across 
+    # replicas.   
+    num_replicas = tf.distribute.get_strategy().num_replicas_in_sync
+    if self._task_config.model.filter.use_scaled_loss:
+      num_replicas = 1
+
+    # Compute the gradient, accumulated over micro batches if the batch is
+    # subdivided
+    if self.task_config.subdivisions > 1:
+      gradients, metric_loss, loss_metrics = self._accumulate_gradients(
+          image, label, model, optimizer, num_replicas)
+    else:
+      gradients, metric_loss, loss_metrics = self._compute_gradients(
+          image, label, model, optimizer, num_replicas)
+    train_vars = model.trainable_variables
 
     # Get unscaled loss if we are using the loss scale optimizer on fp16
     if isinstance(optimizer, mixed_precision.LossScaleOptimizer):
@@ -323,10 +462,24 @@ class YoloTask(base_task.Task):
   ## evaluation ##
   def _reorg_boxes(self, boxes, num_detections, info):
     """This function is used to reorganize and clip the predicitions to remove
-    all padding and only take predicitions within the image"""
+    all padding and only take predicitions within the image. boxes and
+    num_detections may be lists of box sets of the same images, they are then
+    concatenated and reorganized in a single pass and returned as a list."""
+    if isinstance(boxes, (list, tuple)):
+      sizes = [tf.shape(box)[1] for box in boxes]
+      masks = [
+          tf.sequence_mask(num, maxlen=size)
+          for num, size in zip(num_detections, sizes)
+      ]
+      boxes = self._reorg_boxes(
+          tf.concat(boxes, axis=1), tf.concat(masks, axis=1), info)
+      return tf.split(boxes, sizes, axis=1)
 
     # Build a prediciton mask to take only the number of detections
-    mask = tf.sequence_mask(num_detections, maxlen=tf.shape(boxes)[1])
+    if num_detections.shape.rank == 2:
+      mask = num_detections
+    else:
+      mask = tf.sequence_mask(num_detections, maxlen=tf.shape(boxes)[1])
     mask = tf.cast(tf.expand_dims(mask, axis=-1), boxes.dtype)
 
     # Split all infos
@@ -341,8 +494,8 @@ class YoloTask(base_task.Task):
     # if self.task_config.model.dynamic_conv:
     if self.task_config.model.filter.use_scaled_loss:
       # Clip the boxes to remove all padding
-      boxes /= tf.tile(scale, [1, 1, 2])
-      boxes += tf.tile(offset, [1, 1, 2])
+      boxes /= tf.concat([scale, scale], axis=-1)
+      boxes += tf.concat([offset, offset], axis=-1)
       boxes = box_ops.clip_boxes(boxes, ogshape)
 
     # Mask the boxes for usage
@@ -352,20 +505,25 @@ class YoloTask(base_task.Task):
 
   def validation_step(self, inputs, model, metrics=None):
     image, label = inputs
+    label = self._encode_labels(label, training=False)
 
     # Step the model once
     y_pred = model(image, training=False)
     y_pred = tf.nest.map_structure(lambda x: tf.cast(x, tf.float32), y_pred)
-    (_, metric_loss, 
-    loss_metrics) = self.build_losses(y_pred['raw_output'], label)
-    logs = {self.loss: metric_loss}
 
-    # Reorganize and rescale the boxes
-    boxes = self._reorg_boxes(
-        y_pred['bbox'], y_pred['num_detections'],
-        tf.cast(label['groundtruths']['image_info'], tf.float32))
-    label['groundtruths']["boxes"] = self._reorg_boxes(
-        label['groundtruths']["boxes"], label['groundtruths']["num_detections"],
+    # A metrics only evaluation skips the loss, the labels then only hold the
+    # ground truths.
+    logs = {}
+    if not self.task_config.metrics_only_eval:
+      (_, metric_loss,
+       loss_metrics) = self.build_losses(y_pred['raw_output'], label)
+      logs[self.loss] = metric_loss
+
+    # Reorganize and rescale the predicted and ground truth boxes together
+    boxes, label['groundtruths']["boxes"] = self._reorg_boxes(
+        [y_pred['bbox'],
+         tf.cast(label['groundtruths']["boxes"], tf.float32)],
+        [y_pred['num_detections'], label['groundtruths']["num_detections"]],
         tf.cast(label['groundtruths']['image_info'], tf.float32))
 
     # Build the input for the coc evaluation metric
@@ -379,12 +537,13 @@ class YoloTask(base_task.Task):
     }
 
     # Compute all metrics
-    if metrics:
+    if metrics is not None:
       logs.update(
           {self.coco_metric.name: (label['groundtruths'], coco_model_outputs)})
-      for m in metrics:
-        m.update_state(loss_metrics[m.name])
-        logs.update({m.name: m.result()})
+      if not self.task_config.metrics_only_eval:
+        for m in metrics:
+          m.update_state(loss_metrics[m.name])
+          logs.update({m.name: m.result()})
     return logs
 
   def aggregate_logs(self, state=None, step_outputs=None):
@@ -422,17 +581,29 @@ class YoloTask(base_task.Task):
           params,
           decoder_fn=decoder.decode,
           transform_and_batch_fn=lambda x, y: x,
-          parser_fn=None)
+          parser_fn=None,
+          cache_dir=self._get_anchor_cache_dir())
       anchors = reader.read(
           k=self._num_boxes,
           image_width=self._task_config.model.input_size[0],
-          input_context=None)
+          input_context=None,
+          input_size=self._task_config.model.input_size)
       self.task_config.model.set_boxes(anchors)
       self._anchors_built = True
       del reader
     return (self.task_config.model._boxes, 
               self.task_config.model.anchor_free_limits)
 
+  def _get_anchor_cache_dir(self):
+    """Directory for the k-means anchor cache, next to the model directory or
+    in the user cache directory if there is no model directory."""
+    cache_dir = self.task_config.anchor_cache_dir
+    if cache_dir is not None:
+      return cache_dir
+    if self.logging_dir:
+      return os.path.join(self.logging_dir, 'anchors')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'yolo', 'anchors')
+
   def _get_masks(self):
 
     def _build(values):
@@ -476,23 +647,90 @@ class YoloTask(base_task.Task):
     self._metric_names = metric_names
     return self._masks, self._path_scales, self._x_y_scales
 
+  def _get_darknet_cache_dir(self):
+    """Directory for the converted darknet weights, next to the model
+    directory or in the user cache directory if there is no model directory."""
+    cache_dir = self.task_config.darknet_weights_cache_dir
+    if cache_dir is not None:
+      return cache_dir
+    if self.logging_dir:
+      return os.path.join(self.logging_dir, 'darknet')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'yolo', 'darknet')
+
+  def _darknet_cache_key(self, config_file, weights_file):
+    """Returns the cache key for the converted weights. The key changes if the
+    contents of the cfg or weights file or the model config change."""
+    key = hashlib.sha256()
+    for path in (config_file, weights_file):
+      with tf.io.gfile.GFile(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 22), b''):
+          key.update(chunk)
+
+    # the contents are hashed, so the paths of the files do not matter
+    model = self.task_config.model.as_dict()
+    if isinstance(model.get('base'), dict):
+      model['base'].pop('darknet_weights_file', None)
+      model['base'].pop('darknet_weights_cfg', None)
+    model['darknet_load_decoder'] = self.task_config.darknet_load_decoder
+    key.update(json.dumps(model, sort_keys=True, default=str).encode('utf-8'))
+    return key.hexdigest()
+
+  def _darknet_checkpoint(self, model):
+    """Checkpoint of the modules that are loaded from the darknet weights."""
+    if self.task_config.darknet_load_decoder:
+      return tf.train.Checkpoint(
+          backbone=model.backbone, decoder=model.decoder, head=model.head)
+    return tf.train.Checkpoint(backbone=model.backbone)
+
+  def _save_darknet_cache(self, checkpoint, cache_dir, key):
+    """Writes the checkpoint to a temporary directory and renames it into place
+    so readers never see a partial checkpoint."""
+    path = os.path.join(cache_dir, key)
+    tmp_path = '{}.tmp-{}'.format(path, uuid.uuid4().hex)
+    checkpoint.write(os.path.join(tmp_path, 'ckpt'))
+    try:
+      tf.io.gfile.rename(tmp_path, path)
+    except tf.errors.OpError:
+      # another job converted the same weights first
+      tf.io.gfile.rmtree(tmp_path)
+
+  def _load_darknet_weights(self, model, config_file, weights_file):
+    """Converts the darknet weights and loads them into the model."""
+    from yolo.utils import DarkNetConverter
+    from yolo.utils._darknet2tf.load_weights import split_converter
+    from yolo.utils._darknet2tf.load_weights2 import load_weights_backbone
+    from yolo.utils._darknet2tf.load_weights2 import load_weights_decoder
+    from yolo.utils._darknet2tf.load_weights2 import load_weights_prediction_layers
+
+    list_encdec = DarkNetConverter.read(config_file, weights_file)
+
+    splits = model.backbone._splits
+    if 'neck_split' in splits.keys():
+      encoder, neck, decoder = split_converter(list_encdec,
+                                               splits['backbone_split'],
+                                               splits['neck_split'])
+    else:
+      encoder, decoder = split_converter(list_encdec,
+                                         splits['backbone_split'])
+      neck = None
+
+    load_weights_backbone(model.backbone, encoder)
+
+    if self.task_config.darknet_load_decoder:
+      cfgheads = load_weights_decoder(
+          model.decoder, [neck, decoder],
+          csp=self._task_config.model.base.decoder.type == 'csp')
+      load_weights_prediction_layers(cfgheads, model.head)
+
   def initialize(self, model: tf.keras.Model):
     """initialize the weights of the model"""
     if self.task_config.load_darknet_weights:
-      from yolo.utils import DarkNetConverter
-      from yolo.utils._darknet2tf.load_weights import split_converter
-      from yolo.utils._darknet2tf.load_weights2 import load_weights_backbone
-      from yolo.utils._darknet2tf.load_weights2 import load_weights_decoder
-      from yolo.utils._darknet2tf.load_weights2 import load_weights_prediction_layers
       from yolo.utils.downloads.file_manager import download
 
       weights_file = self.task_config.model.darknet_weights_file
       config_file = self.task_config.model.darknet_weights_cfg
 
-      if ('cache' not in weights_file and 'cache' not in config_file):
-        list_encdec = DarkNetConverter.read(config_file, weights_file)
-      else:
-        import os
+      if ('cache' in weights_file or 'cache' in config_file):
         path = os.path.abspath('cache')
         if (not os.path.isdir(path)):
           os.mkdir(path)
@@ -504,26 +742,33 @@ class YoloTask(base_task.Task):
         wgt = f"{path}/weights/{weights_file.split('/')[-1]}"
         if not os.path.isfile(wgt):
           download(weights_file.split('/')[-1])
+        config_file, weights_file = cfg, wgt
 
-        list_encdec = DarkNetConverter.read(cfg, wgt)
-
-      splits = model.backbone._splits
-      if 'neck_split' in splits.keys():
-        encoder, neck, decoder = split_converter(list_encdec,
-                                                 splits['backbone_split'],
-                                                 splits['neck_split'])
-      else:
-        encoder, decoder = split_converter(list_encdec,
-                                           splits['backbone_split'])
-        neck = None
+      cache_dir = self._get_darknet_cache_dir()
+      if not cache_dir:
+        self._load_darknet_weights(model, config_file, weights_file)
+        return
 
-      load_weights_backbone(model.backbone, encoder)
+      # Only the chief converts the weights, the other workers restore the
+      # checkpoint it writes
+      key = self._darknet_cache_key(config_file, weights_file)
+      ckpt_prefix = os.path.join(cache_dir, key, 'ckpt')
+      is_chief = _is_chief()
+      if not is_chief:
+        _wait_for_checkpoint(ckpt_prefix, _DARKNET_CACHE_TIMEOUT)
+
+      checkpoint = self._darknet_checkpoint(model)
+      if tf.io.gfile.exists(ckpt_prefix + '.index'):
+        status = checkpoint.read(ckpt_prefix)
+        status.assert_existing_objects_matched()
+        logging.info('Restored converted darknet weights from %s',
+                     ckpt_prefix)
+        return
 
-      if self.task_config.darknet_load_decoder:
-        cfgheads = load_weights_decoder(
-            model.decoder, [neck, decoder],
-            csp=self._task_config.model.base.decoder.type == 'csp')
-        load_weights_prediction_layers(cfgheads, model.head)
+      self._load_darknet_weights(model, config_file, weights_file)
+      if is_chief:
+        self._save_darknet_cache(checkpoint, cache_dir, key)
+        logging.info('Saved converted darknet weights to %s', ckpt_prefix)
 
     else:
       """Loading pretrained checkpoint."""
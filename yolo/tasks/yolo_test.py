@@ -1,3 +1,8 @@
+import os
+import types
+from unittest import mock
+
+from yolo.configs import yolo as exp_cfg
 from yolo.tasks import yolo
 import orbit
 from official.core import exp_factory
@@ -35,6 +40,97 @@ class YoloTaskTest(tf.test.TestCase, parameterized.TestCase):
     logs = task.validation_step(next(iterator), model, metrics=metrics)
     self.assertIn("loss", logs)
 
+  @parameterized.parameters((False, 2), (True, 4))
+  def test_accumulate_gradients(self, use_scaled_loss, subdivisions):
+    config = exp_factory.get_exp_config("yolo_custom")
+    config.task.model.filter.use_scaled_loss = use_scaled_loss
+    config.task.subdivisions = subdivisions
+    task = yolo.YoloTask(config.task)
+
+    inputs = tf.keras.Input([3])
+    model = tf.keras.Model(inputs,
+                           {"raw_output": tf.keras.layers.Dense(2)(inputs)})
+    optimizer = tf.keras.optimizers.SGD()
+
+    def build_losses(y_pred, label):
+      # like the real losses, the metric loss is the mean over the images.
+      metric_loss = tf.reduce_mean(tf.square(y_pred - label))
+      loss = metric_loss
+      if use_scaled_loss:
+        loss *= tf.cast(tf.shape(label)[0], loss.dtype)
+      return loss, metric_loss, {"net": {"loss": metric_loss}}
+
+    image = tf.random.uniform([8, 3], seed=1)
+    label = tf.random.uniform([8, 2], seed=2)
+    with mock.patch.object(task, "build_losses", build_losses):
+      expected, expected_loss, _ = task._compute_gradients(
+          image, label, model, optimizer, 1)
+      actual, actual_loss, loss_metrics = tf.function(
+          task._accumulate_gradients)(image, label, model, optimizer, 1)
+
+    # micro batches of equal size reproduce the full batch gradient.
+    self.assertAllClose(expected, actual)
+    self.assertAllClose(expected_loss, actual_loss)
+    self.assertAllClose(actual_loss, loss_metrics["net"]["loss"])
+
+  def test_split_batch_requires_multiple_of_subdivisions(self):
+    config = exp_factory.get_exp_config("yolo_custom")
+    task = yolo.YoloTask(config.task)
+    inputs = (tf.zeros([6, 3]), {"boxes": tf.zeros([6, 2])})
+    with self.assertRaises(ValueError):
+      task._split_batch(inputs, 0, 4)
+
+    # the batch size is only known when the step runs.
+    inputs_spec = (tf.TensorSpec([None, 3]), {"boxes": tf.TensorSpec([None, 2])})
+    split = tf.function(
+        lambda inputs, subdivisions: task._split_batch(inputs, 1, subdivisions),
+        input_signature=[inputs_spec, tf.TensorSpec([], tf.int32)])
+    image, label = split(inputs, 3)
+    self.assertAllEqual([2, 3], image.shape)
+    self.assertAllEqual([2, 2], label["boxes"].shape)
+    with self.assertRaises(tf.errors.InvalidArgumentError):
+      split(inputs, 4)
+
+  def test_darknet_weights_cache(self):
+    directory = self.get_temp_dir()
+    files = []
+    for name in ("test.cfg", "test.weights"):
+      files.append(os.path.join(directory, name))
+      with open(files[-1], "w") as f:
+        f.write(name)
+
+    config = exp_factory.get_exp_config("yolo_custom")
+    config.task.load_darknet_weights = True
+    config.task.model.base = exp_cfg.YoloBase(
+        darknet_weights_cfg=files[0], darknet_weights_file=files[1])
+    config.task.darknet_weights_cache_dir = os.path.join(directory, "cache")
+
+    def convert(model, config_file, weights_file):
+      model.backbone.kernel.assign(tf.ones_like(model.backbone.kernel))
+
+    def build_model():
+      backbone = tf.keras.layers.Dense(2)
+      backbone.build([None, 3])
+      return types.SimpleNamespace(backbone=backbone)
+
+    # the weights are only converted once, later tasks restore them.
+    for _ in range(2):
+      task = yolo.YoloTask(config.task)
+      model = build_model()
+      with mock.patch.object(task, "_load_darknet_weights",
+                             side_effect=convert) as load:
+        task.initialize(model)
+      self.assertAllEqual(tf.ones([3, 2]), model.backbone.kernel)
+    self.assertEqual(0, load.call_count)
+
+    # a different model config changes the key.
+    config.task.model.num_classes += 1
+    task = yolo.YoloTask(config.task)
+    with mock.patch.object(task, "_load_darknet_weights",
+                           side_effect=convert) as load:
+      task.initialize(build_model())
+    self.assertEqual(1, load.call_count)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -72,7 +72,8 @@ class DarkNetConverter(_DarkNetSectionList):
       clz: Type[T],
       config_file: Union[PathABC, io.TextIOBase],
       weights_file: Union[PathABC, io.RawIOBase,
-                          io.BufferedIOBase] = None) -> T:
+                          io.BufferedIOBase] = None,
+      use_mmap: bool = True) -> T:
     """
         Parse the config and weights files and read the DarkNet layer's encoder,
         decoder, and output layers. The number of bytes in the file is also returned.
@@ -80,6 +81,8 @@ class DarkNetConverter(_DarkNetSectionList):
         Args:
           config_file: str, path to yolo config file from Darknet
           weights_file: str, path to yolo weights file from Darknet
+          use_mmap: bool, memory map the weights file and point the layer
+            weights to views of it instead of reading them layer by layer
 
         Returns:
           a DarkNetConverter object
@@ -87,7 +90,7 @@ class DarkNetConverter(_DarkNetSectionList):
     from .read_weights import read_weights
 
     full_net = clz()
-    read_weights(full_net, config_file, weights_file)
+    read_weights(full_net, config_file, weights_file, use_mmap=use_mmap)
     return full_net
 
   def to_tf(self,
@@ -127,9 +130,11 @@ class DarkNetConverter(_DarkNetSectionList):
             use_mixed=use_mixed))
     model.build(self.net.shape)
 
+    assignments = []
     for cfg, layer in zip(self, layers):
       if layer is not None:
-        layer.set_weights(cfg.get_weights())
+        assignments.extend(zip(layer.weights, cfg.get_weights()))
+    tf.keras.backend.batch_set_value(assignments)
     return model
 
   def _process_yolo_layer(self,
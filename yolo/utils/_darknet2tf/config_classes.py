@@ -60,6 +60,27 @@ class Config(ABC):
     """
     return 0
 
+  @property
+  def num_weights(self) -> int:
+    """
+    Returns:
+      the number of float32 values the layer reads from the weights file.
+    """
+    return 0
+
+  def assign_weights(self, data):
+    """
+    Set the weights of the current layer to views of a flat array.
+
+    Arguments:
+      data: float32 Numpy array (or memory map) of num_weights values, in the
+            order they are stored in the DarkNet weights file
+
+    Returns:
+      the number of bytes used.
+    """
+    return 0
+
   def get_weights(self) -> list:
     """
     Returns:
@@ -166,19 +187,30 @@ class convCFG(Config):
     h = len_width(self.h, self.size, self.pad, self.stride)
     return (w, h, self.filters)
 
+  @property
+  def num_weights(self):
+    if self.batch_normalize == 1:
+      return self.filters * 4 + self.nweights
+    return self.filters + self.nweights
+
   def load_weights(self, files):
-    self.biases = read_n_floats(self.filters, files)
+    return self.assign_weights(read_n_floats(self.num_weights, files))
+
+  def assign_weights(self, data):
+    self.biases = data[:self.filters]
     bytes_read = self.filters
 
     if self.batch_normalize == 1:
-      self.scales = read_n_floats(self.filters, files)
-      self.rolling_mean = read_n_floats(self.filters, files)
-      self.rolling_variance = read_n_floats(self.filters, files)
+      self.scales = data[bytes_read:bytes_read + self.filters]
+      self.rolling_mean = data[bytes_read + self.filters:bytes_read +
+                               self.filters * 2]
+      self.rolling_variance = data[bytes_read + self.filters * 2:bytes_read +
+                                   self.filters * 3]
       bytes_read += self.filters * 3
 
     # used as a guide:
     # https://github.com/thtrieu/darkflow/blob/master/darkflow/dark/convolution.py
-    weights = read_n_floats(self.nweights, files)
+    weights = data[bytes_read:bytes_read + self.nweights]
     self.weights = weights.reshape(self.filters, self.c, self.size,
                                    self.size).transpose([2, 3, 1, 0])
     bytes_read += self.nweights
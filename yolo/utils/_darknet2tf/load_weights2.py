@@ -1,6 +1,9 @@
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
 from yolo.modeling.layers.nn_blocks import ConvBN, DarkRouteProcess, PathAggregationBlock, CSPRoute, CSPConnect, SAM
 from .config_classes import convCFG, samCFG
-import numpy as np
 
 
 def split_converter(lst, i, j=None):
@@ -9,47 +12,72 @@ def split_converter(lst, i, j=None):
   return lst.data[:i], lst.data[i:]
 
 
-def load_weight(cfg, layer):
+def get_assignments(cfg, layer, match_bn=True):
+  """pair the variables of a layer with the weights of a darknet layer
+
+  The variables are not read, so the pairs of all layers can be assigned at
+  once with assign_weights.
+
+  Args:
+    cfg: the darknet layer config holding the weights.
+    layer: the built keras layer.
+    match_bn: pad weights without batch norm to the variables of a layer
+      with batch norm.
+
+  Return:
+    a list of (variable, weights) tuples.
+
+  Raises:
+    ValueError: the weights do not match the variables of the layer.
+  """
   weights = cfg.get_weights()
-  if len(layer.get_weights()) == len(weights):
-    layer.set_weights(weights)
-  else:
+  variables = layer.weights
+  if match_bn and len(variables) != len(weights):
     # need to match the batch norm
     weights.append(np.zeros_like(weights[-2]))
     weights.append(np.zeros_like(weights[-2]))
     weights.append(np.zeros([]))
     weights.append(np.zeros([]))
-    layer.set_weights(weights)
+
+  if len(variables) != len(weights):
+    raise ValueError(f"{layer.name} has {len(variables)} weights, "
+                     f"{len(weights)} were given")
+  for variable, weight in zip(variables, weights):
+    if not variable.shape.is_compatible_with(weight.shape):
+      raise ValueError(f"{variable.name} has shape {variable.shape}, weights "
+                       f"of shape {weight.shape} were given")
+  return list(zip(variables, weights))
+
+
+def assign_weights(assignments):
+  """assign all (variable, weights) pairs in one batched pass"""
+  tf.keras.backend.batch_set_value(assignments)
+
+
+def load_weight(cfg, layer):
+  assign_weights(get_assignments(cfg, layer))
 
 
 def load_weights(convs, layers):
   # min_key = min(layers.keys())
   # max_key = max(layers.keys())
   keys = sorted(layers.keys())
-  #print (layers)
 
   unloaded = []
   unloaded_convs = []
+  assignments = []
   for i in keys:  # range(min_key, max_key + 1):
 
     try:
       cfg = convs.pop(0)
-      print(layers[i].name, cfg)
-      #print(cfg.c, cfg.filters, layers[i]._filters)
-      weights = cfg.get_weights()
-      if len(layers[i].get_weights()) == len(weights):
-        layers[i].set_weights(weights)
-      else:
-        # need to match the batch norm
-        weights.append(np.zeros_like(weights[-2]))
-        weights.append(np.zeros_like(weights[-2]))
-        weights.append(np.zeros([]))
-        weights.append(np.zeros([]))
-        layers[i].set_weights(weights)
+      logging.debug("%s %s", layers[i].name, cfg)
+      assignments.extend(get_assignments(cfg, layers[i]))
     except BaseException as e:
       unloaded_convs.append(cfg)
       unloaded.append(layers[i])
-      print(f"an error has occured, {layers[i].name}, {i}, {e}")
+      logging.warning("an error has occurred, %s, %d, %s", layers[i].name, i,
+                      e)
+  assign_weights(assignments)
   return unloaded, unloaded_convs
 
 
@@ -168,7 +196,7 @@ def load_weights_decoder(model, net, csp=False):
   if not csp:
     for layer in model.layers:
       # non sub module conv blocks
-      print(layer.name)
+      logging.debug(layer.name)
       if "input" not in layer.name and "fpn" in layer.name:
         load_weights_fpn(layer, net[0], csp=csp)
       elif "input" not in layer.name and "pan" in layer.name:
@@ -181,37 +209,37 @@ def load_weights_decoder(model, net, csp=False):
 def deconstruct_route_process(mod):
   if isinstance(mod, DarkRouteProcess):
     dark_convs = []
-    print(mod)
+    logging.debug(mod)
     for a in mod.layers:
       if isinstance(a, CSPRoute):
         for b in a.submodules:
           if isinstance(b, ConvBN):
             dark_convs.append(b)
-            print("rout conv")
+            logging.debug("rout conv")
       if isinstance(a, CSPConnect):
         for b in a.submodules:
           if isinstance(b, ConvBN):
             dark_convs.append(b)
-            print("connect conv")
+            logging.debug("connect conv")
       if isinstance(a, SAM):
         for b in a.submodules:
           if isinstance(b, ConvBN):
             dark_convs.append(b)
       if isinstance(a, ConvBN):
         dark_convs.append(a)
-        print("conv")
+        logging.debug("conv")
     return dark_convs
   return None
 
 
 def deconstruct_path_agg(mod):
   if isinstance(mod, PathAggregationBlock):
-    print(mod)
+    logging.debug(mod)
     path_convs = []
     for a in mod.submodules:
       if isinstance(a, ConvBN):
         path_convs.append(a)
-        print("path conv")
+        logging.debug("path conv")
     return path_convs
   return None
 
@@ -232,13 +260,14 @@ def load_csp(net, model, out_conv=255):
       else:
         cfg_heads.append(layer)
 
+  assignments = []
   for layer in model.layers:
     # if isinstance(mod, DarkRouteProcess):
     if "input" not in layer.name and "fpn" in layer.name:
       route_convs = []
       merges = []
       for mod in layer.submodules:
-        print(mod.name)
+        logging.debug(mod.name)
         dark_convs = deconstruct_route_process(mod)
         if dark_convs is not None:
           route_convs.append(dark_convs)
@@ -252,18 +281,19 @@ def load_csp(net, model, out_conv=255):
           blocks.extend(merges[i])
         except:
           pass
-      print(len(blocks), len(convs))
+      logging.debug("%d blocks, %d convs", len(blocks), len(convs))
 
       blocks = blocks[9:] + blocks[0:9]
       for layer in blocks:
         cfg = convs.pop(0)
-        load_weight(cfg, layer)
-        print(layer.name, layer._filters, layer._kernel_size, cfg)
+        assignments.extend(get_assignments(cfg, layer))
+        logging.debug("%s %s %s %s", layer.name, layer._filters,
+                      layer._kernel_size, cfg)
     if "input" not in layer.name and "pan" in layer.name:
       route_convs = []
       merges = []
       for mod in layer.submodules:
-        print(mod.name)
+        logging.debug(mod.name)
         dark_convs = deconstruct_route_process(mod)
         if dark_convs is not None:
           route_convs.append(dark_convs)
@@ -277,13 +307,15 @@ def load_csp(net, model, out_conv=255):
           blocks.extend(merges[i])
         except:
           pass
-      print(len(blocks), len(convs))
+      logging.debug("%d blocks, %d convs", len(blocks), len(convs))
 
       for layer in blocks:
         cfg = convs.pop(0)
-        load_weight(cfg, layer)
-        print(layer.name, layer._filters, layer._kernel_size, cfg)
+        assignments.extend(get_assignments(cfg, layer))
+        logging.debug("%s %s %s %s", layer.name, layer._filters,
+                      layer._kernel_size, cfg)
 
+  assign_weights(assignments)
   return cfg_heads
 
 
@@ -302,18 +334,23 @@ def load_weights_prediction_layers(convs, model):
   # print(convs)
   try:
     i = 0
+    assignments = []
     for sublayer in model.submodules:
       if ("conv_bn" in sublayer.name):
         # print(sublayer, convs[i])
-        sublayer.set_weights(convs[i].get_weights())
+        assignments.extend(
+            get_assignments(convs[i], sublayer, match_bn=False))
         i += 1
   except BaseException:
     i = len(convs) - 1
+    assignments = []
     for sublayer in model.submodules:
       if ("conv_bn" in sublayer.name):
         # print(sublayer, convs[i])
-        sublayer.set_weights(convs[i].get_weights())
+        assignments.extend(
+            get_assignments(convs[i], sublayer, match_bn=False))
         i -= 1
+  assign_weights(assignments)
   return
 
 
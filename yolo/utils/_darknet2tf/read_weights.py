@@ -1,6 +1,8 @@
 """
 This file contains the code to parse DarkNet weight files.
 """
+from absl import logging
+import numpy as np
 
 from .config_classes import *  # pylint: disable=wildcard-import, unused-wildcard-import
 from .dn2dicts import convertConfigFile
@@ -19,31 +21,33 @@ def build_layer(layer_dict, file, net):
   return layer, bytes_read
 
 
+def read_header(weights):
+  """read the version header of the weights file and return its size"""
+  major, minor, revision = read_n_int(3, weights)
+  bytes_read = 12
+
+  if ((major * 10 + minor) >= 2):
+    iseen = read_n_long(1, weights, unsigned=True)[0]
+    bytes_read += 8
+  else:
+    iseen = read_n_int(1, weights, unsigned=True)[0]
+    bytes_read += 4
+
+  logging.info('darknet weights version %d.%d.%d, %d images seen', major,
+               minor, revision, iseen)
+  return bytes_read
+
+
 def read_file(full_net, config, weights=None):
   """read the file and construct weights net list"""
   bytes_read = 0
 
   if weights is not None:
-    major, minor, revision = read_n_int(3, weights)
-    bytes_read += 12
-
-    if ((major * 10 + minor) >= 2):
-      print('64 seen')
-      iseen = read_n_long(1, weights, unsigned=True)[0]
-      bytes_read += 8
-    else:
-      print('32 seen')
-      iseen = read_n_int(1, weights, unsigned=True)[0]
-      bytes_read += 4
-
-    print(f"major: {major}")
-    print(f"minor: {minor}")
-    print(f"revision: {revision}")
-    print(f"iseen: {iseen}")
+    bytes_read += read_header(weights)
 
   for i, layer_dict in enumerate(config):
     try:
-      print(layer_dict)
+      logging.debug(layer_dict)
       layer, num_read = build_layer(layer_dict, weights, full_net)
     except Exception as e:
       raise ValueError(f"Cannot read weights for layer [#{i}]") from e
@@ -52,7 +56,60 @@ def read_file(full_net, config, weights=None):
   return bytes_read
 
 
-def read_weights(full_net, config_file, weights_file):
+def weight_offsets(full_net):
+  """offsets of the weights of each layer in the weights file, in floats
+
+  Args:
+    full_net: the list of layers, including [net].
+
+  Return:
+    an array of len(full_net.data) + 1 offsets, the weights of layer i are
+    between offsets i and i + 1 after the header.
+  """
+  sizes = [layer.num_weights for layer in full_net.data]
+  return np.cumsum([0] + sizes)
+
+
+def map_file(full_net, config, weights_file):
+  """build the layers and point their weights to a memory map of the file
+
+  The weights file is memory mapped once and each layer gets zero copy views
+  of its slice, found with the offset table of the layers, so no weight is
+  read before it is assigned to a variable.
+
+  Args:
+    full_net: the empty list of layers to construct.
+    config: the parsed DarkNet config file.
+    weights_file: path or open file with a file descriptor.
+
+  Return:
+    the number of bytes mapped, including the header.
+  """
+  read_file(full_net, config)
+  offsets = weight_offsets(full_net)
+  size = get_size(weights_file)
+
+  with open_if_not_open(weights_file, 'rb') as weights:
+    header_size = read_header(weights)
+    if header_size + offsets[-1] * 4 > size:
+      raise IOError(f'weights file of {size} bytes is too small for the '
+                    f'config, {header_size + offsets[-1] * 4} bytes expected')
+
+    # the map stays valid after the file is closed
+    data = np.memmap(
+        weights,
+        dtype='<f4',
+        mode='r',
+        offset=header_size,
+        shape=(offsets[-1],))
+
+  for i, layer in enumerate(full_net.data):
+    if offsets[i + 1] > offsets[i]:
+      layer.assign_weights(data[offsets[i]:offsets[i + 1]])
+  return header_size + int(offsets[-1]) * 4
+
+
+def read_weights(full_net, config_file, weights_file, use_mmap=True):
   if weights_file is None:
     with open_if_not_open(config_file) as config:
       config = convertConfigFile(config)
@@ -60,15 +117,18 @@ def read_weights(full_net, config_file, weights_file):
     return full_net
 
   size = get_size(weights_file)
-  with open_if_not_open(config_file) as config, \
-      open_if_not_open(weights_file, 'rb') as weights:
-    config = convertConfigFile(config)
-    bytes_read = read_file(full_net, config, weights)
-    print('full net: ')
-    for e in full_net:
-      print(f"{e.w} {e.h} {e.c}\t{e}")
-    print(
-        f"bytes_read: {bytes_read}, original_size: {size}, final_position: {weights.tell()}"
-    )
+  if use_mmap:
+    with open_if_not_open(config_file) as config:
+      config = convertConfigFile(config)
+    bytes_read = map_file(full_net, config, weights_file)
+  else:
+    with open_if_not_open(config_file) as config, \
+        open_if_not_open(weights_file, 'rb') as weights:
+      config = convertConfigFile(config)
+      bytes_read = read_file(full_net, config, weights)
+
+  for e in full_net:
+    logging.debug(f"{e.w} {e.h} {e.c}\t{e}")
+  logging.info('bytes_read: %d, original_size: %d', bytes_read, size)
   if (bytes_read != size):
     raise IOError('error reading weights file')
@@ -0,0 +1,95 @@
+import os
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from yolo.modeling.layers import nn_blocks
+from yolo.utils._darknet2tf import DarkNetConverter
+from yolo.utils._darknet2tf import load_weights2
+
+CONFIG = """[net]
+width=8
+height=8
+channels=3
+
+[convolutional]
+batch_normalize=1
+filters=4
+size=3
+stride=1
+pad=1
+activation=leaky
+
+[maxpool]
+size=2
+stride=2
+
+[convolutional]
+filters=2
+size=1
+stride=1
+pad=1
+activation=linear
+"""
+
+# biases, scales, means, variances and kernel, then biases and kernel
+NUM_WEIGHTS = 4 * 4 + 4 * 3 * 3 * 3 + 2 + 2 * 4
+
+
+def write_files(directory, num_weights=NUM_WEIGHTS):
+  config_file = os.path.join(directory, 'test.cfg')
+  with open(config_file, 'w') as config:
+    config.write(CONFIG)
+
+  weights = np.random.RandomState(1).normal(size=num_weights)
+  weights_file = os.path.join(directory, 'test.weights')
+  with open(weights_file, 'wb') as weights_:
+    np.array([0, 2, 5], '<i4').tofile(weights_)
+    np.array([64], '<u8').tofile(weights_)
+    weights.astype('<f4').tofile(weights_)
+  return config_file, weights_file
+
+
+class ReadWeightsTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters(False, True)
+  def testMappedMatchesStream(self, open_file):
+    config_file, weights_file = write_files(self.get_temp_dir())
+    if open_file:
+      weights_file = open(weights_file, 'rb')
+    mapped = DarkNetConverter.read(config_file, weights_file)
+    streamed = DarkNetConverter.read(
+        config_file, config_file[:-3] + 'weights', use_mmap=False)
+
+    self.assertLen(mapped, 3)
+    for mapped_layer, streamed_layer in zip(mapped, streamed):
+      mapped_weights = mapped_layer.get_weights()
+      streamed_weights = streamed_layer.get_weights()
+      self.assertLen(mapped_weights, len(streamed_weights))
+      for actual, expected in zip(mapped_weights, streamed_weights):
+        self.assertAllEqual(expected, actual)
+    self.assertIsInstance(mapped[0].weights.base, np.memmap)
+
+  def testTruncatedFile(self):
+    config_file, weights_file = write_files(self.get_temp_dir(),
+                                            NUM_WEIGHTS - 1)
+    with self.assertRaises(IOError):
+      DarkNetConverter.read(config_file, weights_file)
+
+  def testAssignWeights(self):
+    config_file, weights_file = write_files(self.get_temp_dir())
+    net = DarkNetConverter.read(config_file, weights_file)
+    layer = nn_blocks.ConvBN(filters=4, kernel_size=(3, 3), padding='same')
+    layer(tf.zeros([1, 8, 8, 3]))
+
+    load_weights2.assign_weights(load_weights2.get_assignments(net[0], layer))
+    for actual, expected in zip(layer.get_weights(), net[0].get_weights()):
+      self.assertAllEqual(expected, actual)
+
+    with self.assertRaises(ValueError):
+      load_weights2.get_assignments(net[2], layer)
+
+
+if __name__ == '__main__':
+  tf.test.main()
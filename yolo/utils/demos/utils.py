@@ -159,131 +159,306 @@ def int_scale_boxes(boxes, classes, width, height):
   return boxes, classes
 
 
-class DrawBoxes(object):
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_FONT_SCALE = 0.5
+# confidences are labeled with 3 decimals, one glyph per value is cached
+_CONF_STEPS = 1000
+
+
+def scale_boxes(boxes, width, height):
+  """numpy version of int_scale_boxes, returns the boxes as integer
+  [x0, x1, y0, y1] pixel coordinates"""
+  boxes = np.asarray(boxes, dtype=np.float32)
+  scale = np.array([width, width, height, height], np.float32)
+  return (boxes[..., [1, 3, 0, 2]] * scale).astype(np.int32)
+
+
+def _ranges(starts, lengths):
+  """concatenation of np.arange(start, start + length) for each pair"""
+  lengths = np.maximum(lengths, 0)
+  ends = np.cumsum(lengths)
+  return np.repeat(starts - ends + lengths, lengths) + np.arange(lengths.sum())
+
+
+def _pixel_view(array):
+  """1-d view of a contiguous array with one void item per pixel, gathers and
+  scatters of whole pixels are much faster on it than on rows"""
+  pixel = np.dtype((np.void, array.dtype.itemsize * array.shape[-1]))
+  return array.reshape([-1, array.shape[-1]]).view(pixel)[:, 0]
+
+
+def _disk(radius):
+  """(dy, dx) offsets of the pixels of a filled disk"""
+  size = int(np.ceil(radius))
+  dy, dx = np.mgrid[-size:size + 1, -size:size + 1]
+  inside = dy**2 + dx**2 <= radius**2
+  return dy[inside], dx[inside]
+
+
+def _render_text(text, thickness):
+  """(dy, dx) offsets of the lit pixels of the text from the bottom left
+  corner it is placed at, and the width of the text"""
+  (width, height), baseline = cv2.getTextSize(text, _FONT, _FONT_SCALE,
+                                              thickness)
+  pad = thickness + 1
+  canvas = np.zeros([height + baseline + 2 * pad, width + 2 * pad], np.uint8)
+  cv2.putText(canvas, text, (pad, height + pad), _FONT, _FONT_SCALE, 1,
+              thickness)
+  dy, dx = np.nonzero(canvas)
+  return dy - (height + pad), dx - pad, width - thickness
+
+
+class _GlyphTable(object):
+  """Pre-rendered shapes, the pixels of all the shapes are packed in one
+  array so the glyphs of many boxes can be gathered at once."""
+
+  def __init__(self, shapes, widths=None):
+    """
+    Args:
+      shapes: list of (dy, dx) pixel offsets of each glyph.
+      widths: the width of each glyph.
+    """
+    self.lengths = np.array([len(dy) for dy, _ in shapes], np.int64)
+    self.starts = np.cumsum(self.lengths) - self.lengths
+    self.widths = None if widths is None else np.array(widths, np.int64)
+    self.dy = np.concatenate([dy for dy, _ in shapes]).astype(np.int64)
+    self.dx = np.concatenate([dx for _, dx in shapes]).astype(np.int64)
+    self.extent = (self.dy.min(), self.dy.max(), self.dx.min(), self.dx.max())
+    self._offsets = {}
+
+  @classmethod
+  def from_texts(cls, texts, thickness):
+    glyphs = [_render_text(text, thickness) for text in texts]
+    return cls([glyph[:2] for glyph in glyphs], [glyph[2] for glyph in glyphs])
+
+  def offsets(self, width):
+    """offsets of the pixels in a flattened image of the given width"""
+    if width not in self._offsets:
+      self._offsets[width] = self.dy * width + self.dx
+    return self._offsets[width]
+
+  def gather(self, ids):
+    """Returns the indices of the pixels of the glyphs ids in the table, and
+    the index into ids each pixel belongs to."""
+    lengths = self.lengths[ids]
+    return _ranges(self.starts[ids], lengths), np.repeat(
+        np.arange(len(ids)), lengths)
 
-  def __init__(self, classes=80, labels=None, display_names=True, thickness=2):
 
+class DrawBoxes(object):
+  """Draws detected boxes, and optionally their labels, on images.
+
+  Padded and zero area boxes are dropped with a mask before anything is
+  drawn. The top and bottom sides of the boxes are written as slices, the
+  pixels of the other sides, the center points and the labels of a frame are
+  computed with numpy and written with a few scatters. The labels are
+  gathered from glyphs pre-rendered per class and per confidence value.
+  Integer images are drawn with the colors scaled to [0, 255].
+  """
+
+  def __init__(self,
+               classes=80,
+               labels=None,
+               display_names=True,
+               thickness=2,
+               num_threads=None):
+    """
+    Args:
+      classes: number of classes, boxes with other classes are skipped.
+      labels: the name of each class.
+      display_names: write the class name and confidence above each box.
+      thickness: line thickness.
+      num_threads: if more than 1, the frames of a batch are drawn on a pool
+        of this many threads.
+    """
     self._classes = classes
     self._colors = gen_colors(classes)
     self._labels = labels
-    self._display_names = display_names
+    self._display_names = display_names and labels is not None
     self._thickness = thickness
-    self._draw_fn = self._get_draw_fn(self._colors, self._labels,
-                                      self._display_names)
+    self._color_tables = {}
+
+    if self._display_names:
+      self._class_glyphs = _GlyphTable.from_texts(
+          ["%s, " % labels[i] for i in range(classes)], thickness)
+      self._conf_glyphs = _GlyphTable.from_texts(
+          ["%0.3f" % (i / _CONF_STEPS) for i in range(_CONF_STEPS + 1)],
+          thickness)
+      self._rect_thickness = thickness
+      self._dot = _GlyphTable([_disk(thickness * 1.5 - 0.5)])
+    else:
+      self._rect_thickness = 1
+      self._dot = _GlyphTable([_disk(thickness / 2)])
+
+    self._pool = None
+    if num_threads is not None and num_threads > 1:
+      self._pool = pooler(num_threads)
     return
 
-  def _get_draw_fn(self, colors, label_names, display_name):
-
-    def draw_box_name(image, box, classes, conf):
-      if box[1] - box[0] == 0 or box[3] - box[2] == 0:
-        return False
-      cv2.rectangle(image, (box[0], box[2]), (box[1], box[3]), colors[classes],
-                    self._thickness)
-      x = (box[1] + box[0]) // 2
-      y = (box[3] + box[2]) // 2
-
-      cv2.circle(
-          image, (x, y),
-          radius=0,
-          color=colors[classes],
-          thickness=self._thickness * 3)
-      if conf is not None:
-        cv2.putText(image, "%s, %0.3f" % (label_names[classes], conf),
-                    (box[0], box[2] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                    colors[classes], self._thickness)
-      else:
-        cv2.putText(image, "%s, %0.3f" % (label_names[classes]),
-                    (box[0], box[2] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                    colors[classes], self._thickness)
-      return True
-
-    def draw_box(image, box, classes, conf):
-      if box[1] - box[0] == 0 or box[3] - box[2] == 0:
-        return False
-      cv2.rectangle(image, (box[0], box[2]), (box[1], box[3]), colors[classes],
-                    1)
-      cv2.circle(
-          image, (box[0], box[2]),
-          radius=0,
-          color=colors[classes],
-          thickness=self._thickness)
-      return True
-
-    if display_name and label_names is not None:
-      return draw_box_name
-    else:
-      return draw_box
+  def _color_table(self, dtype):
+    if dtype not in self._color_tables:
+      colors = np.array(self._colors, np.float64)
+      if np.issubdtype(dtype, np.integer):
+        colors = np.round(colors * 255)
+      self._color_tables[dtype] = colors.astype(dtype)
+    return self._color_tables[dtype]
+
+  def _outline(self, image, boxes, colors):
+    """draws the outlines of the boxes, the top and bottom sides are slices
+    of the image and the left and right sides are written with one scatter"""
+    height, width = image.shape[:2]
+    # like cv2, thick lines spread (thickness + 1) // 2 pixels to each side
+    thickness = self._rect_thickness
+    before = (thickness + 1) // 2 if thickness > 1 else 0
+    after = before + 1
+
+    x0, x1, y0, y1 = boxes.T
+    left = np.clip(x0 - before, 0, width)
+    right = np.clip(x1 + after, 0, width)
+    top = np.clip(y0 - before, 0, height)
+    bottom = np.clip(y1 + after, 0, height)
+    rows = zip(top.tolist(),
+               np.clip(y0 + after, 0, height).tolist(),
+               np.clip(y1 - before, 0, height).tolist(), bottom.tolist(),
+               left.tolist(), right.tolist(), colors)
+    for start, end, low, high, first, last, color in rows:
+      image[start:end, first:last] = color
+      image[low:high, first:last] = color
+
+    spread = np.arange(-before, after)
+    columns = np.concatenate(
+        [x0[:, None] + spread, x1[:, None] + spread], axis=1).ravel()
+    owner = np.repeat(np.arange(boxes.shape[0]), 2 * len(spread))
+    keep = (columns >= 0) & (columns < width) & (bottom > top)[owner]
+    columns, owner = columns[keep], owner[keep]
+    if owner.size:
+      lengths = (bottom - top)[owner]
+      index = np.repeat(top[owner] * width + columns, lengths)
+      index += _ranges(np.zeros_like(lengths), lengths) * width
+      np.put(
+          _pixel_view(image), index,
+          np.repeat(_pixel_view(colors)[owner], lengths))
+
+  def _stamp(self, image, ys, xs, glyphs, ids, colors):
+    """writes glyph ids[i] at ys[i], xs[i] in colors[i] with one scatter"""
+    height, width = image.shape[:2]
+    pixels = _pixel_view(image)
+    colors = _pixel_view(colors)
+    top, bottom, left, right = glyphs.extent
+    inside = ((ys + top >= 0) & (ys + bottom < height) & (xs + left >= 0) &
+              (xs + right < width))
+
+    index, owner = glyphs.gather(ids[inside])
+    origin = ys[inside] * width + xs[inside]
+    np.put(pixels, origin[owner] + glyphs.offsets(width)[index],
+           colors[inside][owner])
+
+    if not np.all(inside):
+      # the glyphs partly outside of the image are clipped pixel by pixel
+      outside = ~inside
+      index, owner = glyphs.gather(ids[outside])
+      y = ys[outside][owner] + glyphs.dy[index]
+      x = xs[outside][owner] + glyphs.dx[index]
+      visible = (y >= 0) & (y < height) & (x >= 0) & (x < width)
+      np.put(pixels, y[visible] * width + x[visible],
+             colors[outside][owner[visible]])
 
   def _draw(self, image, boxes, classes, conf):
-    i = 0
-    for i in range(boxes.shape[0]):
-      if self._draw_fn(image, boxes[i], classes[i], conf[i]):
-        i += 1
-      # else:
-      #   return image
+    """draws the boxes of one frame into the image, in place"""
+    if not image.flags.c_contiguous:
+      buffer = np.ascontiguousarray(image)
+      image[...] = self._draw(buffer, boxes, classes, conf)
+      return image
+
+    height, width = image.shape[:2]
+    classes = np.asarray(classes).astype(np.int64)
+    valid = ((boxes[:, 1] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 2]) &
+             (classes >= 0) & (classes < self._classes))
+    if not np.any(valid):
+      return image
+    boxes = boxes[valid].astype(np.int64)
+    classes = classes[valid]
+    colors = self._color_table(image.dtype)[classes]
+
+    self._outline(image, boxes, colors)
+
+    if self._display_names:
+      cy = (boxes[:, 3] + boxes[:, 2]) // 2
+      cx = (boxes[:, 1] + boxes[:, 0]) // 2
+    else:
+      cy, cx = boxes[:, 2], boxes[:, 0]
+    self._stamp(image, cy, cx, self._dot, np.zeros_like(classes), colors)
+
+    if self._display_names:
+      # the label is written from 10 pixels above the top left corner
+      base_y = boxes[:, 2] - 10
+      base_x = boxes[:, 0]
+      self._stamp(image, base_y, base_x, self._class_glyphs, classes, colors)
+      if conf is not None:
+        conf = np.asarray(conf, np.float64)[valid]
+        steps = np.clip(np.round(conf * _CONF_STEPS), 0,
+                        _CONF_STEPS).astype(np.int64)
+        base_x = base_x + self._class_glyphs.widths[classes]
+        self._stamp(image, base_y, base_x, self._conf_glyphs, steps, colors)
     return image
 
-  def _parent(self, image, boxes, classes, conf):
-
-    def func(i):
-      return self._draw(image[i], boxes[i], classes[i], conf[i])
-
-    return func
-
-  def __call__(self, image, results):
-    """ expectoed format = {bbox: , classes: , "confidence": }"""
-
+  def __call__(self, image, results, out=None):
+    """Draws the results on an image or a batch of images.
+
+    Args:
+      image: an image, a batch of images or a list of images, as numpy
+        arrays or tensors.
+      results: dict with the normalized `bbox` (ymin, xmin, ymax, xmax),
+        the `classes` and optionally the `confidence` of the detections.
+      out: optional preallocated array to draw into, of the shape of the
+        image or of the stacked batch. By default numpy images are drawn on
+        in place.
+
+    Return:
+      the image, or the batch of images, with the boxes drawn on them.
+    """
     boxes = results["bbox"]
     classes = results["classes"]
+    conf = results.get("confidence", None)
 
-    try:
-      conf = results["confidence"]
-    except:
-      conf = results["classes"]
-
-    if not isinstance(image, list):
-      ndims = len(image.shape)
-      if ndims == 4:
-        boxes, classes = int_scale_boxes(boxes, classes, image.shape[2],
-                                         image.shape[1])
-      elif ndims == 3:
-        boxes, classes = int_scale_boxes(boxes, classes, image.shape[1],
-                                         image.shape[0])
-    else:
-      img = image[0]
-      boxes, classes = int_scale_boxes(boxes, classes, img.shape[1],
-                                       img.shape[0])
-
-    if hasattr(image, "numpy"):
-      image = image.numpy()
     if hasattr(boxes, "numpy"):
       boxes = boxes.numpy()
     if hasattr(classes, "numpy"):
       classes = classes.numpy()
-    if not isinstance(conf, type(None)) and hasattr(conf, "numpy"):
+    if conf is not None and hasattr(conf, "numpy"):
       conf = conf.numpy()
 
-    if not isinstance(image, list):
-
-      if ndims == 4:
-        images = []
-        func = self._parent(image, boxes, classes, conf)
-        #images = tf.map_fn(func, elems = tf.range(image.shape[0]), parallel_iterations=10)
-        for i in range(image.shape[0]):
-          im = func(i)
-          images.append(im)
-        image = np.stack(images, axis=0)
-      elif ndims == 3:
-        if len(boxes.shape) == 2:
-          self._draw(image, boxes, classes, conf)
-        else:
-          self._draw(image, boxes[0], classes[0], conf[0])
+    if isinstance(image, list):
+      images = [im.numpy() if hasattr(im, "numpy") else im for im in image]
+      if out is None:
+        out = np.empty([len(images), *images[0].shape], images[0].dtype)
+      for i, im in enumerate(images):
+        out[i] = im
     else:
-      images = []
-      for i, im in enumerate(image):
-        if hasattr(im, "numpy"):
-          im = im.numpy()
-        self._draw(im, boxes[i], classes[i], conf[i])
-        images.append(im)
-      image = np.stack(images, axis=0)
-    return image
+      if hasattr(image, "numpy"):
+        image = image.numpy()
+      if out is None:
+        out = image
+      elif out is not image:
+        out[...] = image
+
+    if len(out.shape) == 3:
+      boxes = scale_boxes(boxes, out.shape[1], out.shape[0])
+      if len(boxes.shape) == 3:
+        boxes, classes = boxes[0], classes[0]
+        conf = None if conf is None else conf[0]
+      self._draw(out, boxes, classes, conf)
+      return out
+
+    boxes = scale_boxes(boxes, out.shape[2], out.shape[1])
+
+    def draw(i):
+      frame_conf = None if conf is None else conf[i]
+      self._draw(out[i], boxes[i], classes[i], frame_conf)
+
+    if self._pool is not None:
+      list(self._pool.map(draw, range(out.shape[0])))
+    else:
+      for i in range(out.shape[0]):
+        draw(i)
+    return out
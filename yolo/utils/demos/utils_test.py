@@ -0,0 +1,92 @@
+from absl.testing import parameterized
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from yolo.utils.demos import coco
+from yolo.utils.demos import utils
+
+
+def random_results(num_boxes, num_padded=0, batch_size=1, seed=0):
+  rng = np.random.RandomState(seed)
+  yx = rng.uniform(-0.1, 0.9, [batch_size, num_boxes, 2])
+  hw = rng.uniform(0.02, 0.3, [batch_size, num_boxes, 2])
+  bbox = np.concatenate([yx, yx + hw], axis=-1).astype(np.float32)
+  if num_padded:
+    bbox[:, -num_padded:] = 0
+  return {
+      'bbox': bbox,
+      'classes': rng.randint(0, 80, [batch_size, num_boxes]),
+      'confidence': rng.uniform(size=[batch_size, num_boxes]),
+  }
+
+
+def reference_draw(image, results, thickness):
+  """draws the boxes without labels one by one with cv2"""
+  height, width = image.shape[:2]
+  boxes = utils.scale_boxes(results['bbox'][0], width, height)
+  for box in boxes.tolist():
+    if box[1] > box[0] and box[3] > box[2]:
+      cv2.rectangle(image, (box[0], box[2]), (box[1], box[3]), 1.0, 1)
+      cv2.circle(
+          image, (box[0], box[2]), radius=0, color=1.0, thickness=thickness)
+  return image
+
+
+class DrawBoxesTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.parameters(1, 2, 3)
+  def test_matches_cv2(self, thickness):
+    drawer = utils.DrawBoxes(display_names=False, thickness=thickness)
+    results = random_results(40, num_padded=5)
+    image = drawer(np.zeros([240, 320, 3], np.float32), results)
+    expected = reference_draw(np.zeros([240, 320], np.float32), results,
+                              thickness)
+
+    drawn = image.any(axis=-1)
+    expected = expected > 0
+    iou = np.sum(drawn & expected) / np.sum(drawn | expected)
+    self.assertGreater(iou, 0.99)
+
+  def test_labels(self):
+    labels = coco.get_coco_names()
+    results = random_results(20)
+    labeled = utils.DrawBoxes(labels=labels)(
+        np.zeros([240, 320, 3], np.float32), results)
+    unlabeled = utils.DrawBoxes(labels=labels, display_names=False)(
+        np.zeros([240, 320, 3], np.float32), results)
+    self.assertGreater(np.sum(labeled.any(-1)), np.sum(unlabeled.any(-1)))
+
+  def test_padded_boxes(self):
+    drawer = utils.DrawBoxes(labels=coco.get_coco_names())
+    results = random_results(10, num_padded=10)
+    image = drawer(np.zeros([120, 160, 3], np.uint8), results)
+    self.assertAllEqual(image, np.zeros([120, 160, 3], np.uint8))
+
+  def test_integer_colors(self):
+    drawer = utils.DrawBoxes(labels=coco.get_coco_names())
+    image = drawer(np.zeros([120, 160, 3], np.uint8), random_results(5))
+    self.assertEqual(image.max(), 255)
+
+  @parameterized.parameters(None, 3)
+  def test_batch(self, num_threads):
+    drawer = utils.DrawBoxes(
+        labels=coco.get_coco_names(), num_threads=num_threads)
+    results = random_results(10, num_padded=2, batch_size=4)
+    images = np.random.uniform(size=[4, 120, 160, 3]).astype(np.float32)
+
+    out = np.empty_like(images)
+    batch = drawer(images, results, out=out)
+    self.assertIs(batch, out)
+    self.assertNotAllClose(batch, images)
+
+    frames = drawer(list(images), results)
+    self.assertAllEqual(batch, frames)
+    for i in range(4):
+      frame = drawer(images[i].copy(),
+                     {key: value[i] for key, value in results.items()})
+      self.assertAllEqual(batch[i], frame)
+
+
+if __name__ == '__main__':
+  tf.test.main()
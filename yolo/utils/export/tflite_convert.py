@@ -3,6 +3,7 @@ import tensorflow as tf
 from yolo.utils.run_utils import prep_gpu
 from yolo.configs import yolo as exp_cfg
 from yolo.tasks.yolo import YoloTask
+from yolo.modeling.yolo_model import fuse_for_inference
 from skimage import io
 import cv2
 
@@ -202,6 +203,7 @@ def uniary_convert():
     task.initialize(model)
     #model.build((1, 416, 416, 3))
     model(tf.ones((1, 416, 416, 3), dtype=tf.float32), training=False)
+    model = fuse_for_inference(model)
 
     image = url_to_image(
         'https://raw.githubusercontent.com/zhreshold/mxnet-ssd/master/data/demo/dog.jpg'
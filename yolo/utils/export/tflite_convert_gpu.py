@@ -2,6 +2,7 @@ import tensorflow as tf
 from yolo.utils.run_utils import prep_gpu
 from yolo.configs import yolo as exp_cfg
 from yolo.tasks.yolo import YoloTask
+from yolo.modeling.yolo_model import fuse_for_inference
 from skimage import io
 import cv2
 
@@ -115,6 +116,7 @@ def get_model(model, input_size=[416, 416, 3], training=True):
     model = task.build_model()
     task.initialize(model)
     model(tf.ones((1, *input_size), dtype=tf.float32), training=False)
+    model = fuse_for_inference(model)
     return model, name
 
 